@@ -9,17 +9,202 @@ import matplotlib.pyplot as plt
 import os 
 from astropy.io import fits
 import numpy as np 
-#for cosmic ray
-"""from pathlib import Path
-from astropy.nddata import CCDData
-from astropy.nddata import block_replicate
-from astropy import units as u
-import ccdproc as ccdp
-from photutils.segmentation import detect_sources 
-from convenience_functions import show_image, display_cosmic_rays"""
+import datetime
+import inspect
+import json
+from collections import OrderedDict
+
+from Spectrometer_Cube import SpectrumCube
+from Spectrometer_IO import SPECTRUM_WRITERS, AsyncImageWriter, FitsSeriesWriter, calibration_id, write_fits, write_spectrum
+from Spectrometer_Processing import (DarkFrameLibrary, SpectrumAccumulator, estimate_profile, extract_tracks,
+                                     optimal_extract, remove_baseline, remove_cosmic_rays)
+from Spectrometer_Peaks import PeakTracker
+from Spectrometer_Scan import order_windows, plan_windows, raman_to_wavelength, run_scan, stitch_windows
+
+class FrameRingBuffer:
+    """
+    Preallocated ring of camera frames tagged with their frame indices.
+
+    The producer pushes batches read from the SDK buffer; a consumer takes every
+    frame it has not seen yet with `read_new`. Frames overwritten before the
+    consumer got to them are counted in `overrun`.
+    """
+    def __init__(self, capacity, frame_shape, dtype=np.int32):
+        self.capacity = int(capacity)
+        self.frames = np.zeros((self.capacity,) + tuple(frame_shape), dtype=dtype)
+        self.indices = np.full(self.capacity, -1, dtype=np.int64)
+        self.timestamps = np.zeros(self.capacity)
+        self.written = 0
+        self.consumed = 0
+        self.overrun = 0
+        self._lock = threading.Lock()
+
+    def push(self, frames, indices, timestamps):
+        n = len(indices)
+        keep = min(n, self.capacity)
+        with self._lock:
+            pos = (self.written + n - keep + np.arange(keep)) % self.capacity
+            self.frames[pos] = np.asarray(frames)[n - keep:]
+            self.indices[pos] = np.asarray(indices)[n - keep:]
+            self.timestamps[pos] = np.asarray(timestamps)[n - keep:]
+            self.written += n
+
+    def read_new(self, max_frames=None):
+        "Return (indices, timestamps, frames) copies of the frames not read yet, oldest first, at most `max_frames`"
+        with self._lock:
+            available = self.written - self.consumed
+            if available > self.capacity:
+                self.overrun += available - self.capacity
+                self.consumed = self.written - self.capacity
+                available = self.capacity
+            if max_frames is not None:
+                available = min(available, max_frames)
+            pos = (self.consumed + np.arange(available)) % self.capacity
+            self.consumed += available
+            return self.indices[pos], self.timestamps[pos], self.frames[pos]
+
+    def latest(self):
+        "Return (index, timestamp, frame) of the newest frame, or None if empty"
+        with self._lock:
+            if not self.written:
+                return None
+            pos = (self.written - 1) % self.capacity
+            return int(self.indices[pos]), self.timestamps[pos], self.frames[pos].copy()
+
+    def __len__(self):
+        return min(self.written, self.capacity)
+
+
+class TemperatureHistory:
+    """
+    Fixed-size, array-backed history of CCD temperature, temperature status, cooler and fan state.
+
+    Samples closer than `min_interval` seconds to the previous one are skipped. The
+    defaults (2**18 samples, 5 s spacing) cover about 15 days in under 4 MB; older
+    samples are overwritten.
+    """
+    STATUSES = ["off", "not_reached", "not_stabilized", "stabilized", "drifted"]
+    FAN_MODES = ["full", "low", "off"]
+
+    def __init__(self, capacity=2**18, min_interval=5.0):
+        self.capacity = int(capacity)
+        self.min_interval = min_interval
+        self.time = np.zeros(self.capacity)
+        self.temperature = np.zeros(self.capacity, dtype=np.float32)
+        self.status = np.zeros(self.capacity, dtype=np.int8)
+        self.cooler = np.zeros(self.capacity, dtype=np.int8)
+        self.fan = np.zeros(self.capacity, dtype=np.int8)
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def _code(self, names, value):
+        return names.index(value) if value in names else -1
+
+    def record(self, temperature, status, cooler, fan, timestamp=None):
+        "Store one sample; return False if it was too close to the previous one"
+        timestamp = time.time() if timestamp is None else timestamp
+        with self._lock:
+            if self.count and timestamp - self.time[(self.count - 1) % self.capacity] < self.min_interval:
+                return False
+            pos = self.count % self.capacity
+            self.time[pos] = timestamp
+            self.temperature[pos] = temperature
+            self.status[pos] = self._code(self.STATUSES, status)
+            self.cooler[pos] = bool(cooler)
+            self.fan[pos] = self._code(self.FAN_MODES, fan)
+            self.count += 1
+        return True
+
+    def _window(self, start, end):
+        "Chronological copies of the samples with start <= time < end"
+        with self._lock:
+            n = min(self.count, self.capacity)
+            split = self.count % self.capacity if self.count > self.capacity else 0
+            segments = [(split, n), (0, split)] if split else [(0, n)]
+            parts = []
+            for lo, hi in segments:
+                t = self.time[lo:hi]
+                a, b = lo + np.searchsorted(t, start), lo + np.searchsorted(t, end)
+                parts.append((a, b))
+            cols = (self.time, self.temperature, self.status, self.cooler, self.fan)
+            return [np.concatenate([col[a:b] for a, b in parts]) for col in cols]
+
+    def query(self, start=None, end=None, bins=500):
+        """
+        Downsample [start, end) into `bins` equal time bins.
+
+        Return a dict of per-bin arrays: bin start times, sample count, temperature
+        min/max/mean (NaN for empty bins), last temperature status and fan codes
+        (-1 for empty bins; see STATUSES/FAN_MODES) and the fraction of samples with
+        the cooler on.
+        """
+        end = time.time() if end is None else end
+        if start is None:
+            start = self.time[0] if self.count <= self.capacity else self.time[self.count % self.capacity]
+        t, temp, status, cooler, fan = self._window(start, end)
+        edges = np.linspace(start, end, bins + 1)
+        bounds = np.searchsorted(t, edges)
+        counts = np.diff(bounds)
+        filled = counts > 0
+        # the filled bins tile the window, so each reduceat segment is exactly one bin
+        starts = bounds[:-1][filled]
+        last = np.maximum(bounds[1:] - 1, 0)
+
+        def reduce(ufunc, values):
+            out = np.full(bins, np.nan)
+            if len(starts):
+                out[filled] = ufunc.reduceat(values.astype(float), starts)
+            return out
+
+        def last_code(values):
+            out = np.full(bins, -1, dtype=np.int8)
+            if len(values):
+                out[filled] = values[last[filled]]
+            return out
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return {
+                "time": edges[:-1],
+                "count": counts,
+                "temperature_min": reduce(np.minimum, temp),
+                "temperature_max": reduce(np.maximum, temp),
+                "temperature_mean": reduce(np.add, temp) / counts,
+                "cooler_fraction": reduce(np.add, cooler) / counts,
+                "status": last_code(status),
+                "fan": last_code(fan),
+            }
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
 
 class AndorCameraController:
-    def __init__(self):
+    # apply_settings parameters -> SDK setter, in the order they are written: readout
+    # geometry, read mode, vertical shift speed, exposure (cycle times are computed
+    # from it), mode timings, acquisition mode, trigger and frame format
+    SETTINGS_WRITERS = {
+        "roi": "set_roi",
+        "single_track": "setup_single_track_mode",
+        "multi_track": "setup_multi_track_mode",
+        "read_mode": "set_read_mode",
+        "vsspeed": "set_vsspeed",
+        "exposure": "set_exposure",
+        "accum": "setup_accum_mode",
+        "kinetic": "setup_kinetic_mode",
+        "cont": "setup_cont_mode",
+        "acquisition_mode": "set_acquisition_mode",
+        "trigger_mode": "set_trigger_mode",
+        "frame_format": "set_frame_format",
+    }
+    # Setting a geometry also switches the SDK read mode
+    GEOMETRY_SETTINGS = ["roi", "single_track", "multi_track"]
+    # Setting mode timings also switches the SDK acquisition mode
+    MODE_SETTINGS = {"accum": "accum", "kinetic": "kinetic", "cont": "cont"}
+
+    def __init__(self, camera_factory=None):
+        # camera_factory builds the SDK camera object on connect (real iDus by default,
+        # or e.g. Spectrometer_Sim.SimulatedAndorCamera for hardware-free runs)
+        self.camera_factory = camera_factory or Andor.AndorSDK2Camera
         self.cam = None
         self.connected = False
 
@@ -36,12 +221,34 @@ class AndorCameraController:
 
         self._lock = threading.Lock()
 
+        # Last value written to the SDK for each entry of SETTINGS_WRITERS;
+        # cleared on connect, missing entries are always written
+        self._device = {}
+
+        # Streaming (continuous) acquisition state
+        self.stream = None
+        self.streaming = False
+        self._stream_t0 = 0.0
+        self._stream_period = 0.0
+        self._stream_last_index = -1
+        self._stream_dropped = 0
+
+        # Background FITS writer (created on first async save)
+        self.writer = None
+        self.series_writer = None
+        self._image_counter = 0
+
+        self.fan_mode = None
+        self.temperature_history = TemperatureHistory()
+
     # Connection control
     def connect(self):
         "Open camera connection"
         if not self.connected:
-            self.cam = Andor.AndorSDK2Camera()
+            self.cam = self.camera_factory()
+            self._device = {}
             self.cam.set_fan_mode("low")
+            self.fan_mode = "low"
             self.connected = True
 
     def disconnect(self):
@@ -57,6 +264,7 @@ class AndorCameraController:
     def set_cooler(self, on=True):
         if on:
             self.cam.set_fan_mode("full")
+            self.fan_mode = "full"
         self.cam.set_cooler(on)
         self.cooler_enabled = on
     
@@ -71,29 +279,106 @@ class AndorCameraController:
     def get_temperature(self):
         return self.cam.get_temperature()
     
-    def update_fan_auto(self, threshold=10):
-        print("cooler:", self.cooler_enabled, self.temperature_setpoint)
+    def record_temperature(self, temperature=None, status=None, cooler=None, timestamp=None):
+        """Add a sample to temperature_history; missing values are read from the camera"""
+        temperature = self.get_temperature() if temperature is None else temperature
+        status = self.get_temp_status() if status is None else status
+        cooler = self.cooler_enabled if cooler is None else cooler
+        return self.temperature_history.record(temperature, status, cooler, self.fan_mode, timestamp)
+
+    def update_fan_auto(self, threshold=10, current_temp=None):
+        """Full fan near the setpoint, low otherwise; the SDK is only called when the mode changes"""
         if not self.cooler_enabled or self.temperature_setpoint is None:
             return
-        current_temp = self.get_temperature()
+        if current_temp is None:
+            current_temp = self.get_temperature()
         set_temp = self.temperature_setpoint
-        if abs(current_temp - set_temp) < threshold:
-            self.cam.set_fan_mode("full")
-        else:
-            self.cam.set_fan_mode("low")
+        mode = "full" if abs(current_temp - set_temp) < threshold else "low"
+        if mode != self.fan_mode:
+            self.cam.set_fan_mode(mode)
+            self.fan_mode = mode
+
+    # Settings transactions
+    def _apply(self, settings):
+        "Write the settings that differ from the device state; caller holds self._lock"
+        unknown = set(settings) - set(self.SETTINGS_WRITERS)
+        if unknown:
+            raise ValueError(f"Unknown camera settings: {sorted(unknown)}")
+        modes = {self.MODE_SETTINGS[name] for name in settings if name in self.MODE_SETTINGS}
+        if "acquisition_mode" in settings:
+            modes.add(settings["acquisition_mode"])
+        if len(modes) > 1:
+            raise ValueError(f"Conflicting acquisition modes in one transaction: {sorted(modes)}")
+        changed = []
+        for name, method in self.SETTINGS_WRITERS.items():
+            if name not in settings:
+                continue
+            value = settings[name]
+            value = tuple(value) if isinstance(value, list) else value
+            mode = self.MODE_SETTINGS.get(name)
+            if (name in self._device and self._device[name] == value
+                    and (mode is None or self._device.get("acquisition_mode") == mode)):
+                continue
+            setter = getattr(self.cam, method)
+            if isinstance(value, dict):
+                setter(**value)
+            elif isinstance(value, tuple):
+                setter(*value)
+            else:
+                setter(value)
+            if name in self.GEOMETRY_SETTINGS:
+                self._device.pop("read_mode", None)
+            self._device[name] = value
+            self._mirror(name, value)
+            if mode is not None:
+                self._device["acquisition_mode"] = mode
+                self._mirror("acquisition_mode", mode)
+            changed.append(name)
+        return changed
+
+    def _mirror(self, name, value):
+        if name == "exposure":
+            self.exposure = value
+        elif name == "acquisition_mode":
+            self.acquisition_mode = value
+        elif name == "trigger_mode":
+            self.trigger_mode = value
+        elif name == "roi":
+            self.hbin = value.get("hbin", 1)
+            self.vbin = value.get("vbin", 1)
+        elif name == "kinetic":
+            self.kinetics_frame = value[0]
+
+    def apply_settings(self, **settings):
+        """
+        Apply camera settings (see SETTINGS_WRITERS) in one locked transaction.
+
+        Only values that differ from what was last written are sent, in dependency
+        order. Tuple values are passed as positional arguments, dicts as keywords.
+        Return the names of the settings that were written.
+        """
+        with self._lock:
+            return self._apply(settings)
+
+    def _forget_acquisition_mode(self):
+        "snap and stream start/stop leave the SDK in a mode we did not write; caller holds self._lock"
+        for name in list(self.MODE_SETTINGS) + ["acquisition_mode"]:
+            self._device.pop(name, None)
+
+    def invalidate_settings(self):
+        "Forget the device state, e.g. after changing the camera outside this controller"
+        with self._lock:
+            self._device = {}
+
+    def settings_state(self):
+        with self._lock:
+            return dict(self._device)
 
     # Readout / ROI
     def set_roi(self, hbin=1, vbin=1,
                 hstart=0, hend=None,
                 vstart=0, vend=None):
-        with self._lock:
-            self.cam.set_roi(
-                hstart=hstart, hend=hend,
-                vstart=vstart, vend=vend,
-                hbin=hbin, vbin=vbin
-            )
-            self.hbin = hbin
-            self.vbin = vbin
+        self.apply_settings(roi=dict(hstart=hstart, hend=hend, vstart=vstart, vend=vend, hbin=hbin, vbin=vbin))
     
     def get_fan_mode(self):
         return self.cam.get_fan_mode()
@@ -103,6 +388,7 @@ class AndorCameraController:
             raise ValueError("Fan must must be 'full', 'low', or 'off'")
         with self._lock:
             self.cam.set_fan_mode(mode)
+            self.fan_mode = mode
     
     def get_readout_mode(self):
         return self.cam.get_read_mode()
@@ -110,37 +396,35 @@ class AndorCameraController:
     def set_readout_mode(self, mode):
         if mode not in ["fvb", "single_track", "multi_track", "image", "cont"]:
             raise ValueError("Incorrect readout mode")
-        with self._lock:
-            self.cam.set_read_mode(mode)
+        self.apply_settings(read_mode=mode)
         
     def setup_single_mode(self, center=0, width=1):
-        self.cam.setup_single_track_mode(center, width)
+        self.apply_settings(single_track=(center, width))
     
     def get_single_mode_parameters(self):
         return self.cam.get_single_track_mode_parameters()
     
     def setup_multi_mode(self, number=1, height=1, offset=0):
-        self.cam.setup_multi_track_mode(number, height, offset)
+        self.apply_settings(multi_track=(number, height, offset))
     
     def get_multi_mode_parameters(self):
         return self.cam.get_multi_track_mode_parameters()
     
     def setup_image_mode(self, hstart=0, hend=None, vstart=0, vend=None, hbin=1, vbin=1):
-        self.cam.setup_image_mode(hstart, hend, vstart, vend, hbin, vbin)
+        self.apply_settings(roi=dict(hstart=hstart, hend=hend, vstart=vstart, vend=vend, hbin=hbin, vbin=vbin),
+                            read_mode="image")
     
     def get_image_mode_parameters(self):
         return self.cam.get_image_mode_parameters()
     
     def set_fvb(self):
-        with self._lock:
-            self.cam.set_roi(vbin="full")
-            self.vbin = "full"
+        self.apply_settings(read_mode="fvb")
     
     def get_all_vsspeeds(self):
         return self.cam.get_all_vsspeeds()
     
     def set_vsspeed(self, speed):
-        self.cam.set_vsspeed(speed)
+        self.apply_settings(vsspeed=speed)
     
     def get_max_vsspeed(self):
         return self.cam.get_max_vsspeed()
@@ -154,10 +438,7 @@ class AndorCameraController:
             raise ValueError(
                 "Trigger mode must be 'int', 'software'"
             )
-        
-        with self._lock:
-            self.cam.set_trigger_mode(mode)
-            self.trigger_mode = mode
+        self.apply_settings(trigger_mode=mode)
     
     def set_internal_trigger(self):
         self.set_trigger_mode("int")
@@ -167,9 +448,7 @@ class AndorCameraController:
     
     # Acquisition settings
     def set_exposure(self, exposure):
-        with self._lock:
-            self.cam.set_exposure(exposure)
-            self.exposure = exposure
+        self.apply_settings(exposure=exposure)
     
     def get_exposure(self):
         return self.cam.get_exposure()
@@ -178,9 +457,7 @@ class AndorCameraController:
         return self.cam.get_acquisition_mode()
 
     def set_acquisition_mode(self, mode="single"):
-        with self._lock:
-            self.cam.set_acquisition_mode(mode)
-            self.acquisition_mode = mode
+        self.apply_settings(acquisition_mode=mode)
     
     def start_acquisition(self):
         self.cam.start_acquisition()
@@ -192,22 +469,123 @@ class AndorCameraController:
         return self.cam.read_newest_image()
     
     def setup_accum_mode(self, num_acc, cycle_time_acc=0):
-        self.cam.setup_accum_mode(num_acc, cycle_time_acc)
+        self.apply_settings(accum=(num_acc, cycle_time_acc))
     
     def get_accum_mode_parameters(self):
         return self.cam.get_accum_mode_parameters()
     
     def setup_kinetic_mode(self, num_cycle, cycle_time=0.0, num_acc=1, cycle_time_acc=0, num_prescan=0):
-        self.cam.setup_kinetic_mode(num_cycle, cycle_time, num_acc, cycle_time_acc, num_prescan)
+        self.apply_settings(kinetic=(num_cycle, cycle_time, num_acc, cycle_time_acc, num_prescan))
     
     def get_kinetic_mode_parameters(self):
         return self.cam.get_kinetic_mode_parameters()
     
     def setup_cont_mode(self, cycle_time=0):
-        self.cam.setup_cont_mode(cycle_time)
+        self.apply_settings(cont=cycle_time)
     
     def get_cont_mode_parameters(self):
         return self.cam.get_cont_mode_parameters()
+
+    # Streaming acquisition
+    def start_stream(self, cycle_time=0, buffer_frames=256):
+        """Start continuous acquisition draining into a preallocated ring buffer"""
+        with self._lock:
+            self._apply({"acquisition_mode": "cont", "cont": cycle_time, "frame_format": "array"})
+            rows, cols = self.cam.get_data_dimensions()
+            self.stream = FrameRingBuffer(buffer_frames, (rows, cols))
+            self._stream_period = self.cam.get_cycle_timings()[2]
+            self._stream_last_index = -1
+            self._stream_dropped = 0
+            self.cam.start_acquisition()
+            self._forget_acquisition_mode()
+            self._stream_t0 = time.time()
+            self.streaming = True
+
+    def drain_stream(self):
+        """Move every new frame from the SDK buffer into the ring; return the number of frames moved"""
+        with self._lock:
+            if not self.streaming:
+                return 0
+            rng = self.cam.get_new_images_range()
+            if rng is None:
+                return 0
+            frames, indices = self._read_frames(rng)
+            if not len(indices):
+                return 0
+            # frames skipped before or inside this batch never reach the ring
+            self._stream_dropped += int(indices[-1] - self._stream_last_index) - len(indices)
+            self._stream_last_index = indices[-1]
+            timestamps = self._stream_t0 + indices * self._stream_period
+            self.stream.push(frames, indices, timestamps)
+            # appended under the lock so concurrent drains write batches in frame order
+            finished = None
+            if self.series_writer is not None:
+                self.series_writer.append(frames, timestamps, self.exposure, indices)
+                if self.series_writer.full:
+                    finished, self.series_writer = self.series_writer, None
+        if finished is not None:
+            finished.close()
+        return len(indices)
+
+    def wait_stream(self, timeout=1.0):
+        """Wait for a new streamed frame; return False on timeout"""
+        try:
+            self.cam.wait_for_frame(timeout=timeout)
+            return True
+        except (Andor.AndorTimeoutError, TimeoutError):
+            return False
+
+    def iter_stream(self, timeout=1.0, max_frames=None):
+        """Yield (frame_index, timestamp, frame) for every frame until the stream stops"""
+        yielded = 0
+        while self.streaming and (max_frames is None or yielded < max_frames):
+            if not self.wait_stream(timeout):
+                continue
+            self.drain_stream()
+            # frames past max_frames stay unread in the ring for the next consumer
+            indices, timestamps, frames = self.stream.read_new(None if max_frames is None else max_frames - yielded)
+            for index, ts, frame in zip(indices, timestamps, frames):
+                yield int(index), ts, frame
+                yielded += 1
+                if max_frames is not None and yielded >= max_frames:
+                    return
+
+    def stream_status(self):
+        acquired = self.cam.get_frames_status()[0] if self.streaming else None
+        return {
+            "streaming": self.streaming,
+            "acquired": acquired,
+            "received": 0 if self.stream is None else self.stream.written,
+            "last_index": int(self._stream_last_index),
+            "dropped_camera": int(self._stream_dropped),
+            "dropped_buffer": 0 if self.stream is None else self.stream.overrun,
+        }
+
+    def stop_stream(self):
+        self.drain_stream()
+        with self._lock:
+            if self.streaming:
+                self.cam.stop_acquisition()
+                self._forget_acquisition_mode()
+                self._apply({"frame_format": "list"})
+                self.streaming = False
+        self.stop_recording()
+
+    def record_stream(self, n_frames, filename=None, directory=None):
+        """Append the next `n_frames` streamed frames to a single FITS cube"""
+        writer = self.open_series_writer(n_frames, filename, directory)
+        with self._lock:
+            previous, self.series_writer = self.series_writer, writer
+        if previous is not None:
+            previous.close()
+        return writer.path
+
+    def stop_recording(self):
+        # detached under the lock, so no drain is appending while the file is closed
+        with self._lock:
+            writer, self.series_writer = self.series_writer, None
+        if writer is not None:
+            return writer.close()
     
         
     # Acquisition
@@ -217,39 +595,127 @@ class AndorCameraController:
     def acquire_single(self):
         """Blocking single acquisition"""
         with self._lock:
-            return self.cam.snap()
-    
+            try:
+                return self.cam.snap()
+            finally:
+                # pylablib's snap starts the acquisition in continuous mode
+                self._forget_acquisition_mode()
+    
+    def dark_settings(self):
+        "Readout settings a dark frame depends on (exposure and temperature aside)"
+        mode = self.cam.get_read_mode()
+        settings = {"read_mode": mode, "roi": self.cam.get_roi(), "vsspeed": self.cam.get_vsspeed()}
+        if mode == "single_track":
+            settings["tracks"] = self.cam.get_single_track_mode_parameters()
+        elif mode == "multi_track":
+            settings["tracks"] = self.cam.get_multi_track_mode_parameters()
+        return settings
+
+    def acquire_dark(self, n_frames=10):
+        """Average `n_frames` frames taken with the shutter closed"""
+        with self._lock:
+            previous = self.cam.get_shutter_parameters()
+            self.cam.setup_shutter("closed")
+            try:
+                total = None
+                for _ in range(n_frames):
+                    frame = self.cam.snap().astype(np.float64)
+                    total = frame if total is None else total + frame
+            finally:
+                self._forget_acquisition_mode()
+                if previous[0] is None:
+                    self.cam.setup_shutter("auto")
+                else:
+                    self.cam.setup_shutter(*previous)
+        return (total / n_frames).astype(np.float32)
+
     def acquire_software_triggered(self, timeout=10):
         with self._lock:
-            self.cam.set_trigger_mode("software")
+            self._apply({"trigger_mode": "software"})
             self.cam.start_acquisition()
             self.cam.send_software_trigger()
             self.cam.wait_for_frame(timeout=timeout)
             image = self.cam.read_newest_image()
             return image
 
+    def _read_frames(self, rng=None):
+        "Read frames in `rng` (default: all unread) as (frames, frame indices); skipped frames are left out"
+        frames, info = self.cam.read_multiple_images(rng=rng, return_info=True)
+        indices = np.array([getattr(i, "frame_index", i) for i in info], dtype=np.int64).reshape(-1)
+        return frames, indices
+
+    def acquire_kinetic_series(self, n_frames, cycle_time=0.0, num_acc=1, cycle_time_acc=0,
+                               batch_size=64, timeout=10, writer=None, keep_frames=True):
+        """
+        Acquire a kinetic series into a preallocated (n_frames, rows, cols) array.
+
+        After each new frame, whatever has arrived (up to `batch_size` frames) is copied
+        out of the camera buffer; `timeout` bounds the wait for each frame beyond the
+        kinetic cycle time. Return (frames, timestamps); timestamps are derived from the
+        kinetic cycle time, frames lost by the camera stay zero with a NaN timestamp.
+        If `writer` (see `open_series_writer`, or a SpectrumCube) is given, each batch is
+        also appended to it; with `keep_frames=False` frames only go to the writer and
+        the returned frames are None.
+        """
+        with self._lock:
+            self._apply({"acquisition_mode": "kinetic", "frame_format": "array",
+                         "kinetic": (n_frames, cycle_time, num_acc, cycle_time_acc, 0)})
+            rows, cols = self.cam.get_data_dimensions()
+            frames = np.zeros((n_frames, rows, cols), dtype=np.int32) if keep_frames else None
+            timestamps = np.full(n_frames, np.nan)
+            self.kinetis_cycle_time = self.cam.get_cycle_timings()[2]
+
+            self.cam.start_acquisition()
+            t0 = time.time()
+            try:
+                next_index = 0
+                while next_index < n_frames:
+                    self.cam.wait_for_frame(timeout=timeout + self.kinetis_cycle_time)
+                    rng = self.cam.get_new_images_range()
+                    if rng is None:
+                        continue
+                    batch, indices = self._read_frames((rng[0], min(rng[1], rng[0] + batch_size)))
+                    if not len(indices):
+                        continue
+                    if frames is not None:
+                        frames[indices] = batch
+                    timestamps[indices] = t0 + indices * self.kinetis_cycle_time
+                    if writer is not None:
+                        writer.append(batch, timestamps[indices], self.exposure, indices)
+                    next_index = indices[-1] + 1
+            finally:
+                self.cam.stop_acquisition()
+                self._apply({"frame_format": "list"})
+        return frames, timestamps
+
     
     #File Saving 
-    def save_image(self, image, filename=None, directory=None, save_preview=True):
+    def _image_metadata(self):
+        "Snapshot of the FITS header values for the current settings"
+        return {
+            "EXPOSURE": self.exposure,
+            "H_BIN": self.hbin,
+            "V_BIN": self.vbin,
+            "TEMP_SET": self.temperature_setpoint,
+            "COOLER": self.cooler_enabled,
+            "ACQ_MODE": self.acquisition_mode,
+            "DATE": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        }
+
+    def _image_path(self, filename, directory, prefix="image"):
         if directory is None:
             directory = os.getcwd()
         os.makedirs(directory, exist_ok=True)
-        
+
         if filename is None:
-            filename = f"image_{time.strftime('%Y%m%d-%H%M%S')}.fits"
-        
-        full_path = os.path.join(directory, filename)
-        
-        hdr = fits.Header()
-        hdr['EXPOSURE'] = self.exposure 
-        hdr['H_BIN'] = self.hbin
-        hdr['V_BIN'] = self.vbin
-        hdr['TEMP_SET'] = self.temperature_setpoint
-        hdr['COOLER'] = self.cooler_enabled
-        hdr['ACQ_MODE'] = self.acquisition_mode
-        hdr['DATE'] = time.strftime("%Y-%m-%dT%H:%M:%S")
-        hdu = fits.PrimaryHDU(image, header=hdr)
-        hdu.writeto(full_path, overwrite=True)
+            now = time.time()
+            self._image_counter += 1
+            filename = f"{prefix}_{time.strftime('%Y%m%d-%H%M%S', time.localtime(now))}-{int(now % 1 * 1000):03d}_{self._image_counter:04d}.fits"
+        return os.path.join(directory, filename)
+
+    def save_image(self, image, filename=None, directory=None, save_preview=True):
+        full_path = self._image_path(filename, directory)
+        write_fits(full_path, image, self._image_metadata())
         
         if save_preview:
             preview_file = full_path.replace('.fits', '.png')
@@ -257,6 +723,33 @@ class AndorCameraController:
             
         return full_path
 
+    def save_image_async(self, image, filename=None, directory=None, save_preview=True, block=False):
+        """
+        Queue an image for the background writer and return its path right away.
+
+        Previews are written at reduced resolution. Returns None when the writer
+        queue is full (see `writer.status()` for backpressure counters).
+        """
+        if self.writer is None:
+            self.writer = AsyncImageWriter()
+        full_path = self._image_path(filename, directory)
+        if not self.writer.submit(full_path, image, self._image_metadata(), save_preview, block=block):
+            return None
+        return full_path
+
+    def open_series_writer(self, n_frames, filename=None, directory=None):
+        """Pre-sized FITS cube for `n_frames` frames of the current readout geometry"""
+        full_path = self._image_path(filename, directory, prefix="series")
+        metadata = self._image_metadata()
+        return FitsSeriesWriter(full_path, n_frames, self.cam.get_data_dimensions(), metadata)
+
+    def close_writer(self):
+        "Flush pending images and stop the background writer"
+        if self.writer is not None:
+            self.writer.flush()
+            self.writer.close()
+            self.writer = None
+
     def get_status(self):
         return {
             "connected": self.connected,
@@ -271,40 +764,160 @@ class AndorCameraController:
 
     # Safety
     def shutdown(self):
+        try:
+            self.close_writer()
+        except Exception:
+            pass
         try:
             self.disconnect()
         except Exception:
             pass
 
+# Calibration cache of the real spectrograph; SPECTROMETER_CALIBRATION_CACHE overrides it
+DEFAULT_CALIBRATION_CACHE = os.path.join(os.path.expanduser("~"), ".spectrometer", "calibration_cache.npz")
+
+
+def calibration_cache_path():
+    return os.environ.get("SPECTROMETER_CALIBRATION_CACHE") or DEFAULT_CALIBRATION_CACHE
+
+
+class CalibrationCache:
+    """
+    LRU cache of wavelength axes keyed on spectrograph configuration.
+
+    With a `path`, entries are saved to an .npz file on every insert and loaded
+    again on start-up, so known configurations survive restarts.
+    """
+    def __init__(self, path=None, capacity=64):
+        self.path = path
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            with np.load(path) as data:
+                for key in data.files:
+                    self._entries[key] = self._frozen(data[key])
+
+    def _frozen(self, axis):
+        axis = np.array(axis, dtype=float)
+        axis.setflags(write=False)
+        return axis
+
+    def key(self, grating, center_nm, offset, pixel_width_um, n_pixels, columns):
+        return f"g{grating}_c{center_nm:.4f}_o{offset}_w{pixel_width_um:.4f}_n{n_pixels}_x{columns}"
+
+    def get(self, key):
+        with self._lock:
+            axis = self._entries.get(key)
+            if axis is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return axis
+
+    def put(self, key, axis):
+        axis = self._frozen(axis)
+        with self._lock:
+            self._entries[key] = axis
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+            if self.path:
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+                tmp = self.path + ".tmp.npz"
+                np.savez(tmp, **self._entries)
+                os.replace(tmp, self.path)
+        return axis
+
+    def status(self):
+        return {"entries": len(self._entries), "capacity": self.capacity,
+                "hits": self.hits, "misses": self.misses, "path": self.path}
+
+
 class KymeraController:
-    def __init__(self, device_index=0):
-        self.spec = Shamrock.ShamrockSpectrograph(device_index)
-        self._wl_cache = None
+    def __init__(self, device_index=0, spectrograph_factory=None, calibration_cache=None):
+        spectrograph_factory = spectrograph_factory or Shamrock.ShamrockSpectrograph
+        self.spec = spectrograph_factory(device_index)
+        # calibration_cache: .npz path for the persistent calibration cache (None keeps it in memory)
+        self.calibration_cache = CalibrationCache(calibration_cache)
+        # Guards the local configuration below against concurrent readers (e.g. TelemetryPoller)
+        self._lock = threading.RLock()
+
+        # Local copy of the configuration the calibration depends on; None means
+        # "read from the SDK on next use" (e.g. offset after a grating change)
+        self._grating = None
+        self._center_nm = None
+        self._offset = None
+        self._pixel_width_um = None
+        self._n_pixels = None
+        self._columns = None
+        self._camera = None
     
     def disconnect(self):
         self.spec.close()
 
     def setup_from_camera(self, camera):
-        self.spec.setup_pixels_from_camera(camera)
-        self._wl_cache = None
+        """Match the detector geometry to the camera; no SDK calls if nothing changed"""
+        pixel_width_um = camera.get_pixel_size()[0] * 1e6
+        n_pixels = camera.get_detector_size()[0]
+        # binning/ROI only apply to the spectrum axis in image readout
+        columns = (0, n_pixels, 1)
+        if camera.get_read_mode() == "image":
+            hstart, hend, _, _, hbin, _ = camera.get_roi()
+            columns = (hstart, hend, hbin)
+        with self._lock:
+            if camera is not self._camera or (pixel_width_um, n_pixels) != (self._pixel_width_um, self._n_pixels):
+                self.spec.setup_pixels_from_camera(camera)
+                self._camera = camera
+                self._pixel_width_um, self._n_pixels = pixel_width_um, n_pixels
+            self._columns = columns
 
     def set_grating(self, index):
-        self.spec.set_grating(index)
-        self._wl_cache = None
+        with self._lock:
+            self.spec.set_grating(index)
+            self._grating = index
+            self._center_nm = None
+            self._offset = None
 
     #sets central wavelength
     def set_central_wavelength(self, wl_nm):
-        self.spec.set_wavelength(wl_nm * 1e-9)
-        self._wl_cache = None
+        with self._lock:
+            self.spec.set_wavelength(wl_nm * 1e-9)
+            self._center_nm = wl_nm
     
     def get_number_pixels(self):
         return self.spec.get_number_pixels()
 
+    def _calibration_key(self):
+        if self._grating is None:
+            self._grating = self.spec.get_grating()
+        if self._center_nm is None:
+            self._center_nm = self.spec.get_wavelength() * 1e9
+        if self._offset is None:
+            self._offset = self.spec.get_grating_offset()
+        if self._pixel_width_um is None:
+            self._pixel_width_um = self.spec.get_pixel_width() * 1e6
+            self._n_pixels = self.spec.get_number_pixels()
+        columns = self._columns or (0, self._n_pixels, 1)
+        return self.calibration_cache.key(self._grating, self._center_nm, self._offset,
+                                          self._pixel_width_um, self._n_pixels, columns)
+
     def get_calibration_nm(self):
-        if self._wl_cache is None:
-            wl_m = self.spec.get_calibration()  # meters
-            self._wl_cache = wl_m * 1e9        # convert to nm
-        return self._wl_cache
+        """Wavelength (nm) of each spectrum pixel, from the calibration cache when possible"""
+        with self._lock:
+            key = self._calibration_key()
+            wl = self.calibration_cache.get(key)
+            if wl is None:
+                wl = self.spec.get_calibration() * 1e9  # meters -> nm
+                if self._columns is not None:
+                    hstart, hend, hbin = self._columns
+                    hend = hstart + (hend - hstart) // hbin * hbin
+                    wl = wl[hstart:hend].reshape(-1, hbin).mean(axis=1)
+                wl = self.calibration_cache.put(key, wl)
+            return wl
     
     def get_grating(self):
         return self.spec.get_grating()
@@ -313,8 +926,9 @@ class KymeraController:
         return self.spec.get_grating_offset()
     
     def set_grating_offset(self, offset):
-        self.spec.set_grating_offset(offset)
-        self._wl_cache = None
+        with self._lock:
+            self.spec.set_grating_offset(offset)
+            self._offset = offset
     
     def get_central_wavelength(self):
         return self.spec.get_wavelength() * 1e9
@@ -358,7 +972,9 @@ class KymeraController:
     
     #preset in GUI to 26 um
     def set_acq_pixel_width(self, width_um):
-        self.spec.set_pixel_width(width_um)
+        with self._lock:
+            self.spec.set_pixel_width(width_um)
+            self._pixel_width_um = None
     
     def get_status(self):
         return {
@@ -372,6 +988,22 @@ class SpectrometerController:
         self.camera = camera_controller
         self.kymera = kymera_controller
         self._lock = threading.Lock()
+        self.cosmic_ray_options = None
+        self.cosmic_ray_pixels = 0
+        self.darks = None
+        self.dark_subtracted = False
+        self.accumulator = None
+        self._accumulator_key = None
+        self.last_scan = None
+        self.track_background = None
+        self.extraction_options = None
+        self.last_extraction = None
+        self._profiles = {}
+        self.baseline_options = None
+        self.last_baseline = None
+        self.frame_directory = None
+        self.save_previews = True
+        self.last_frame_path = None
     
     def connect(self):
         self.camera.connect()
@@ -385,6 +1017,19 @@ class SpectrometerController:
         with self._lock:
             return self.camera.acquire_single()
     
+    def set_frame_saving(self, directory=None, save_preview=True):
+        """
+        Queue the raw frame of every acquired spectrum as FITS in `directory` (None
+        stops saving) on the camera's background writer, so saving never blocks readout.
+        """
+        self.frame_directory = directory
+        self.save_previews = save_preview
+
+    def _save_frame(self, image):
+        if self.frame_directory is not None:
+            self.last_frame_path = self.camera.save_image_async(image, directory=self.frame_directory,
+                                                                save_preview=self.save_previews)
+
     def get_wavelength_axis(self):
         return self.kymera.get_calibration_nm()
     
@@ -401,25 +1046,272 @@ class SpectrometerController:
         wl = self.get_wavelength_axis()
         return spectrum, wl, img"""
     
+    def set_cosmic_ray_removal(self, enabled=True, **options):
+        """Enable single-frame cosmic ray removal in acquire_spectrum; options go to clean_frame"""
+        self.cosmic_ray_options = dict(options) if enabled else None
+
+    def remove_cosmic_rays(self, data, **options):
+        """Clean a frame, FVB spectrum or (n, rows, cols) stack; return (cleaned, mask)"""
+        cleaned, mask = remove_cosmic_rays(data, **options)
+        self.cosmic_ray_pixels += int(mask.sum())
+        return cleaned, mask
+
+    # Dark correction
+    def use_dark_library(self, directory="darks", **options):
+        """Subtract matching darks from `directory` in acquire_spectrum; options go to DarkFrameLibrary"""
+        self.darks = DarkFrameLibrary(directory, **options)
+        return self.darks
+
+    def take_dark(self, n_frames=10):
+        """Record a dark for the current exposure and readout settings into the library"""
+        if self.darks is None:
+            raise RuntimeError("No dark library in use (call use_dark_library first)")
+        with self._lock:
+            frame = self.camera.acquire_dark(n_frames)
+            return self.darks.add(frame, self.camera.exposure, self.camera.dark_settings(),
+                                  self.camera.get_temperature(), n_frames=n_frames)
+
+    def current_dark(self, shape=None):
+        "Dark frame matching the current camera settings, or None"
+        if self.darks is None:
+            return None
+        return self.darks.match(self.camera.exposure, self.camera.dark_settings(),
+                                self.camera.get_temperature(), shape=shape)
+
+    def _correct_image(self, image, independent_rows=False):
+        dark = self.current_dark(np.shape(image))
+        self.dark_subtracted = dark is not None
+        if dark is not None:
+            image = image - dark
+        if self.cosmic_ray_options is not None:
+            image = self.remove_cosmic_rays(image, independent_rows=independent_rows,
+                                            **self.cosmic_ray_options)[0]
+        return image
+
+    # Multi-track extraction
+    def acquire_track_frame(self, bands=None):
+        """Dark/cosmic-corrected frame split into tracks, before background subtraction"""
+        image = self._correct_image(self.acquire_image(), independent_rows=bands is None)
+        return extract_tracks(image, bands)
+
+    def acquire_track_background(self, n_frames=10, bands=None):
+        """Average `n_frames` track frames (e.g. laser off or blank fibres) as per-track background"""
+        frames = [self.acquire_track_frame(bands) for _ in range(n_frames)]
+        self.track_background = np.mean(frames, axis=0)
+        return self.track_background
+
+    def clear_track_background(self):
+        self.track_background = None
+
+    def acquire_tracks(self, laser_wl, bands=None):
+        """
+        One readout, one spectrum per track: return (tracks, wl, raman) with tracks
+        an (n_tracks, pixels) array on the shared calibration axis.
+
+        In multi-track readout each frame row is a track; in image readout pass
+        `bands`, a list of (start, stop) row ranges. The per-track background from
+        acquire_track_background is subtracted when its shape matches.
+        """
+        tracks = self.acquire_track_frame(bands)
+        background = self.track_background
+        if background is not None and background.shape == tracks.shape:
+            tracks -= background
+        tracks = self._correct_spectra(tracks)
+        wl = self.kymera.get_calibration_nm()
+        raman = self.wavelength_to_raman_shift(wl, laser_wl)
+        return tracks, wl, raman
+
+    # Baseline removal
+    def set_baseline_removal(self, method="als", **options):
+        """Subtract a fluorescence baseline from acquired spectra; method "als", "airpls" or None"""
+        self.baseline_options = None if method is None else dict(options, method=method)
+        self.last_baseline = None
+
+    def remove_baseline(self, spectra, **options):
+        """Baseline-correct a spectrum or (n, pixels) stack with the configured method; return corrected"""
+        options = dict(self.baseline_options or {"method": "als"}, **options)
+        corrected, self.last_baseline = remove_baseline(spectra, **options)
+        return corrected
+
+    def _correct_spectra(self, spectra):
+        if self.baseline_options is None:
+            return spectra
+        return self.remove_baseline(spectra)
+
+    # Software accumulation
+    def start_accumulation(self, ema_alpha=None):
+        """Average every acquired spectrum (exponentially weighted if ema_alpha is set)"""
+        self.accumulator = SpectrumAccumulator(ema_alpha)
+        self._accumulator_key = None
+        return self.accumulator
+
+    def stop_accumulation(self):
+        self.accumulator = None
+
+    def _accumulation_key(self, wl):
+        "Settings a spectrum depends on: readout (read mode, ROI, speed, tracks), timing and corrections"
+        cam = self.camera
+        return (json.dumps(cam.dark_settings(), sort_keys=True, default=str), cam.exposure,
+                cam.acquisition_mode, cam.trigger_mode, self.dark_subtracted,
+                json.dumps(self.baseline_options, sort_keys=True), calibration_id(wl))
+
+    def accumulate(self, spectra, wl):
+        """Add a spectrum or (n, pixels) batch; the average restarts when settings change"""
+        if self.accumulator is None:
+            return 0
+        key = self._accumulation_key(wl)
+        if key != self._accumulator_key:
+            self.accumulator.reset()
+            self._accumulator_key = key
+        return self.accumulator.update(spectra)
+
+    # Optimal extraction
+    def set_optimal_extraction(self, enabled=True, **options):
+        """
+        Use profile-weighted extraction for image readout; options go to optimal_extract.
+        The background under the track is added back (include_background=True) so the
+        spectrum stays comparable to the row mean; pass include_background=False for a
+        background-free spectrum. Pass the camera `bias` (counts) when no dark frame is
+        subtracted, so the bias level is not counted as shot noise.
+        """
+        self.extraction_options = dict(options) if enabled else None
+
+    def _profile_key(self, shape):
+        return json.dumps(self.camera.dark_settings(), sort_keys=True, default=str), tuple(shape)
+
+    def calibrate_profile(self, n_frames=10, window=64):
+        """Average `n_frames` corrected frames into the spatial profile cached for the current ROI"""
+        frames = [self._correct_image(self.acquire_image()) for _ in range(n_frames)]
+        mean = np.mean(frames, axis=0)
+        profile = estimate_profile(mean, window)
+        self._profiles[self._profile_key(mean.shape)] = profile
+        return profile
+
+    def clear_profiles(self):
+        self._profiles = {}
+
+    def extract_image_spectrum(self, image):
+        """
+        Row-mean spectrum of a frame; with optimal extraction enabled and image readout,
+        the variance-weighted estimate scaled to the same units (total / rows).
+        """
+        image = np.atleast_2d(image)
+        if (self.extraction_options is None or image.shape[0] < 2
+                or self.camera.get_readout_mode() != "image"):
+            self.last_extraction = None
+            return image.mean(axis=0)
+        profile = self._profiles.get(self._profile_key(image.shape))
+        options = {"include_background": True, **self.extraction_options}
+        if self.dark_subtracted:
+            options["bias"] = 0.0
+        flux, variance, rejected, profile = optimal_extract(image, profile, **options)
+        rows = image.shape[0]
+        self.last_extraction = {"variance": variance / rows ** 2, "rejected": int(rejected.sum()),
+                                "cached_profile": (self._profile_key(image.shape) in self._profiles)}
+        return flux / rows
+
+    def spectrum_from_frame(self, image):
+        """Spectrum of one raw frame: dark and cosmic-ray correction, extraction, baseline"""
+        image = self._correct_image(image)
+        return self._correct_spectra(self.extract_image_spectrum(image))
+
+    def spectra_from_frames(self, frames):
+        """(n, pixels) spectra of (n, rows, cols) raw frames, corrected as in spectrum_from_frame"""
+        spectra = np.array([self.extract_image_spectrum(self._correct_image(frame)) for frame in frames])
+        return self._correct_spectra(spectra)
+
     def acquire_spectrum(self, laser_wl):
         image = self.acquire_image()
-        spectrum = image.mean(axis=0)
+        self._save_frame(image)
+        spectrum = self.spectrum_from_frame(image)
         wl = self.kymera.get_calibration_nm()
         raman = self.wavelength_to_raman_shift(wl, laser_wl)
+        self.accumulate(spectrum, wl)
         return spectrum, wl, raman  
     
     def acquire_spectrum_software(self, laser_wl, pixel_width=26.0):
         image = self.camera.acquire_software_triggered()
-        spectrum = image.mean(axis=0)
+        self._save_frame(image)
+        spectrum = self.spectrum_from_frame(image)
         wl = self.kymera.get_calibration_nm()
         raman = self.wavelength_to_raman_shift(wl, laser_wl)
+        self.accumulate(spectrum, wl)
         return spectrum, wl, raman
     
-    def save_spectrum_csv(self, spectrum, wavelength_nm, filename=None):
-        if filename is None:
-            ts = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-            filename = f"spectrum_{ts}.csv"
+    # Stitched scans
+    def acquire_stitched(self, start_nm, end_nm, laser_wl, overlap=0.15, n_frames=1,
+                         match_intensity=True, step_nm=None, match_offset=True):
+        """
+        Cover [start_nm, end_nm] with several grating positions and merge them.
+
+        The window width is taken from the current calibration; windows are visited
+        in the order with the least grating travel and the grating returns to its
+        starting wavelength afterwards. Windows are matched by gain and offset (see
+        stitch_windows); matched darks are subtracted first when a dark library is
+        in use. Return (spectrum, wl, raman) on a uniform axis trimmed to the
+        requested range; the raw windows are kept in `last_scan`.
+        """
+        wl = self.kymera.get_calibration_nm()
+        centers = plan_windows(start_nm, end_nm, abs(wl[-1] - wl[0]), overlap)
+        centers = order_windows(centers, self.kymera.get_central_wavelength())
+
+        def acquire():
+            spectra = [self.acquire_spectrum(laser_wl)[:2] for _ in range(n_frames)]
+            return np.mean([s for s, _ in spectra], axis=0), spectra[-1][1]
+
+        windows = run_scan(self.kymera, acquire, centers)
+        axis, spectrum, scales, offsets = stitch_windows(windows, step_nm, match_intensity, match_offset)
+        self.last_scan = {"centers": centers, "windows": windows, "scales": scales, "offsets": offsets}
+        lo, hi = sorted((start_nm, end_nm))
+        inside = (axis >= lo) & (axis <= hi)
+        axis, spectrum = axis[inside], spectrum[inside]
+        return spectrum, axis, self.wavelength_to_raman_shift(axis, laser_wl)
+
+    def acquire_stitched_raman(self, start_cm, end_cm, laser_wl, **options):
+        """Stitched scan over a Raman shift range (cm^-1); options as in acquire_stitched"""
+        start_nm, end_nm = raman_to_wavelength([start_cm, end_cm], laser_wl)
+        return self.acquire_stitched(start_nm, end_nm, laser_wl, **options)
+
+    # Data cubes
+    def open_cube(self, directory, n_frames, laser_wl=None, fields=()):
+        """
+        Empty SpectrumCube for `n_frames` spectra on the current calibration (and Raman
+        axis if `laser_wl` is given), with the acquisition metadata attached.
+        `fields` names extra per-frame values, e.g. ("x_um", "y_um") for a map.
+        """
+        wl = self.kymera.get_calibration_nm()
+        axes = {"wavelength_nm": wl}
+        if laser_wl is not None:
+            axes = {"raman_shift": self.wavelength_to_raman_shift(wl, laser_wl), "wavelength_nm": wl}
+        metadata = dict(self.spectrum_metadata(len(wl)), laser_wavelength_nm=laser_wl,
+                        calibration_id=calibration_id(wl))
+        return SpectrumCube(directory, n_frames, axes, metadata, fields=fields)
 
+    def acquire_cube(self, directory, n_frames, laser_wl=None, cycle_time=0.0, batch_size=64, **options):
+        """
+        Kinetic series written straight to a SpectrumCube (row-mean spectra per frame),
+        so runs larger than memory never hold the frames; options go to
+        acquire_kinetic_series. Return the closed cube, still readable.
+        """
+        cube = self.open_cube(directory, n_frames, laser_wl)
+        with cube:
+            self.camera.acquire_kinetic_series(n_frames, cycle_time, batch_size=batch_size,
+                                               writer=cube, keep_frames=False, **options)
+        return cube
+
+    # Band analysis
+    def track_bands(self, spectra, laser_wl, peaks=None, **options):
+        """
+        Fit Raman bands through a (n_frames, pixels) series, e.g. the row means of
+        acquire_kinetic_series frames. Return PeakTracker.series() with positions
+        and widths in cm^-1; `options` go to PeakTracker.
+        """
+        raman = self.wavelength_to_raman_shift(self.kymera.get_calibration_nm(), laser_wl)
+        tracker = PeakTracker(raman, peaks=peaks, **options)
+        tracker.update(spectra)
+        return tracker.series()
+
+    def spectrum_metadata(self, num_pixels):
         metadata = {
             "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
             "exposure_s": getattr(self.camera, "exposure", "unknown"),
@@ -429,25 +1321,25 @@ class SpectrometerController:
             "center_wavelength_nm": getattr(
                 self.kymera.spec, "get_wavelength", lambda: None
             )(),
-            "num_pixels": len(wavelength_nm),
+            "num_pixels": num_pixels,
+            "dark_subtracted": self.dark_subtracted,
+            "baseline": None if self.baseline_options is None else self.baseline_options["method"],
         }
 
         if metadata["center_wavelength_nm"] not in ("unknown", None):
             metadata["center_wavelength_nm"] *= 1e9
+        return metadata
 
-        with open(filename, "w") as f:
-            # Metadata header
-            for key, value in metadata.items():
-                f.write(f"# {key}: {value}\n")
-
-            # Column header
-            f.write("wavelength_nm,intensity\n")
-
-            # Data
-            for wl, val in zip(wavelength_nm, spectrum):
-                f.write(f"{wl},{val}\n")
+    def save_spectrum(self, spectrum, wavelength_nm, filename=None, fmt="csv", raman=None):
+        """Save a spectrum as "csv", "npz" or "hdf5" (hdf5 appends to an existing file)"""
+        if filename is None:
+            ts = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+            filename = f"spectrum_{ts}{SPECTRUM_WRITERS[fmt][1]}"
+        metadata = self.spectrum_metadata(len(wavelength_nm))
+        return write_spectrum(filename, wavelength_nm, spectrum, metadata, raman=raman, fmt=fmt)
 
-        return os.path.abspath(filename)
+    def save_spectrum_csv(self, spectrum, wavelength_nm, filename=None):
+        return self.save_spectrum(spectrum, wavelength_nm, filename=filename, fmt="csv")
     
     def get_status(self):
         status = self.cam_ctrl.get_status()
@@ -474,7 +1366,40 @@ class SpectrometerController:
         plt.show()
 
 
+def create_controllers(backend=None, device_index=0, camera_options=None, spectrograph_options=None,
+                       **sim_options):
+    """
+    Build (camera, kymera, spectrometer) controllers for the given backend.
 
-
-
-
+    `backend` is "andor" (real hardware) or "sim" (Spectrometer_Sim models);
+    defaults to the SPECTROMETER_BACKEND environment variable, then "andor".
+    The andor backend keeps its calibration cache in calibration_cache_path();
+    simulated spectrographs keep theirs in memory.
+    `sim_options` (e.g. time_scale, seed, or any constructor option) are passed to
+    each simulated device that accepts them; `camera_options` and
+    `spectrograph_options` go to one device only.
+    """
+    backend = backend or os.environ.get("SPECTROMETER_BACKEND", "andor")
+    if backend == "sim":
+        from Spectrometer_Sim import SimulatedAndorCamera, SimulatedShamrockSpectrograph
+        camera_params = inspect.signature(SimulatedAndorCamera).parameters
+        spectrograph_params = inspect.signature(SimulatedShamrockSpectrograph).parameters
+        unknown = [name for name in sim_options if name not in camera_params and name not in spectrograph_params]
+        if unknown:
+            raise TypeError(f"Unknown simulator options: {unknown}")
+        camera_kwargs = {k: v for k, v in sim_options.items() if k in camera_params}
+        camera_kwargs.update(camera_options or {})
+        spectrograph_kwargs = {k: v for k, v in sim_options.items() if k in spectrograph_params}
+        spectrograph_kwargs.update(spectrograph_options or {})
+        camera = AndorCameraController(camera_factory=lambda: SimulatedAndorCamera(**camera_kwargs))
+        kymera = KymeraController(
+            device_index,
+            spectrograph_factory=lambda idx: SimulatedShamrockSpectrograph(idx, **spectrograph_kwargs),
+            calibration_cache=None
+        )
+    elif backend == "andor":
+        camera = AndorCameraController()
+        kymera = KymeraController(device_index, calibration_cache=calibration_cache_path())
+    else:
+        raise ValueError(f"Unknown backend: {backend}")
+    return camera, kymera, SpectrometerController(camera, kymera)
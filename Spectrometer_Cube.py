@@ -0,0 +1,257 @@
+import datetime
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from numpy.lib.format import open_memmap
+
+# Disk-backed spectrum cubes for runs larger than memory: kinetic series (frames x
+# pixels) and map scans (positions x pixels). Reductions read the cube in chunks of
+# frames on a thread pool; NumPy releases the GIL, so chunks are reduced in parallel.
+
+FRAME_FIELDS = [("index", "i8"), ("timestamp", "f8"), ("exposure", "f8")]
+
+
+def _trapezoid_weights(x):
+    "Weights w such that spectrum @ w is the trapezoidal integral over x"
+    dx = np.abs(np.diff(x))
+    w = np.zeros(len(x))
+    w[:-1] += dx / 2
+    w[1:] += dx / 2
+    return w
+
+
+class SpectrumCube:
+    """
+    (n_frames, n_pixels) spectra in a memory-mapped .npy file, with spectral axes
+    and per-frame metadata alongside.
+
+    A directory holds spectra.npy, frames.npy (a record per frame: index, timestamp,
+    exposure and any extra `fields` such as stage positions), axes.npz and cube.json.
+    Pass `n_frames` and `axes` (e.g. {"wavelength_nm": wl, "raman_shift": raman}) to
+    create a cube, or only the directory to open an existing one. `append` takes
+    the same arguments as FitsSeriesWriter.append, so a cube can be used as the
+    writer of a kinetic series or a recorded stream.
+    """
+    def __init__(self, directory, n_frames=None, axes=None, metadata=None, fields=(), dtype=np.float32,
+                 mode="r+", chunk_bytes=2**25, workers=None):
+        self.directory = directory
+        self.chunk_bytes = int(chunk_bytes)
+        self.workers = workers or min(8, os.cpu_count() or 1)
+        self._lock = threading.Lock()
+        self._info_path = os.path.join(directory, "cube.json")
+        if n_frames is None:
+            if not os.path.exists(self._info_path):
+                raise ValueError(f"No spectrum cube in {directory}")
+            with open(self._info_path) as f:
+                self.info = json.load(f)
+            self.spectra_all = open_memmap(os.path.join(directory, "spectra.npy"), mode=mode)
+            self.frames_all = open_memmap(os.path.join(directory, "frames.npy"), mode=mode)
+            with np.load(os.path.join(directory, "axes.npz")) as data:
+                self.axes = {name: data[name] for name in data.files}
+        else:
+            if not axes:
+                raise ValueError("A new spectrum cube needs at least one spectral axis")
+            self.axes = {name: np.asarray(values, dtype=float) for name, values in axes.items()}
+            n_pixels = {len(values) for values in self.axes.values()}
+            if len(n_pixels) != 1:
+                raise ValueError(f"Spectral axes differ in length: { {k: len(v) for k, v in self.axes.items()} }")
+            os.makedirs(directory, exist_ok=True)
+            record = np.dtype(FRAME_FIELDS + [(name, "f8") for name in fields])
+            self.spectra_all = open_memmap(os.path.join(directory, "spectra.npy"), mode="w+",
+                                           dtype=dtype, shape=(int(n_frames), n_pixels.pop()))
+            self.frames_all = open_memmap(os.path.join(directory, "frames.npy"), mode="w+",
+                                          dtype=record, shape=(int(n_frames),))
+            self.frames_all["index"] = -1
+            for name in record.names[1:]:
+                self.frames_all[name] = np.nan
+            np.savez(os.path.join(directory, "axes.npz"), **self.axes)
+            self.info = {
+                "count": 0,
+                "created": datetime.datetime.now().isoformat(timespec="seconds"),
+                "fields": list(fields),
+                "metadata": dict(metadata or {}),
+            }
+            self._save_info()
+        self.writable = self.spectra_all.mode != "r"
+
+    def _save_info(self):
+        tmp = self._info_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.info, f, indent=1, default=str)
+        os.replace(tmp, self._info_path)
+
+    # Shape
+    @property
+    def count(self):
+        return self.info["count"]
+
+    @property
+    def capacity(self):
+        return len(self.spectra_all)
+
+    @property
+    def n_pixels(self):
+        return self.spectra_all.shape[1]
+
+    @property
+    def full(self):
+        return self.count >= self.capacity
+
+    @property
+    def metadata(self):
+        return self.info["metadata"]
+
+    @property
+    def spectra(self):
+        "Memory-mapped view of the frames written so far; nothing is read until indexed"
+        return self.spectra_all[:self.count]
+
+    @property
+    def frames(self):
+        return self.frames_all[:self.count]
+
+    def __len__(self):
+        return self.count
+
+    # Writing
+    def append(self, spectra, timestamps=None, exposures=None, indices=None, **fields):
+        """
+        Write a spectrum, an (n, pixels) batch, or (n, rows, cols) frames (reduced to
+        their row means); per-frame `fields` are scalars or length-n arrays.
+        Return the number of frames stored.
+        """
+        if not self.writable:
+            raise ValueError(f"Spectrum cube {self.directory} is read-only")
+        spectra = np.asarray(spectra)
+        if spectra.ndim == 3:
+            spectra = spectra.mean(axis=1)
+        spectra = np.atleast_2d(spectra)
+        if spectra.shape[1] != self.n_pixels:
+            raise ValueError(f"Spectra have {spectra.shape[1]} pixels, cube has {self.n_pixels}")
+        unknown = set(fields) - set(self.info["fields"])
+        if unknown:
+            raise ValueError(f"Unknown frame fields: {sorted(unknown)} (cube has {self.info['fields']})")
+        with self._lock:
+            n = min(len(spectra), self.capacity - self.count)
+            sl = slice(self.count, self.count + n)
+            self.spectra_all[sl] = spectra[:n]
+            records = self.frames_all[sl]
+            records["index"] = np.arange(self.count, self.count + n) if indices is None else np.asarray(indices)[:n]
+            for name, values in [("timestamp", timestamps), ("exposure", exposures)] + list(fields.items()):
+                if values is not None:
+                    records[name] = np.broadcast_to(values, len(spectra))[:n]
+            self.info["count"] += n
+        return n
+
+    def flush(self):
+        if self.writable:
+            self.spectra_all.flush()
+            self.frames_all.flush()
+            with self._lock:
+                self._save_info()
+
+    def close(self):
+        self.flush()
+        return self.directory
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # Chunked reductions
+    def _slices(self, start=0, stop=None):
+        start, stop, _ = slice(start, stop).indices(self.count)
+        rows = max(1, self.chunk_bytes // (self.n_pixels * self.spectra_all.dtype.itemsize))
+        return [slice(lo, min(lo + rows, stop)) for lo in range(start, stop, rows)]
+
+    def map_chunks(self, func, start=0, stop=None):
+        "Apply func to each (chunk_frames, pixels) block of frames [start, stop) in parallel; results in order"
+        slices = self._slices(start, stop)
+        if len(slices) <= 1 or self.workers == 1:
+            return [func(self.spectra_all[sl]) for sl in slices]
+        with ThreadPoolExecutor(self.workers) as pool:
+            return list(pool.map(lambda sl: func(self.spectra_all[sl]), slices))
+
+    def _per_frame(self, func, start, stop, width=None):
+        parts = self.map_chunks(func, start, stop)
+        if parts:
+            return np.concatenate(parts)
+        return np.zeros((0,) if width is None else (0, width))
+
+    def _band_pixels(self, band, axis):
+        if band is None:
+            return slice(None)
+        x = self.axes[axis]
+        lo, hi = sorted(band)
+        inside = np.nonzero((x >= lo) & (x <= hi))[0]
+        if len(inside) < 2:
+            raise ValueError(f"Band {band} covers fewer than 2 pixels of {axis}")
+        return slice(inside[0], inside[-1] + 1)
+
+    def _default_axis(self, axis):
+        axis = axis or next(iter(self.axes))
+        if axis not in self.axes:
+            raise ValueError(f"Unknown axis: {axis} (cube has {list(self.axes)})")
+        return axis
+
+    def mean(self, start=0, stop=None):
+        "Mean spectrum over frames [start, stop)"
+        parts = self.map_chunks(lambda block: block.sum(axis=0, dtype=np.float64), start, stop)
+        n = sum(sl.stop - sl.start for sl in self._slices(start, stop))
+        if not n:
+            raise ValueError("No frames to average")
+        return np.sum(parts, axis=0) / n
+
+    def frame_mean(self, band=None, axis=None, start=0, stop=None):
+        "Mean intensity of every frame, over the whole spectrum or a (low, high) band of `axis`"
+        pixels = self._band_pixels(band, self._default_axis(axis))
+        return self._per_frame(lambda block: block[:, pixels].mean(axis=1, dtype=np.float64), start, stop)
+
+    def band_integrals(self, bands, axis=None, start=0, stop=None):
+        """
+        Trapezoidal integral of every frame over each (low, high) range of `axis`
+        (default: the first axis, e.g. "raman_shift" if given first). Return (n_frames, n_bands).
+        """
+        axis = self._default_axis(axis)
+        x = self.axes[axis]
+        spans = [self._band_pixels(band, axis) for band in bands]
+        lo, hi = min(sl.start for sl in spans), max(sl.stop for sl in spans)
+        # only the pixels covered by some band are read from each chunk
+        weights = np.zeros((hi - lo, len(bands)))
+        for k, pixels in enumerate(spans):
+            weights[pixels.start - lo:pixels.stop - lo, k] = _trapezoid_weights(x[pixels])
+        return self._per_frame(lambda block: block[:, lo:hi] @ weights, start, stop, width=len(bands))
+
+    def argmax(self, band=None, axis=None, start=0, stop=None):
+        """
+        Brightest pixel of every frame, optionally within a (low, high) band of `axis`.
+        Return (pixel indices into the full spectrum, positions on `axis`, peak values).
+        """
+        axis = self._default_axis(axis)
+        pixels = self._band_pixels(band, axis)
+        offset = pixels.start or 0
+
+        def reduce(block):
+            block = block[:, pixels]
+            idx = block.argmax(axis=1)
+            return np.stack([idx + offset, block[np.arange(len(block)), idx]], axis=1)
+
+        result = self._per_frame(reduce, start, stop, width=2)
+        indices = result[:, 0].astype(int)
+        return indices, self.axes[axis][indices], result[:, 1]
+
+    def status(self):
+        return {
+            "directory": os.path.abspath(self.directory),
+            "count": self.count,
+            "capacity": self.capacity,
+            "n_pixels": self.n_pixels,
+            "axes": list(self.axes),
+            "fields": self.info["fields"],
+            "dtype": str(self.spectra_all.dtype),
+        }
@@ -1,17 +1,73 @@
-from flask import Flask, request, jsonify, render_template
-import threading
+from flask import Flask, Response, request, jsonify, render_template, make_response
+import base64
+import json
+import os
 import time
 
-from Spectrometer import AndorCameraController, KymeraController, SpectrometerController 
+import numpy as np
+
+from Spectrometer import create_controllers
+from Spectrometer_IO import calibration_id, encode_npy, encode_spectrum
+from Spectrometer_Services import AcquisitionJobQueue, SpectrumBroadcaster, TelemetryPoller
 
 
 app = Flask(__name__)
 
-camera = AndorCameraController()
+# SPECTROMETER_BACKEND=sim runs the driver against the simulated instrument
+camera, kymera, spec = create_controllers(device_index=0)
 camera.connect()
-kymera = KymeraController(device_index=0)
 kymera.setup_from_camera(camera.cam)
-spec = SpectrometerController(camera, kymera)
+
+# Content types for spectrum responses; JSON stays the default for plain clients
+SPECTRUM_RAW = "application/x-spectrum"
+SPECTRUM_NPY = "application/x-npy"
+SPECTRUM_TYPES = ["application/json", SPECTRUM_RAW, SPECTRUM_NPY]
+
+last_laser_wl = None
+
+def format_spectrum_event(item):
+    """Server-sent event carrying float32 intensities (base64) and the calibration id"""
+    payload = {
+        "frame": item["frame"],
+        "timestamp": item["timestamp"],
+        "calibration_id": calibration_id(item["wavelength_nm"]),
+        "intensity_b64": base64.b64encode(np.asarray(item["intensity"], dtype="<f4").tobytes()).decode("ascii"),
+    }
+    return f"id: {item['frame']}\nevent: spectrum\ndata: {json.dumps(payload)}\n\n"
+
+broadcaster = SpectrumBroadcaster(spec, formatter=format_spectrum_event)
+jobs = AcquisitionJobQueue(spec)
+
+# Status endpoints read this snapshot instead of querying the SDK on every request
+telemetry = TelemetryPoller(camera, kymera, interval=float(os.environ.get("SPECTROMETER_TELEMETRY_INTERVAL", 1.0)))
+telemetry.start()
+
+def snapshot_response(status, timestamp, error):
+    data = dict(status)
+    data["timestamp"] = timestamp
+    data["age_s"] = None if timestamp is None else time.time() - timestamp
+    data["telemetry_error"] = error
+    return jsonify(data)
+
+def spectrum_response(spectrum, wl, raman):
+    """JSON (with axes) or, if the client asks for it, intensities only as raw/NPY binary"""
+    calib_id = calibration_id(wl)
+    mime = request.accept_mimetypes.best_match(SPECTRUM_TYPES, default="application/json")
+    if mime == SPECTRUM_RAW:
+        resp = make_response(encode_spectrum(spectrum, calib_id))
+    elif mime == SPECTRUM_NPY:
+        resp = make_response(encode_npy(np.asarray(spectrum, dtype="<f4")))
+    else:
+        resp = jsonify({
+            "calibration_id": calib_id,
+            "wavelength_nm": wl.tolist(),
+            "raman_shift": raman.tolist(),
+            "intensity": spectrum.tolist()
+        })
+    resp.headers["Content-Type"] = mime
+    resp.headers["X-Calibration-Id"] = calib_id
+    resp.vary.add("Accept")
+    return resp
 
 @app.route("/")
 def index():
@@ -19,12 +75,14 @@ def index():
 
 @app.route("/api/camera/status")
 def camera_status():
-    return jsonify(camera.get_status())
+    snap = telemetry.snapshot()
+    return snapshot_response(snap.camera, snap.camera_time, snap.error)
 
 @app.route("/api/camera/exposure", methods=["POST"])
 def set_exposure():
     exp = float(request.json["exposure"])
     camera.set_exposure(exp)
+    telemetry.refresh(kymera=False)
     return jsonify({"exposure": exp})
 
 @app.route("/api/camera/exposure")
@@ -35,15 +93,45 @@ def get_exposure():
 def set_cooler():
     on = bool(request.json["on"])
     camera.set_cooler(on)
+    telemetry.refresh(kymera=False)
     return jsonify({"cooler": on})
 
 @app.route("/api/camera/temperature")
 def get_temperature():
+    snap = telemetry.snapshot()
     return jsonify({
-        "temperature": camera.get_temperature(),
-        "status": camera.get_temp_status()
+        "temperature": snap.camera.get("temperature"),
+        "status": snap.camera.get("temperature_status"),
+        "timestamp": snap.camera_time
     })
 
+@app.route("/api/camera/temperature/history")
+def get_temperature_history():
+    """Min/max/mean temperature per bin; ?start=&end= (unix s) or ?window= (s back from now), ?bins="""
+    end = request.args.get("end", type=float, default=time.time())
+    window = request.args.get("window", type=float)
+    start = request.args.get("start", type=float, default=None if window is None else end - window)
+    bins = min(request.args.get("bins", type=int, default=500), 10000)
+    history = camera.temperature_history.query(start, end, bins)
+    data = {key: np.where(np.isnan(value), None, value).tolist() if value.dtype.kind == "f" else value.tolist()
+            for key, value in history.items()}
+    data["status_names"] = camera.temperature_history.STATUSES
+    data["fan_names"] = camera.temperature_history.FAN_MODES
+    return jsonify(data)
+
+@app.route("/api/camera/frames", methods=["POST"])
+def set_frame_saving():
+    """Save the raw frame of every acquisition as FITS in "directory" (null stops), in the background"""
+    data = request.json
+    spec.set_frame_saving(data.get("directory"), save_preview=bool(data.get("preview", True)))
+    return jsonify({"directory": spec.frame_directory, "preview": spec.save_previews})
+
+@app.route("/api/camera/writer")
+def writer_status():
+    """Background image writer backpressure: pending, rejected and failed writes"""
+    status = camera.writer.status() if camera.writer is not None else None
+    return jsonify({"writer": status, "directory": spec.frame_directory, "last_frame": spec.last_frame_path})
+
 @app.route("/api/camera/roi", methods=["POST"])
 def set_roi():
     data = request.json
@@ -55,22 +143,28 @@ def set_roi():
         vstart=data.get("vstart", 0),
         vend=data.get("vend")
     )
+    # binning and ROI change the pixel count and width of the calibration axis
+    kymera.setup_from_camera(camera.cam)
+    telemetry.refresh()
     return jsonify({"status": "roi set"})
 
 @app.route("/api/kymera/status")
 def kymera_status():
-    return jsonify(kymera.get_status())
+    snap = telemetry.snapshot()
+    return snapshot_response(snap.kymera, snap.kymera_time, snap.error)
 
 @app.route("/api/kymera/grating", methods=["POST"])
 def set_grating():
     idx = int(request.json["index"])
     kymera.set_grating(idx)
+    telemetry.refresh()
     return jsonify({"grating": idx})
 
 @app.route("/api/kymera/central_wavelength", methods=["POST"])
 def set_central_wavelength():
     wl = float(request.json["wavelength_nm"])
     kymera.set_central_wavelength(wl)
+    telemetry.refresh()
     return jsonify({"central_wavelength_nm": wl})
 
 @app.route("/api/kymera/central_wavelength")
@@ -87,40 +181,162 @@ def set_slit_width():
 def get_slit_width():
     return jsonify({"slit_width_um": kymera.get_slit_width_um()})
 
+@app.route("/api/spectrum/axis")
+def get_spectrum_axis():
+    """Wavelength and Raman axes, cached by clients through the calibration ETag"""
+    laser_wl = request.args.get("laser_wavelength_nm", type=float, default=last_laser_wl)
+    wl = kymera.get_calibration_nm()
+    calib_id = calibration_id(wl)
+    raman = spec.wavelength_to_raman_shift(wl, laser_wl) if laser_wl else None
+
+    mime = request.accept_mimetypes.best_match(["application/json", SPECTRUM_NPY], default="application/json")
+    if mime == SPECTRUM_NPY:
+        axes = np.vstack([wl, raman if raman is not None else np.full_like(wl, np.nan)])
+        resp = make_response(encode_npy(axes))
+        resp.headers["Content-Type"] = SPECTRUM_NPY
+    else:
+        resp = jsonify({
+            "calibration_id": calib_id,
+            "laser_wavelength_nm": laser_wl,
+            "wavelength_nm": wl.tolist(),
+            "raman_shift": None if raman is None else raman.tolist()
+        })
+    resp.set_etag(f"{calib_id}-{laser_wl}-{mime.rsplit('/', 1)[-1]}")
+    resp.headers["X-Calibration-Id"] = calib_id
+    resp.headers["Cache-Control"] = "no-cache"
+    resp.vary.add("Accept")
+    return resp.make_conditional(request)
+
+def live_conflict():
+    """409 response while live spectra are streaming: a snap would stop the camera stream"""
+    if broadcaster.running:
+        return jsonify({"error": "live acquisition is running; stop it first"}), 409
+    return None
+
+def run_job(laser_wl, method="acquire_spectrum", **options):
+    """Run an acquisition on the job executor, in order with queued jobs; return (job, error response)"""
+    job = jobs.wait(jobs.submit(laser_wl, method, **options))
+    if job["state"] == "error":
+        return job, (jsonify(jobs.summary(job)), 500)
+    return job, None
+
 @app.route("/api/spectrum/acquire", methods=["POST"])
 def acquire_spectrum():
+    global last_laser_wl
     laser_wl = float(request.json["laser_wavelength_nm"])
-    spectrum, wl, raman = spec.acquire_spectrum(laser_wl)
-    return jsonify({
-        "wavelength_nm": wl.tolist(),
-        "raman_shift": raman.tolist(),
-        "intensity": spectrum.tolist()
-    })
+    conflict = live_conflict()
+    if conflict:
+        return conflict
+    last_laser_wl = laser_wl
+    job, error = run_job(laser_wl)
+    if error:
+        return error
+    spectrum, wl, raman = job["result"]
+    return spectrum_response(spectrum, wl, raman)
+
+@app.route("/api/spectrum/acquire_tracks", methods=["POST"])
+def acquire_tracks():
+    """One spectrum per track (multi-track readout, or "bands" row ranges in image mode)"""
+    data = request.json
+    conflict = live_conflict()
+    if conflict:
+        return conflict
+    job, error = run_job(float(data["laser_wavelength_nm"]), "acquire_tracks", bands=data.get("bands"))
+    if error:
+        return error
+    tracks, wl, raman = job["result"]
+    resp = spectrum_response(tracks, wl, raman)
+    resp.headers["X-Tracks"] = str(len(tracks))
+    return resp
 
 @app.route("/api/spectrum/acquire_async", methods=["POST"])
 def acquire_spectrum_async():
+    global last_laser_wl
     laser_wl = float(request.json["laser_wavelength_nm"])
-    def worker():
-        global last_spectrum
-        last_spectrum = spec.acquire_spectrum(laser_wl)
-    
-    threading.Thread(target=worker, daemon=True).start()
-    return jsonify({"status": "acquisition started"})
+    conflict = live_conflict()
+    if conflict:
+        return conflict
+    last_laser_wl = laser_wl
+    job_id = jobs.submit(laser_wl)
+    return jsonify({"job_id": job_id, "state": "queued"}), 202
+
+@app.route("/api/jobs")
+def list_jobs():
+    return jsonify({"status": jobs.status(), "jobs": jobs.list_jobs()})
+
+@app.route("/api/jobs/<job_id>")
+def get_job(job_id):
+    """Job record; ?wait=<seconds> long-polls until the job finishes"""
+    wait = request.args.get("wait", type=float)
+    job = jobs.wait(job_id, timeout=min(wait, 60)) if wait else jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "unknown job"}), 404
+    return jsonify(jobs.summary(job)), 200 if job["finished"] else 202
+
+@app.route("/api/jobs/<job_id>/spectrum")
+def get_job_spectrum(job_id):
+    wait = request.args.get("wait", type=float)
+    job = jobs.wait(job_id, timeout=min(wait, 60)) if wait else jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "unknown job"}), 404
+    if job["state"] == "error":
+        return jsonify(jobs.summary(job)), 500
+    if job["result"] is None:
+        return jsonify(jobs.summary(job)), 202
+
+    spectrum, wl, raman = job["result"]
+    return spectrum_response(spectrum, wl, raman)
 
 @app.route("/api/spectrum/last")
 def get_last_spectrum():
-    if "last_spectrum" in globals():
+    result = jobs.last_result()
+    if result is None:
         return jsonify({"error": "no spectrum acquired yet"}), 404
     
-    spectrum, wl, raman = last_spectrum
-    return jsonify({
-        "wavelength_nm": wl.tolist(),
-        "raman_shift": raman.tolist(),
-        "intensity": spectrum.tolist()
-    })
+    spectrum, wl, raman = result
+    return spectrum_response(spectrum, wl, raman)
+
+@app.route("/api/live/start", methods=["POST"])
+def start_live():
+    global last_laser_wl
+    laser_wl = float(request.json["laser_wavelength_nm"])
+    cycle = float(request.json.get("cycle_time", 0))
+    if jobs.busy():
+        return jsonify({"error": "acquisition jobs are pending; wait for them first"}), 409
+    last_laser_wl = laser_wl
+    broadcaster.start(laser_wl, cycle_time=cycle)
+    return jsonify(broadcaster.status())
+
+@app.route("/api/live/stop", methods=["POST"])
+def stop_live():
+    broadcaster.stop()
+    return jsonify(broadcaster.status())
+
+@app.route("/api/live/status")
+def live_status():
+    return jsonify(broadcaster.status())
+
+@app.route("/api/spectrum/stream")
+def stream_spectra():
+    """Server-sent events with every live spectrum; slow clients drop their oldest spectra"""
+    sub = broadcaster.subscribe(maxlen=request.args.get("queue", type=int))
+
+    def events():
+        try:
+            yield "retry: 1000\n\n"
+            while True:
+                event = sub.get(timeout=15)
+                yield event if event is not None else ": keepalive\n\n"
+        finally:
+            broadcaster.unsubscribe(sub)
+
+    return Response(events(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 @app.route("/api/shutdown", methods=["POST"])
 def shutdown():
+    broadcaster.stop()
+    telemetry.stop()
     camera.shutdown()
     kymera.disconnect()
     return jsonify({"status": "shutdown complete"})
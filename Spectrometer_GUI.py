@@ -1,4 +1,6 @@
 import sys 
+import threading
+import time
 from PyQt6.QtCore import pyqtSignal
 import numpy as np 
 from numpy.random import noncentral_chisquare
@@ -6,14 +8,13 @@ import pyqtgraph as pg
 pg.setConfigOptions(antialias=True)
 from PyQt6.QtWidgets import (
     QApplication, QWidget,  QPushButton, QVBoxLayout, QGridLayout,QLabel, 
-    QLineEdit, QMessageBox, QComboBox, QGroupBox, QHBoxLayout, QSpinBox, QDoubleSpinBox
+    QLineEdit, QMessageBox, QComboBox, QGroupBox, QHBoxLayout, QSpinBox, QDoubleSpinBox,
+    QCheckBox
 )
 from PyQt6.QtCore import QThread, pyqtSignal, QTimer, Qt
 import matplotlib.pyplot as plt 
 
-from Spectrometer import (
-    AndorCameraController, KymeraController, SpectrometerController
-)
+from Spectrometer import create_controllers
 
 class AcquireWorker(QThread):
     finished = pyqtSignal(object, object, object)
@@ -36,17 +37,114 @@ class AcquireWorker(QThread):
         except Exception as e:
             self.error.emit(repr(e))
 
+class LiveWorker(QThread):
+    """
+    Live-mode producer: waits for new camera frames, reduces them to spectra and
+    emits the newest one (or the running average) ready to plot, with frame counters.
+    """
+    spectrum_ready = pyqtSignal(object, object, object, object)
+    error = pyqtSignal(str)
+
+    def __init__(self, spec, laser_wl, cycle_time=0, average=False, ema_alpha=None):
+        super().__init__()
+        self.spec = spec
+        self.cam = spec.camera
+        self.laser_wl = laser_wl
+        self.cycle_time = cycle_time
+        self.average = average
+        self.ema_alpha = ema_alpha
+        self.processed = 0
+        self._stop = threading.Event()
+
+    def set_laser_wavelength(self, laser_wl):
+        self.laser_wl = laser_wl
+
+    def run(self):
+        try:
+            if self.average:
+                self.spec.start_accumulation(self.ema_alpha)
+            self.cam.start_stream(cycle_time=self.cycle_time)
+            while not self._stop.is_set():
+                if not self.cam.wait_stream(timeout=0.5):
+                    continue
+                self.cam.drain_stream()
+                indices, _, frames = self.cam.stream.read_new()
+                if not len(indices):
+                    continue
+                # same corrections as a single acquisition (dark, cosmic rays, extraction, baseline)
+                spectra = self.spec.spectra_from_frames(frames)
+                self.processed += len(spectra)
+
+                wl = self.spec.get_wavelength_axis()
+                raman = self.spec.wavelength_to_raman_shift(wl, self.laser_wl)
+                status = self.cam.stream_status()
+                stats = {
+                    "frame": int(indices[-1]),
+                    "acquired": status["last_index"] + 1,
+                    "processed": self.processed,
+                    "dropped": status["dropped_camera"] + status["dropped_buffer"],
+                }
+                spectrum = spectra[-1]
+                if self.average:
+                    self.spec.accumulate(spectra, wl)
+                    spectrum = self.spec.accumulator.mean
+                    stats.update(self.spec.accumulator.status())
+                self.spectrum_ready.emit(spectrum, wl, raman, stats)
+        except Exception as e:
+            self.error.emit(repr(e))
+        finally:
+            if self.average:
+                self.spec.stop_accumulation()
+            try:
+                self.cam.stop_stream()
+            except Exception as e:
+                self.error.emit(repr(e))
+
+    def stop(self):
+        self._stop.set()
+        self.wait()
+
+class TelemetryWorker(QThread):
+    """Polls temperature/cooler/fan off the UI thread and drives the automatic fan mode"""
+    updated = pyqtSignal(float, str, bool, str)
+    error = pyqtSignal(str)
+
+    def __init__(self, cam, interval=1.0, fan_threshold=10):
+        super().__init__()
+        self.cam = cam
+        self.interval = interval
+        self.fan_threshold = fan_threshold
+        self._stop = threading.Event()
+
+    def run(self):
+        while not self._stop.is_set():
+            if self.cam.connected:
+                try:
+                    temp = self.cam.get_temperature()
+                    status = self.cam.get_temp_status()
+                    cooler = self.cam.cooler()
+                    self.cam.update_fan_auto(threshold=self.fan_threshold, current_temp=temp)
+                    self.cam.record_temperature(temp, status, cooler)
+                    self.updated.emit(temp, str(status), bool(cooler), self.cam.fan_mode or "--")
+                except Exception as e:
+                    self.error.emit(repr(e))
+            self._stop.wait(self.interval)
+
+    def stop(self):
+        self._stop.set()
+        self.wait()
+
 class SpectrometerGUI(QWidget):
     def __init__(self):
         super().__init__()
         self.setWindowTitle("Spectrometer")
 
-        self.cam = AndorCameraController()
-        self.kymera = KymeraController()
-        self.spec = SpectrometerController(self.cam, self.kymera)
+        # SPECTROMETER_BACKEND=sim runs the GUI against the simulated instrument
+        self.cam, self.kymera, self.spec = create_controllers()
 
         self.connect_btn = QPushButton("Connect")
         self.acquire_btn = QPushButton("Acquire Spectrum")
+        self.save_frames_check = QCheckBox("Save frames (FITS)")
 
         self.laser_edit = QLineEdit("532")
         self.status_label = QLabel("Disconnected")
@@ -65,6 +163,19 @@ class SpectrometerGUI(QWidget):
         self.plot_widget.showGrid(x=True, y=True)
 
         self.spectrum_curve = self.plot_widget.plot([], [])
+        self.spectrum_curve.setDownsampling(auto=True, method="peak")
+        self.spectrum_curve.setClipToView(True)
+
+        # Render scheduler: new spectra only mark the plot dirty, the render timer draws
+        # the newest one at most max_display_fps times per second
+        self.max_display_fps = 30
+        self._plot_pending_since = None
+        self._axis_mode = None
+        self._render_latency_ms = None
+        self.render_label = QLabel("Render: -- ms")
+        self.render_timer = QTimer()
+        self.render_timer.timeout.connect(self.render_pending_plot)
+        self.render_timer.start(int(1000 / self.max_display_fps))
 
         cooling_box = QGroupBox("Cooling")
         cooling_layout = QHBoxLayout()
@@ -331,6 +442,15 @@ class SpectrometerGUI(QWidget):
         self.cont_cycle_spin.setValue(0.1)
         cont_layout.addWidget(QLabel("Cycle time (s):"))
         cont_layout.addWidget(self.cont_cycle_spin)
+        self.live_average_check = QCheckBox("Average")
+        self.live_ema_spin = QDoubleSpinBox()
+        self.live_ema_spin.setRange(0, 1)
+        self.live_ema_spin.setDecimals(3)
+        self.live_ema_spin.setSingleStep(0.01)
+        self.live_ema_spin.setToolTip("EMA weight of each new spectrum (0 = equal weights)")
+        cont_layout.addWidget(self.live_average_check)
+        cont_layout.addWidget(QLabel("EMA:"))
+        cont_layout.addWidget(self.live_ema_spin)
         self.cont_params_box.setLayout(cont_layout)
         acq_layout.addWidget(self.cont_params_box)
 
@@ -341,8 +461,9 @@ class SpectrometerGUI(QWidget):
         controls_layout.addWidget(self.start_cont_btn)
         controls_layout.addWidget(self.stop_cont_btn)
 
-        self.live_timer = QTimer()
-        self.live_timer.timeout.connect(self.update_live_spectrum)
+        self.live_worker = None
+        self.live_stats = None
+        self.live_displayed = 0
 
         acq_box.setLayout(acq_layout)
         controls_layout.addWidget(acq_box)
@@ -367,9 +488,11 @@ class SpectrometerGUI(QWidget):
         plot_layout.addWidget(self.laser_edit)
         plot_layout.addWidget(self.connect_btn)
         plot_layout.addWidget(self.acquire_btn)
+        plot_layout.addWidget(self.save_frames_check)
         plot_layout.addWidget(self.status_label)
         plot_layout.addWidget(self.xaxis_combo)
         plot_layout.addWidget(self.plot_widget, stretch=1)
+        plot_layout.addWidget(self.render_label)
 
         main_layout.addLayout(controls_layout, stretch=0)
         main_layout.addLayout(plot_layout, stretch=1)
@@ -377,6 +500,7 @@ class SpectrometerGUI(QWidget):
         #self.setLayout(main_layout)
         self.connect_btn.clicked.connect(self.connect_devices)
         self.acquire_btn.clicked.connect(self.acquire)
+        self.save_frames_check.toggled.connect(self.set_frame_saving)
         self.cooler_on.clicked.connect(self.enable_cooling)
         self.cooler_off.clicked.connect(self.disable_cooling)
         self.apply_roi_btn.clicked.connect(self.apply_roi)
@@ -390,11 +514,13 @@ class SpectrometerGUI(QWidget):
         self.acq_mode_combo.currentTextChanged.connect(self.update_acquisition_ui)
         self.set_exposure_btn.clicked.connect(self.set_exposure_from_gui)
         self.start_cont_btn.clicked.connect(self.start_live)
+        self.laser_edit.textChanged.connect(self.update_live_laser)
         self.stop_cont_btn.clicked.connect(self.stop_live)
 
-        self.temp_timer = QTimer()
-        self.temp_timer.timeout.connect(self.update_temperature)
-        self.temp_timer.start(1000)
+        self.telemetry_worker = TelemetryWorker(self.cam, interval=1.0)
+        self.telemetry_worker.updated.connect(self.update_temperature)
+        self.telemetry_worker.error.connect(self.show_telemetry_error)
+        self.telemetry_worker.start()
 
 
         self.set_connected(False)
@@ -465,21 +591,11 @@ class SpectrometerGUI(QWidget):
         except Exception as e:
             QMessageBox.critical(self, "Cooling error", str(e))
     
-    def update_temperature(self):
-        if not self.cam.connected:
-            self.temp_status_label.setText("Temp: -- °C | Status: Disconnected")
-            return 
-        
-        try:
-            temp = self.cam.get_temperature()
-            status = self.cam.get_temp_status()
-            cooler = self.cam.cooler()
-            self.cam.update_fan_auto(threshold=10)
-            fan = self.cam.get_fan_mode()
-        
-            self.temp_status_label.setText(f"Temp: {temp:.1f} °C | Status: {status} | Cooler: {'ON' if cooler else 'OFF'} | Fan: {fan}")
-        except Exception as e:
-            pass 
+    def update_temperature(self, temp, status, cooler, fan):
+        self.temp_status_label.setText(f"Temp: {temp:.1f} °C | Status: {status} | Cooler: {'ON' if cooler else 'OFF'} | Fan: {fan}")
+
+    def show_telemetry_error(self, msg):
+        self.temp_status_label.setText(f"Temp: -- °C | Telemetry error: {msg}")
     
     def set_fan_mode(self, mode):
         try:
@@ -661,25 +777,57 @@ class SpectrometerGUI(QWidget):
         self.worker.start()
     
     def update_plot(self):
+        """Schedule a redraw; only the newest spectrum is drawn on the next render tick"""
         if self.last_spectrum is None:
             return 
-        
-        if self.xaxis_combo.currentText().startswith("Raman"):
-            x = self.last_raman
-            self.plot_widget.setLabel("bottom", "Raman shift (cm${-1}$)")
-            self.plot_widget.getViewBox().invertX(True)
-        else:
-            x = self.last_wavelength
-            self.plot_widget.setLabel("bottom", "Wavelength (nm)")
-            self.plot_widget.getViewBox().invertX(False)
-        
+        if self._plot_pending_since is None:
+            self._plot_pending_since = time.perf_counter()
+
+    def render_pending_plot(self):
+        if self._plot_pending_since is None:
+            return
+
+        raman_mode = self.xaxis_combo.currentText().startswith("Raman")
+        if raman_mode != self._axis_mode:
+            if raman_mode:
+                self.plot_widget.setLabel("bottom", "Raman shift (cm${-1}$)")
+            else:
+                self.plot_widget.setLabel("bottom", "Wavelength (nm)")
+            self.plot_widget.getViewBox().invertX(raman_mode)
+            self._axis_mode = raman_mode
+        x = self.last_raman if raman_mode else self.last_wavelength
+
         self.spectrum_curve.setData(x, self.last_spectrum)
+
+        latency = (time.perf_counter() - self._plot_pending_since) * 1000
+        self._plot_pending_since = None
+        if self._render_latency_ms is None:
+            self._render_latency_ms = latency
+        else:
+            self._render_latency_ms += 0.1 * (latency - self._render_latency_ms)
+        self.render_label.setText(f"Render: {self._render_latency_ms:.1f} ms")
+
+        if self.live_worker is not None and self.live_stats is not None:
+            self.live_displayed += 1
+            stats = self.live_stats
+            text = (f"Live: acquired {stats['acquired']} | processed {stats['processed']} | "
+                    f"displayed {self.live_displayed} | dropped {stats['dropped']}")
+            if stats.get("median_snr") is not None:
+                text += f" | averaged {stats['count']} | SNR {stats['median_snr']:.1f}"
+            self.status_label.setText(text)
     
     def update_plot_axis(self):
         self.update_plot()
 
+    def set_frame_saving(self, on):
+        # frames go to the camera's background writer, so saving never blocks acquisition
+        self.spec.set_frame_saving("frames" if on else None)
+
     def show_result(self, spectrum, wl, raman):
-        self.status_label.setText("Done")
+        status = "Done"
+        if self.spec.frame_directory is not None:
+            status += " (saved)" if self.spec.last_frame_path else " (frame not saved: writer busy)"
+        self.status_label.setText(status)
 
         self.last_spectrum = spectrum
         self.last_wavelength = wl
@@ -690,51 +838,62 @@ class SpectrometerGUI(QWidget):
     
     def start_live(self):
         try:
-            self.cam.set_acquisition_mode("cont")
-            cycle = self.cont_cycle_spin.value()
-            self.cam.setup_cont_mode(cycle_time=cycle)
-            self.cam.start_acquisition()
-            self.live_timer.start(int(cycle*1000))
-            self.start_cont_btn.setEnabled(False)
-            self.stop_cont_btn.setEnabled(True)
-            self.status_label.setText("Live acquisition started")
+            laser_wl = float(self.laser_edit.text())
+        except ValueError:
+            QMessageBox.warning(self, "Input error", "Laser wavelength must be a number")
+            return
 
-        except Exception as e:
-            QMessageBox.critical(self, "Live error", str(e))
-    
-    def update_live_spectrum(self):
+        cycle = self.cont_cycle_spin.value()
+        self.live_stats = None
+        self.live_displayed = 0
+        ema = self.live_ema_spin.value() or None
+        self.live_worker = LiveWorker(self.spec, laser_wl, cycle_time=cycle,
+                                      average=self.live_average_check.isChecked(), ema_alpha=ema)
+        self.live_worker.spectrum_ready.connect(self.show_live_spectrum)
+        self.live_worker.error.connect(self.show_live_error)
+        self.live_worker.start()
+        self.start_cont_btn.setEnabled(False)
+        self.stop_cont_btn.setEnabled(True)
+        self.status_label.setText("Live acquisition started")
+
+    def update_live_laser(self, text):
+        if self.live_worker is None:
+            return
         try:
-            image = self.cam.get_newest_image()
-            spectrum = image.mean(axis=0)
-
-            wl = self.kymera.get_calibration_nm()
-            laser_wl = float(self.laser_edit.text())
-            raman = self.spec.wavelength_to_raman_shift(wl, laser_wl)
+            self.live_worker.set_laser_wavelength(float(text))
+        except ValueError:
+            pass
 
-            self.last_spectrum = spectrum
-            self.last_wavelength = wl
-            self.last_raman = raman
+    def show_live_spectrum(self, spectrum, wl, raman, stats):
+        self.last_spectrum = spectrum
+        self.last_wavelength = wl
+        self.last_raman = raman
+        self.live_stats = stats
+        self.update_plot()
 
-            self.update_plot()
-        
-        except Exception:
-            pass 
+    def show_live_error(self, msg):
+        self.stop_live()
+        QMessageBox.critical(self, "Live error", msg)
     
     def stop_live(self):
-        self.live_timer.stop()
-        self.cam.stop_acquisition()
+        if self.live_worker is not None:
+            self.live_worker.stop()
+            self.live_worker = None
 
         self.start_cont_btn.setEnabled(True)
         self.stop_cont_btn.setEnabled(False)
         self.status_label.setText("Live acquisition stopped")
 
-
-
-    
     def show_error(self, msg):
         QMessageBox.critical(self, "Acquisition error", msg)
         self.status_label.setText("Error")
         self.acquire_btn.setEnabled(True)
+
+    def closeEvent(self, event):
+        self.stop_live()
+        self.telemetry_worker.stop()
+        self.cam.close_writer()
+        super().closeEvent(event)
     
 if __name__ == "__main__":
     app = QApplication(sys.argv)
@@ -0,0 +1,326 @@
+import hashlib
+import io
+import json
+import os
+import queue
+import struct
+import threading
+from collections import deque
+
+import matplotlib.pyplot as plt
+import numpy as np
+from astropy.io import fits
+
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+# File writers shared by the controllers. Spectra are written from whole arrays
+# (no per-pixel Python loops) so saving keeps up with acquisition.
+
+
+# Spectrum export
+def _columns(wavelength_nm, spectrum, raman=None):
+    names = ["wavelength_nm"]
+    cols = [np.asarray(wavelength_nm, dtype=float)]
+    if raman is not None:
+        names.append("raman_shift")
+        cols.append(np.asarray(raman, dtype=float))
+    names.append("intensity")
+    cols.append(np.asarray(spectrum, dtype=float))
+    return names, cols
+
+
+def write_spectrum_csv(path, wavelength_nm, spectrum, metadata, raman=None, float_fmt="%.10g"):
+    "CSV with a '# key: value' metadata block, written with one formatted write"
+    names, cols = _columns(wavelength_nm, spectrum, raman)
+    data = np.column_stack(cols)
+    row = ",".join([float_fmt] * data.shape[1]) + "\n"
+    header = "".join(f"# {key}: {value}\n" for key, value in metadata.items())
+    with open(path, "w") as f:
+        f.write(header)
+        f.write(",".join(names) + "\n")
+        f.write((row * len(data)) % tuple(data.ravel()))
+    return path
+
+
+def write_spectrum_npz(path, wavelength_nm, spectrum, metadata, raman=None):
+    "Uncompressed NumPy archive; metadata stored as a JSON string"
+    names, cols = _columns(wavelength_nm, spectrum, raman)
+    arrays = dict(zip(names, cols))
+    np.savez(path, metadata=json.dumps(metadata, default=str), **arrays)
+    return path
+
+
+def write_spectrum_hdf5(path, wavelength_nm, spectrum, metadata, raman=None, chunk_rows=64):
+    """
+    Append a spectrum to an HDF5 file.
+
+    The first call creates the axes and a chunked, resizable (n_spectra, n_pixels)
+    `intensity` dataset; later calls append one row and its JSON metadata.
+    """
+    if h5py is None:
+        raise RuntimeError("HDF5 export requires h5py")
+    wavelength_nm = np.asarray(wavelength_nm, dtype=float)
+    spectrum = np.asarray(spectrum, dtype=float)
+    n = len(wavelength_nm)
+    with h5py.File(path, "a") as f:
+        if "intensity" not in f:
+            f.create_dataset("wavelength_nm", data=wavelength_nm)
+            if raman is not None:
+                f.create_dataset("raman_shift", data=np.asarray(raman, dtype=float))
+            f.create_dataset("intensity", shape=(0, n), maxshape=(None, n), dtype="f8",
+                             chunks=(chunk_rows, n), compression="lzf")
+            f.create_dataset("metadata", shape=(0,), maxshape=(None,), dtype=h5py.string_dtype(),
+                             chunks=(chunk_rows,))
+        elif f["intensity"].shape[1] != n or not np.allclose(f["wavelength_nm"][:], wavelength_nm):
+            raise ValueError(f"{path} holds spectra on a different wavelength axis")
+        row = f["intensity"].shape[0]
+        f["intensity"].resize(row + 1, axis=0)
+        f["intensity"][row] = spectrum
+        f["metadata"].resize(row + 1, axis=0)
+        f["metadata"][row] = json.dumps(metadata, default=str)
+    return path
+
+
+SPECTRUM_WRITERS = {
+    "csv": (write_spectrum_csv, ".csv"),
+    "npz": (write_spectrum_npz, ".npz"),
+    "hdf5": (write_spectrum_hdf5, ".h5"),
+}
+
+
+def write_spectrum(path, wavelength_nm, spectrum, metadata, raman=None, fmt="csv"):
+    if fmt not in SPECTRUM_WRITERS:
+        raise ValueError(f"Unknown spectrum format: {fmt} (expected one of {list(SPECTRUM_WRITERS)})")
+    writer, _ = SPECTRUM_WRITERS[fmt]
+    return os.path.abspath(writer(path, wavelength_nm, spectrum, metadata, raman=raman))
+
+
+# Binary spectrum transport
+# Intensities travel as raw little-endian values behind a fixed 28-byte header:
+# magic, version, dtype code, reserved, pixel count, calibration id (16 ASCII chars).
+# The wavelength/Raman axes are fetched once and matched by calibration id.
+SPECTRUM_MAGIC = b"SPEC"
+SPECTRUM_HEADER = struct.Struct("<4sBBHI16s")
+SPECTRUM_DTYPES = {1: np.dtype("<f4"), 2: np.dtype("<u4")}
+
+
+def calibration_id(wavelength_nm):
+    "Short content hash identifying a wavelength axis"
+    data = np.ascontiguousarray(wavelength_nm, dtype="<f8")
+    return hashlib.sha1(data.tobytes()).hexdigest()[:16]
+
+
+def encode_spectrum(intensity, calib_id):
+    intensity = np.asarray(intensity)
+    code = 2 if intensity.dtype.kind in "iu" and intensity.min(initial=0) >= 0 else 1
+    data = np.ascontiguousarray(intensity.ravel(), dtype=SPECTRUM_DTYPES[code])
+    header = SPECTRUM_HEADER.pack(SPECTRUM_MAGIC, 1, code, 0, len(data), calib_id.encode("ascii"))
+    return header + data.tobytes()
+
+
+def decode_spectrum(payload):
+    "Return (intensity, calibration id) from an `encode_spectrum` payload"
+    magic, _, code, _, n, calib_id = SPECTRUM_HEADER.unpack_from(payload)
+    if magic != SPECTRUM_MAGIC:
+        raise ValueError("Not a binary spectrum payload")
+    data = np.frombuffer(payload, dtype=SPECTRUM_DTYPES[code], count=n, offset=SPECTRUM_HEADER.size)
+    return data, calib_id.decode("ascii")
+
+
+def encode_npy(array):
+    buf = io.BytesIO()
+    np.save(buf, np.asarray(array), allow_pickle=False)
+    return buf.getvalue()
+
+
+# Images
+def write_fits(path, image, metadata):
+    "Write `image` as a primary HDU with `metadata` as header cards"
+    hdr = fits.Header()
+    for key, value in metadata.items():
+        hdr[key] = value
+    fits.PrimaryHDU(image, header=hdr).writeto(path, overwrite=True)
+    return path
+
+
+def write_preview_png(path, image, max_size=None):
+    "Grayscale PNG preview, decimated so neither side exceeds `max_size` pixels"
+    image = np.atleast_2d(image)
+    if max_size:
+        step = max(int(np.ceil(max(image.shape) / max_size)), 1)
+        image = image[::step, ::step]
+    plt.imsave(path, image, cmap="gray")
+    return path
+
+
+class AsyncImageWriter:
+    """
+    Background thread writing FITS images (and optional PNG previews) from a bounded queue.
+
+    `submit` never blocks by default: when the queue is full the frame is rejected and
+    counted, so a slow disk shows up as backpressure instead of stalling acquisition.
+    Failed writes are counted; only the last `max_errors` (path, error) pairs are kept.
+    """
+    def __init__(self, max_queue=32, preview_max_size=512, max_errors=100):
+        self.preview_max_size = preview_max_size
+        self.written = 0
+        self.rejected = 0
+        self.failed = 0
+        self.errors = deque(maxlen=max_errors)
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = threading.Thread(target=self._run, name="AsyncImageWriter", daemon=True)
+        self._thread.start()
+
+    def submit(self, path, image, metadata, save_preview=True, block=False, timeout=None):
+        "Queue an image for writing; return False if the queue is full"
+        item = (path, np.array(image, copy=True), dict(metadata), save_preview)
+        try:
+            self._queue.put(item, block=block, timeout=timeout)
+        except queue.Full:
+            self.rejected += 1
+            return False
+        return True
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                path, image, metadata, save_preview = item
+                write_fits(path, image, metadata)
+                if save_preview:
+                    write_preview_png(os.path.splitext(path)[0] + ".png", image, self.preview_max_size)
+                self.written += 1
+            except Exception as e:
+                self.failed += 1
+                self.errors.append((item[0], repr(e)))
+            finally:
+                self._queue.task_done()
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def status(self):
+        return {
+            "pending": self.pending(),
+            "capacity": self._queue.maxsize,
+            "written": self.written,
+            "rejected": self.rejected,
+            "errors": self.failed,
+            "last_error": self.errors[-1] if self.errors else None,
+        }
+
+    def flush(self):
+        "Block until every queued image is on disk"
+        self._queue.join()
+
+    def close(self):
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+
+
+FITS_BLOCK = 2880
+FITS_BITPIX = {
+    np.dtype(np.uint8): 8,
+    np.dtype(np.int16): 16,
+    np.dtype(np.int32): 32,
+    np.dtype(np.int64): 64,
+    np.dtype(np.float32): -32,
+    np.dtype(np.float64): -64,
+}
+
+
+def _fits_padded(nbytes):
+    return -(-nbytes // FITS_BLOCK) * FITS_BLOCK
+
+
+class FitsSeriesWriter:
+    """
+    Pre-sized FITS data cube (n_frames, rows, cols) filled through a memory map.
+
+    The file is allocated once; each frame is a plain memory copy. On close the cube is
+    trimmed to the number of frames written and a FRAMES binary table with the frame
+    index, timestamp and exposure of every plane is appended.
+    """
+    def __init__(self, path, n_frames, frame_shape, metadata=None, dtype=np.int32):
+        dtype = np.dtype(dtype)
+        if dtype not in FITS_BITPIX:
+            raise ValueError(f"Unsupported FITS data type: {dtype}")
+        rows, cols = frame_shape
+        self.path = path
+        self.n_frames = int(n_frames)
+        self.count = 0
+        self.indices = np.full(self.n_frames, -1, dtype=np.int64)
+        self.timestamps = np.full(self.n_frames, np.nan)
+        self.exposures = np.full(self.n_frames, np.nan)
+
+        self._header = fits.Header()
+        self._header["SIMPLE"] = True
+        self._header["BITPIX"] = FITS_BITPIX[dtype]
+        self._header["NAXIS"] = 3
+        self._header["NAXIS1"] = cols
+        self._header["NAXIS2"] = rows
+        self._header["NAXIS3"] = self.n_frames
+        self._header["EXTEND"] = True
+        for key, value in (metadata or {}).items():
+            self._header[key] = value
+        header_bytes = self._header.tostring().encode("ascii")
+        self._data_offset = len(header_bytes)
+        self._frame_bytes = rows * cols * dtype.itemsize
+
+        with open(path, "wb") as f:
+            f.write(header_bytes)
+            f.truncate(self._data_offset + _fits_padded(self.n_frames * self._frame_bytes))
+        self._data = np.memmap(path, dtype=dtype.newbyteorder(">"), mode="r+",
+                               offset=self._data_offset, shape=(self.n_frames, rows, cols))
+
+    @property
+    def full(self):
+        return self.count >= self.n_frames
+
+    def append(self, frames, timestamps=None, exposures=None, indices=None):
+        "Write a frame or a (n, rows, cols) batch; return the number of frames stored"
+        if self._data is None:
+            raise ValueError("Series writer is closed")
+        frames = np.asarray(frames)
+        if frames.ndim == 2:
+            frames = frames[None]
+        n = min(len(frames), self.n_frames - self.count)
+        sl = slice(self.count, self.count + n)
+        self._data[sl] = frames[:n]
+        self.indices[sl] = np.arange(self.count, self.count + n) if indices is None else np.asarray(indices)[:n]
+        if timestamps is not None:
+            self.timestamps[sl] = np.broadcast_to(timestamps, len(frames))[:n]
+        if exposures is not None:
+            self.exposures[sl] = np.broadcast_to(exposures, len(frames))[:n]
+        self.count += n
+        return n
+
+    def close(self):
+        if self._data is None:
+            return self.path
+        self._data.flush()
+        self._data = None
+        if self.count < self.n_frames:
+            self._header["NAXIS3"] = self.count
+            with open(self.path, "r+b") as f:
+                f.write(self._header.tostring().encode("ascii"))
+                f.truncate(self._data_offset + _fits_padded(self.count * self._frame_bytes))
+        table = fits.BinTableHDU.from_columns([
+            fits.Column(name="FRAME", format="K", array=self.indices[:self.count]),
+            fits.Column(name="TIMESTAMP", format="D", unit="s", array=self.timestamps[:self.count]),
+            fits.Column(name="EXPOSURE", format="D", unit="s", array=self.exposures[:self.count]),
+        ], name="FRAMES")
+        fits.append(self.path, table.data, header=table.header)
+        return self.path
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,262 @@
+import numpy as np
+
+from Spectrometer_Processing import robust_sigma
+
+# Raman band analysis on batches of spectra. Fits are vectorised over spectra and
+# peaks: every band is fitted in its own window with a local linear baseline, and
+# all (spectrum, band) problems take their Levenberg-Marquardt step together.
+
+LN2 = np.log(2)
+PARAMETERS = ["amplitude", "center", "hwhm", "eta", "offset", "slope"]
+PROFILES = ["lorentzian", "gaussian", "pseudo_voigt"]
+
+
+# Detection
+def detect_peaks(spectrum, min_snr=5.0, distance=15, window=25, max_peaks=None):
+    """
+    Indices of local maxima, strongest first.
+
+    A maximum counts if its prominence -- height above the higher of the minima
+    within `window` pixels to its left and right -- exceeds `min_snr` noise units.
+    Peaks closer than `distance` pixels to a stronger one are dropped; keep it at
+    least the fit half-window, or two maxima of one band are fitted to the same centre.
+    """
+    y = np.asarray(spectrum, dtype=float)
+    padded = np.pad(y, window, mode="edge")
+    windows = np.lib.stride_tricks.sliding_window_view(padded, window + 1)
+    left_min = windows[:len(y)].min(axis=1)
+    right_min = windows[window:window + len(y)].min(axis=1)
+    prominence = y - np.maximum(left_min, right_min)
+    noise = robust_sigma(np.diff(y)) / np.sqrt(2)
+    is_max = np.zeros(len(y), dtype=bool)
+    is_max[1:-1] = (y[1:-1] > y[:-2]) & (y[1:-1] >= y[2:])
+    candidates = np.nonzero(is_max & (prominence > min_snr * noise))[0]
+    candidates = candidates[np.argsort(prominence[candidates])[::-1]]
+    peaks = []
+    for index in candidates:
+        if all(abs(index - p) >= distance for p in peaks):
+            peaks.append(index)
+            if max_peaks and len(peaks) >= max_peaks:
+                break
+    return np.array(peaks, dtype=int)
+
+
+# Model
+def profile_shape(x, center, hwhm, eta):
+    "Pseudo-Voigt of unit height: eta * Lorentzian + (1 - eta) * Gaussian, same FWHM"
+    u = (x - center) / hwhm
+    return eta / (1 + u ** 2) + (1 - eta) * np.exp(-LN2 * u ** 2)
+
+
+def band_area(amplitude, hwhm, eta):
+    return amplitude * hwhm * (eta * np.pi + (1 - eta) * np.sqrt(np.pi / LN2))
+
+
+def _model(params, x, x_ref):
+    "Model and Jacobian for params (..., 6) on x (..., W); returns (..., W) and (..., W, 6)"
+    a, c, w, eta, b0, b1 = [params[..., i:i + 1] for i in range(6)]
+    u = (x - c) / w
+    lor = 1 / (1 + u ** 2)
+    gau = np.exp(-LN2 * u ** 2)
+    shape = eta * lor + (1 - eta) * gau
+    dshape_du = eta * (-2 * u * lor ** 2) + (1 - eta) * (-2 * LN2 * u * gau)
+    dx = x - x_ref
+    y = a * shape + b0 + b1 * dx
+    jac = np.stack([
+        shape,
+        a * dshape_du * (-1 / w),
+        a * dshape_du * (-u / w),
+        a * (lor - gau),
+        np.ones_like(u),
+        dx,
+    ], axis=-1)
+    return y, jac
+
+
+# Fitting
+def _solve(lhs, rhs):
+    "Batched solve of lhs x = rhs; if any system is singular, least-norm solutions for all"
+    try:
+        return np.linalg.solve(lhs, rhs[..., None])[..., 0]
+    except np.linalg.LinAlgError:
+        finite = np.isfinite(lhs).all(axis=(-2, -1))
+        safe = np.where(finite[..., None, None], lhs, np.eye(lhs.shape[-1]))
+        delta = (np.linalg.pinv(safe) @ rhs[..., None])[..., 0]
+        return np.where(finite[..., None], delta, np.nan)
+
+
+def _windows(centers_idx, half_window, n_pixels):
+    "(K, W) pixel indices of the fitting window around each band"
+    offsets = np.arange(-half_window, half_window + 1)
+    lo = np.clip(np.asarray(centers_idx) - half_window, 0, n_pixels - len(offsets))
+    return lo[:, None] + offsets + half_window
+
+
+def initial_guess(spectra, x, peaks, half_window=15, profile="lorentzian"):
+    """Starting parameters (N, K, 6) from the data around each detected peak index"""
+    spectra = np.atleast_2d(np.asarray(spectra, dtype=float))
+    x = np.asarray(x, dtype=float)
+    idx = _windows(peaks, half_window, len(x))
+    xw, yw = x[idx], spectra[:, idx]
+    offset = (yw[..., :3].mean(axis=-1) + yw[..., -3:].mean(axis=-1)) / 2
+    slope = (yw[..., -3:].mean(axis=-1) - yw[..., :3].mean(axis=-1)) / (xw[:, -2] - xw[:, 1])
+    height = yw - offset[..., None]
+    amplitude = height.max(axis=-1)
+    center = np.broadcast_to(x[np.asarray(peaks)], amplitude.shape)
+    step = np.abs(np.diff(xw, axis=-1)).mean(axis=-1)
+    above = (height > amplitude[..., None] / 2).sum(axis=-1)
+    hwhm = np.maximum(above, 1) * step / 2
+    eta = np.full(amplitude.shape, 0.0 if profile == "gaussian" else 1.0 if profile == "lorentzian" else 0.5)
+    return np.stack([amplitude, center, hwhm, eta, offset, slope], axis=-1)
+
+
+def fit_peaks(spectra, x, peaks, init=None, profile="lorentzian", half_window=15, max_iter=50, tol=1e-6):
+    """
+    Fit one band per entry of `peaks` (pixel indices) in every spectrum of `spectra` (N, pixels).
+
+    `init` (N, K, 6) or (K, 6) are starting parameters, e.g. the previous batch's
+    result; windows are centred on their band centres. `profile` is "lorentzian",
+    "gaussian" or "pseudo_voigt" (eta free). Return a dict of (N, K) arrays:
+    amplitude, center, hwhm, fwhm, eta, area, offset, slope, chi2, converged,
+    at_limit (hwhm pinned at its lower or upper clip: no band resolved, never
+    counted as converged), plus "params" (N, K, 6) to warm-start the next call.
+    """
+    if profile not in PROFILES:
+        raise ValueError(f"Unknown profile: {profile} (expected one of {PROFILES})")
+    spectra = np.atleast_2d(np.asarray(spectra, dtype=float))
+    x = np.asarray(x, dtype=float)
+    peaks = np.asarray(peaks, dtype=int)
+    n, k = len(spectra), len(peaks)
+    if init is None:
+        params = initial_guess(spectra, x, peaks, half_window, profile)
+    else:
+        # band parameters from `init`, windows re-centred on them; the linear
+        # baseline is re-estimated because it is relative to the window centre
+        init = np.broadcast_to(init, (n, k, 6))
+        peaks = np.abs(x[None, :] - init[..., 1].mean(axis=0)[:, None]).argmin(axis=1)
+        params = initial_guess(spectra, x, peaks, half_window, profile)
+        params[..., :4] = init[..., :4]
+
+    idx = _windows(peaks, half_window, len(x))
+    xw = np.broadcast_to(x[idx], (n, k, idx.shape[1]))
+    yw = spectra[:, idx]
+    x_ref = x[peaks][None, :, None]
+    step = np.abs(np.diff(x[idx], axis=-1)).mean(axis=-1)[None, :]
+    x_lo, x_hi = xw.min(axis=-1), xw.max(axis=-1)
+    w_lo, w_hi = 0.1 * step, x_hi - x_lo
+
+    free = np.ones(6, dtype=bool)
+    free[3] = profile == "pseudo_voigt"
+    fixed = np.diag(~free).astype(float)
+
+    model, jac = _model(params, xw, x_ref)
+    resid = yw - model
+    chi2 = (resid ** 2).sum(axis=-1)
+    damping = np.full((n, k), 1e-3)
+    converged = np.zeros((n, k), dtype=bool)
+    failed = np.zeros((n, k), dtype=bool)
+    for _ in range(max_iter):
+        jac = jac * free
+        hess = np.einsum("nkwi,nkwj->nkij", jac, jac)
+        grad = np.einsum("nkwi,nkw->nki", jac, resid)
+        diag = np.einsum("nkii->nki", hess)
+        lhs = hess + damping[..., None, None] * (diag[..., None] * np.eye(6)) + fixed + 1e-12 * np.eye(6)
+        delta = _solve(lhs, grad)
+        # a degenerate window (e.g. no band in it) gives no usable step: stop it, unconverged
+        bad = ~np.isfinite(delta).all(axis=-1)
+        failed |= bad
+        delta[bad] = 0
+        trial = params + delta
+        trial[..., 1] = np.clip(trial[..., 1], x_lo, x_hi)
+        trial[..., 2] = np.clip(np.abs(trial[..., 2]), w_lo, w_hi)
+        trial[..., 3] = np.clip(trial[..., 3], 0, 1)
+        trial_model, trial_jac = _model(trial, xw, x_ref)
+        trial_resid = yw - trial_model
+        trial_chi2 = (trial_resid ** 2).sum(axis=-1)
+
+        better = trial_chi2 < chi2
+        improvement = np.where(better, (chi2 - trial_chi2) / np.maximum(chi2, 1e-300), 0)
+        params = np.where(better[..., None], trial, params)
+        resid = np.where(better[..., None], trial_resid, resid)
+        jac = np.where(better[..., None, None], trial_jac, jac)
+        chi2 = np.where(better, trial_chi2, chi2)
+        damping = np.where(better, damping / 3, damping * 4)
+        converged |= (better & (improvement < tol)) | (damping > 1e4)
+        if (converged | failed).all():
+            break
+
+    a, c, w, eta = params[..., 0], params[..., 1], params[..., 2], params[..., 3]
+    at_limit = (w <= w_lo * (1 + 1e-6)) | (w >= w_hi * (1 - 1e-6))
+    return {
+        "amplitude": a,
+        "center": c,
+        "hwhm": w,
+        "fwhm": 2 * w,
+        "eta": eta,
+        "area": band_area(a, w, eta),
+        "offset": params[..., 4],
+        "slope": params[..., 5],
+        "chi2": chi2,
+        "converged": converged & ~failed & ~at_limit,
+        "at_limit": at_limit,
+        "params": params,
+    }
+
+
+class PeakTracker:
+    """
+    Fits the same bands through a long series, batch by batch.
+
+    The first batch starts from peaks detected in its mean spectrum (or the given
+    `peaks`). Detected peaks are dropped as noise if their fits mostly end at a
+    width limit, or have a median FWHM under `min_fwhm` pixels or a non-positive
+    amplitude. Every later batch is warm-started from the last frame of the one before.
+    `series()` returns (n_frames, n_bands) arrays of every fitted quantity.
+    """
+    OUTPUTS = ["center", "fwhm", "amplitude", "area", "eta", "chi2", "converged"]
+
+    def __init__(self, x, peaks=None, profile="lorentzian", half_window=15, batch_size=256, min_fwhm=1.5,
+                 **detect_options):
+        self.x = np.asarray(x, dtype=float)
+        self.peaks = None if peaks is None else np.asarray(peaks, dtype=int)
+        self.profile = profile
+        self.half_window = half_window
+        self.batch_size = batch_size
+        self.min_fwhm = min_fwhm
+        self.detect_options = dict(detect_options)
+        self.detect_options.setdefault("distance", half_window)
+        self._params = None
+        self._results = {name: [] for name in self.OUTPUTS}
+
+    def update(self, spectra):
+        "Fit a (n, pixels) block of spectra; return the number of frames fitted so far"
+        spectra = np.atleast_2d(np.asarray(spectra, dtype=float))
+        for lo in range(0, len(spectra), self.batch_size):
+            batch = spectra[lo:lo + self.batch_size]
+            detected = self.peaks is None
+            if detected:
+                self.peaks = detect_peaks(batch.mean(axis=0), **self.detect_options)
+            if not len(self.peaks):
+                raise RuntimeError("No peaks to fit")
+            result = fit_peaks(batch, self.x, self.peaks, init=self._params, profile=self.profile,
+                               half_window=self.half_window)
+            if detected:
+                step = np.abs(np.diff(self.x)).mean()
+                keep = ((result["at_limit"].mean(axis=0) <= 0.5)
+                        & (np.median(result["fwhm"], axis=0) >= self.min_fwhm * step)
+                        & (np.median(result["amplitude"], axis=0) > 0))
+                if not keep.any():
+                    raise RuntimeError("No detected peak could be fitted")
+                self.peaks = self.peaks[keep]
+                result = {name: value[:, keep] for name, value in result.items()}
+            self._params = result["params"][-1]
+            for name in self.OUTPUTS:
+                self._results[name].append(result[name])
+        return len(self)
+
+    def series(self):
+        return {name: (np.concatenate(parts) if parts else np.zeros((0, 0)))
+                for name, parts in self._results.items()}
+
+    def __len__(self):
+        return sum(len(part) for part in self._results["center"])
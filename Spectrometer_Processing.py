@@ -0,0 +1,594 @@
+import datetime
+import functools
+import hashlib
+import json
+import os
+import threading
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy.linalg import cho_solve_banded, cholesky_banded, solveh_banded
+
+# Array-level data reduction used by SpectrometerController. Everything here works
+# on whole NumPy arrays (frames, spectra or stacks of them); loops only run over
+# chunks or iterations, never over pixels.
+
+
+# Filters
+def median_filter(data, size, axes=(-1,), chunk=64):
+    """
+    Median filter over `axes` with reflected edges, computed from sliding windows.
+
+    Rows along the first non-filtered axis are processed `chunk` at a time to bound
+    the size of the window copy.
+    """
+    data = np.asarray(data, dtype=float)
+    axes = tuple(ax % data.ndim for ax in axes)
+    half = size // 2
+    pad = [(half, half) if ax in axes else (0, 0) for ax in range(data.ndim)]
+    mode = "reflect" if all(data.shape[ax] > half for ax in axes) else "edge"
+    padded = np.pad(data, pad, mode=mode)
+    out = np.empty_like(data)
+    outer = next((ax for ax in range(data.ndim) if ax not in axes), None)
+    if outer is None:
+        windows = sliding_window_view(padded, (size,) * len(axes), axis=axes)
+        return np.median(windows, axis=tuple(range(-len(axes), 0)))
+    for lo in range(0, data.shape[outer], chunk):
+        hi = min(lo + chunk, data.shape[outer])
+        block = np.take(padded, np.arange(lo, hi), axis=outer)
+        windows = sliding_window_view(block, (size,) * len(axes), axis=axes)
+        index = [slice(None)] * data.ndim
+        index[outer] = slice(lo, hi)
+        out[tuple(index)] = np.median(windows, axis=tuple(range(-len(axes), 0)))
+    return out
+
+
+def robust_sigma(values, axis=None):
+    "Standard deviation estimated from the median absolute deviation"
+    values = np.asarray(values)
+    keep = axis is not None
+    mad = np.median(np.abs(values - np.median(values, axis=axis, keepdims=keep)), axis=axis, keepdims=keep)
+    return np.maximum(1.4826 * mad, 1e-12)
+
+
+def ccd_noise(level, read_noise, gain=1.0, bias=0.0):
+    "Expected noise (counts) of a pixel at `level` counts: shot noise plus read noise"
+    return np.sqrt(read_noise ** 2 + np.clip(level - bias, 0, None) / gain) / gain
+
+
+# Cosmic rays
+def clean_stack(stack, sigma=5.0, read_noise=None, gain=1.0, bias=0.0, chunk=None):
+    """
+    Multi-frame cosmic-ray rejection for kinetic or accumulation stacks.
+
+    Each pixel is compared with its median over the frames; values more than `sigma`
+    robust standard deviations above it are replaced by the median. Pixels are
+    processed in chunks of `chunk` columns (default: ~16M values per chunk).
+    Return (cleaned float32 stack, boolean mask of replaced values).
+    """
+    stack = np.asarray(stack)
+    n = stack.shape[0]
+    if n < 3:
+        raise ValueError("Need at least 3 frames for multi-frame cosmic ray rejection")
+    flat = stack.reshape(n, -1)
+    npix = flat.shape[1]
+    chunk = chunk or max(2 ** 24 // n, 1)
+    cleaned = np.empty(flat.shape, dtype=np.float32)
+    mask = np.zeros(flat.shape, dtype=bool)
+    for lo in range(0, npix, chunk):
+        block = flat[:, lo:lo + chunk].astype(np.float32)
+        med = np.median(block, axis=0)
+        resid = block - med
+        noise = robust_sigma(resid, axis=0) if read_noise is None else ccd_noise(med, read_noise, gain, bias)
+        hit = resid > sigma * noise
+        block[hit] = np.broadcast_to(med, block.shape)[hit]
+        cleaned[:, lo:lo + chunk] = block
+        mask[:, lo:lo + chunk] = hit
+    return cleaned.reshape(stack.shape), mask.reshape(stack.shape)
+
+
+def clean_spectra(spectra, sigma=5.0, sharpness=3.0, size=7, niter=3, read_noise=None, gain=1.0, bias=0.0):
+    """
+    Single-frame spike removal for 1D spectra (FVB/track readouts), one spectrum per row.
+
+    A pixel is a spike if it exceeds the running median by `sigma` noise units and
+    its excess is `sharpness` times larger than either neighbour's (Raman bands are
+    wider than one pixel, cosmic rays are not). Spikes are replaced by the running
+    median; repeating `niter` times catches hits spread over two pixels.
+    Return (cleaned, mask) with the input shape.
+    """
+    spectra = np.asarray(spectra, dtype=float)
+    shape = spectra.shape
+    x = np.atleast_2d(spectra).copy()
+    mask = np.zeros(x.shape, dtype=bool)
+    for _ in range(niter):
+        med = median_filter(x, size, axes=(-1,))
+        excess = x - med
+        if read_noise is None:
+            # median-filter residuals are exactly zero for ~1/size of the pixels, which
+            # biases their MAD low; first differences of the data are not
+            noise = robust_sigma(np.diff(x, axis=-1), axis=-1) / np.sqrt(2)
+        else:
+            noise = ccd_noise(med, read_noise, gain, bias)
+        padded = np.pad(excess, [(0, 0), (1, 1)], mode="edge")
+        neighbours = np.clip(np.maximum(padded[:, :-2], padded[:, 2:]), 0, None)
+        hit = (excess > sigma * noise) & (excess > sharpness * neighbours)
+        if not hit.any():
+            break
+        x[hit] = med[hit]
+        mask |= hit
+    return x.reshape(shape), mask.reshape(shape)
+
+
+def clean_frame(image, sigma=5.0, objlim=4.0, sigfrac=0.3, niter=2, read_noise=None, gain=1.0, bias=0.0):
+    """
+    Single-frame cosmic-ray rejection for 2D images (Laplacian edge detection).
+
+    Follows the L.A.Cosmic idea: the positive Laplacian, in units of the local noise,
+    flags sharp features; the fine-structure image (med3 - med7 of med3) rejects
+    real but compact features; neighbours of flagged pixels above `sigfrac * sigma`
+    are included. Flagged pixels are replaced by the 5x5 median.
+    Images with a single row are passed to `clean_spectra`. Return (cleaned, mask).
+    """
+    image = np.asarray(image, dtype=float)
+    if image.ndim == 1 or image.shape[0] == 1:
+        return clean_spectra(image, sigma=sigma, read_noise=read_noise, gain=gain, bias=bias)
+    x = image.copy()
+    mask = np.zeros(x.shape, dtype=bool)
+    for _ in range(niter):
+        p = np.pad(x, 1, mode="edge")
+        lap = np.clip(4 * x - p[:-2, 1:-1] - p[2:, 1:-1] - p[1:-1, :-2] - p[1:-1, 2:], 0, None) / 4
+        med5 = median_filter(x, 5, axes=(0, 1))
+        noise = robust_sigma(x - med5) if read_noise is None else ccd_noise(med5, read_noise, gain, bias)
+        significance = lap / noise
+        significance -= median_filter(significance, 5, axes=(0, 1))
+        med3 = median_filter(x, 3, axes=(0, 1))
+        fine = np.clip(med3 - median_filter(med3, 7, axes=(0, 1)), 0.01 * noise, None)
+        hit = (significance > sigma) & (lap / fine > objlim)
+        grown = np.pad(hit, 1)
+        near = grown[:-2, 1:-1] | grown[2:, 1:-1] | grown[1:-1, :-2] | grown[1:-1, 2:] | hit
+        hit = near & (significance > sigfrac * sigma)
+        hit &= ~mask
+        if not hit.any():
+            break
+        x[hit] = med5[hit]
+        mask |= hit
+    return x, mask
+
+
+def remove_cosmic_rays(data, independent_rows=False, **kwargs):
+    """
+    Dispatch: (n, rows, cols) stacks use clean_stack, single frames clean_frame.
+
+    With `independent_rows` (e.g. multi-track readouts) each row is cleaned as its
+    own spectrum by clean_spectra; frame-only options are ignored.
+    """
+    data = np.asarray(data)
+    if data.ndim == 3:
+        return clean_stack(data, **kwargs)
+    if independent_rows:
+        options = ("sigma", "sharpness", "size", "niter", "read_noise", "gain", "bias")
+        return clean_spectra(data, **{key: kwargs[key] for key in options if key in kwargs})
+    return clean_frame(data, **kwargs)
+
+
+# Extraction
+def extract_tracks(image, bands=None, background=None):
+    """
+    Per-track spectra as an (n_tracks, pixels) array.
+
+    Without `bands` every row of `image` is one track (multi-track readout, where
+    the camera already bins each track). With `bands`, a list of (start, stop) row
+    ranges of a full image, the rows of each band are summed. `background` is
+    subtracted per track: an (n_tracks, pixels) array, or one value per track.
+    """
+    image = np.atleast_2d(np.asarray(image, dtype=float))
+    if bands is None:
+        tracks = image.copy()
+    else:
+        bands = np.asarray(bands, dtype=int)
+        cum = np.concatenate([np.zeros((1, image.shape[1])), np.cumsum(image, axis=0)])
+        tracks = cum[bands[:, 1]] - cum[bands[:, 0]]
+    if background is not None:
+        background = np.asarray(background, dtype=float)
+        if background.ndim == 1 and len(background) == len(tracks):
+            background = background[:, None]
+        tracks -= background
+    return tracks
+
+
+def _background_rows(image, profile=None, fraction=0.25):
+    "Per-column background from the rows with the least signal (or profile weight)"
+    weight = image.sum(axis=1) if profile is None else profile.sum(axis=1)
+    n = max(1, int(len(weight) * fraction))
+    quiet = np.argsort(weight)[:n]
+    return np.median(image[quiet], axis=0), quiet
+
+
+def estimate_profile(image, window=64, subtract_background=True):
+    """
+    Spatial profile (rows, cols) of a spectrum image, normalised to 1 in every column.
+
+    The frame (minus its background, see optimal_extract) is smoothed along the
+    dispersion axis with a `window`-pixel boxcar (a cumulative sum, so cost does not
+    depend on the window), then negative values are clipped. Columns without
+    signal get a flat profile.
+    """
+    image = np.atleast_2d(np.asarray(image, dtype=float))
+    if subtract_background and image.shape[0] > 1:
+        image = image - _background_rows(image)[0]
+    rows, cols = image.shape
+    window = max(1, min(int(window), cols))
+    cum = np.concatenate([np.zeros((rows, 1)), np.cumsum(image, axis=1)], axis=1)
+    lo = np.clip(np.arange(cols) - window // 2, 0, cols - window)
+    smooth = (cum[:, lo + window] - cum[:, lo]) / window
+    smooth = np.clip(smooth, 0, None)
+    total = smooth.sum(axis=0)
+    return np.where(total > 0, smooth / np.where(total > 0, total, 1), 1.0 / rows)
+
+
+def optimal_extract(image, profile=None, read_noise=None, gain=1.0, sigma=5.0, niter=5,
+                    profile_window=64, subtract_background=True, include_background=False, bias=0.0):
+    """
+    Variance-weighted (Horne 1986) extraction of a spectrum image, vectorised over columns.
+
+    Each column is fitted as flux * profile with weights 1/variance, where the
+    variance is read noise plus shot noise of the current model and background
+    above `bias` (counts; 0 for dark-subtracted frames). Pixels deviating by more
+    than `sigma` are rejected and the fit repeated up to `niter` times.
+    `profile` defaults to estimate_profile(image). With `subtract_background`, the
+    per-column median of the quietest quarter of rows is removed before the fit and,
+    with `include_background`, its total over rows added back to the flux, so the
+    result matches a plain row sum. `read_noise` (counts) defaults to a robust
+    estimate from the quiet rows.
+    Return (flux, variance, rejected mask, profile); flux is the total over rows.
+    """
+    image = np.atleast_2d(np.asarray(image, dtype=float))
+    background = np.zeros(image.shape[1])
+    quiet = None
+    if subtract_background and image.shape[0] > 1:
+        background, quiet = _background_rows(image, profile)
+        image = image - background
+    if read_noise is None:
+        rows = image if quiet is None else image[quiet]
+        read_noise = robust_sigma(np.diff(rows, axis=1)) / np.sqrt(2)
+    if profile is None:
+        profile = estimate_profile(image, profile_window, subtract_background=False)
+    if profile.shape != image.shape:
+        raise ValueError(f"Profile shape {profile.shape} does not match image shape {image.shape}")
+
+    keep = np.ones(image.shape, dtype=bool)
+    flux = np.clip(image.sum(axis=0), 0, None)
+    for _ in range(niter):
+        model = flux * profile
+        variance = read_noise ** 2 + np.clip(model + background - bias, 0, None) / gain
+        weight = keep * profile / variance
+        norm = (weight * profile).sum(axis=0)
+        flux = (weight * image).sum(axis=0) / np.where(norm > 0, norm, np.inf)
+        residual = (image - flux * profile) ** 2 / variance
+        outliers = keep & (residual > sigma ** 2)
+        if not outliers.any():
+            break
+        # reject only the worst pixel of each affected column per pass
+        worst = np.argmax(np.where(outliers, residual, -1), axis=0)
+        cols = np.nonzero(outliers.any(axis=0))[0]
+        keep[worst[cols], cols] = False
+    flux_variance = 1.0 / np.where(norm > 0, norm, np.nan)
+    if include_background and quiet is not None:
+        # median of the quiet rows, scaled to all rows: variance of a median ~ pi/2 of a mean
+        rows = image.shape[0]
+        pixel_variance = read_noise ** 2 + np.clip(background - bias, 0, None) / gain
+        flux = flux + rows * background
+        flux_variance = flux_variance + rows ** 2 * np.pi / 2 * pixel_variance / len(quiet)
+    return flux, flux_variance, ~keep, profile
+
+
+# Baseline
+@functools.lru_cache(maxsize=32)
+def difference_penalty(length, lam, order=2):
+    """
+    Banded factors for the Whittaker smoother of `length` points, cached per (length, lam, order).
+
+    Return (penalty, factor): lam * D'D and the Cholesky factor of I + lam * D'D,
+    both in upper banded storage (order + 1, length) as used by scipy.linalg.
+    """
+    coeffs = np.diff(np.eye(order + 1), order, axis=0)[0]
+    penalty = np.zeros((order + 1, length))
+    rows = length - order
+    for p in range(order + 1):
+        for q in range(p, order + 1):
+            # D[j, j + p] * D[j, j + q] lands on (j + p, j + q), band q - p, column j + q
+            penalty[order - (q - p), q:q + rows] += coeffs[p] * coeffs[q]
+    penalty *= lam
+    identity = penalty.copy()
+    identity[order] += 1
+    factor = cholesky_banded(identity, check_finite=False)
+    penalty.flags.writeable = False
+    factor.flags.writeable = False
+    return penalty, factor
+
+
+def _weighted_smooth(spectra, weights, lam, order):
+    "Solve (W + lam D'D) z = W y for every row at once as one block-diagonal banded system"
+    n, length = spectra.shape
+    penalty = difference_penalty(length, float(lam), order)[0]
+    # blocks stay uncoupled: the first `band` columns of each block have no entry on that band
+    ab = np.tile(penalty, (1, n))
+    ab[order] += weights.ravel()
+    z = solveh_banded(ab, (weights * spectra).ravel(), check_finite=False)
+    return z.reshape(n, length)
+
+
+def whittaker_smooth(spectra, lam=1e5, order=2):
+    "Penalised least-squares smooth of a spectrum or (n, pixels) stack with unit weights"
+    spectra = np.asarray(spectra, dtype=float)
+    stack = np.atleast_2d(spectra)
+    factor = difference_penalty(stack.shape[-1], float(lam), order)[1]
+    return cho_solve_banded((factor, False), stack.T, check_finite=False).T.reshape(spectra.shape)
+
+
+def als_baseline(spectra, lam=1e5, p=0.01, niter=10, order=2):
+    """
+    Asymmetric least squares baseline (Eilers & Boelens) of a spectrum or (n, pixels) stack.
+
+    Points above the current baseline get weight `p`, points below 1 - p. Spectra
+    stop iterating once their weights no longer change.
+    """
+    spectra = np.asarray(spectra, dtype=float)
+    stack = np.atleast_2d(spectra)
+    baseline = whittaker_smooth(stack, lam, order)
+    weights = np.where(stack > baseline, p, 1 - p)
+    active = np.arange(len(stack))
+    for _ in range(niter):
+        baseline[active] = _weighted_smooth(stack[active], weights[active], lam, order)
+        new = np.where(stack[active] > baseline[active], p, 1 - p)
+        changed = (new != weights[active]).any(axis=1)
+        weights[active] = new
+        active = active[changed]
+        if not len(active):
+            break
+    return baseline.reshape(spectra.shape)
+
+
+def airpls_baseline(spectra, lam=1e5, niter=15, tol=1e-3, order=2):
+    """
+    Adaptive iteratively reweighted penalised least squares baseline (Zhang et al.)
+    of a spectrum or (n, pixels) stack.
+
+    Points above the baseline get zero weight, points below a weight growing
+    exponentially with their depth and the iteration. A spectrum is done when its
+    total negative residual falls below `tol` times its total absolute intensity.
+    """
+    spectra = np.asarray(spectra, dtype=float)
+    stack = np.atleast_2d(spectra)
+    baseline = whittaker_smooth(stack, lam, order)
+    limit = tol * np.abs(stack).sum(axis=1)
+    active = np.arange(len(stack))
+    for t in range(1, niter + 1):
+        resid = stack[active] - baseline[active]
+        negative = np.minimum(resid, 0)
+        total = -negative.sum(axis=1)
+        keep = total >= limit[active]
+        active, resid, negative, total = active[keep], resid[keep], negative[keep], total[keep]
+        if not len(active):
+            break
+        scale = t / total[:, None]
+        weights = np.where(resid < 0, np.exp(-negative * scale), 0.0)
+        ends = np.exp(scale[:, 0] * -negative.min(axis=1))
+        weights[:, 0] = weights[:, -1] = ends
+        baseline[active] = _weighted_smooth(stack[active], weights, lam, order)
+    return baseline.reshape(spectra.shape)
+
+
+BASELINE_METHODS = {"als": als_baseline, "airpls": airpls_baseline}
+
+
+def remove_baseline(spectra, method="als", **kwargs):
+    """Subtract an "als" or "airpls" baseline from a spectrum or stack; return (corrected, baseline)"""
+    if method not in BASELINE_METHODS:
+        raise ValueError(f"Unknown baseline method: {method} (expected one of {list(BASELINE_METHODS)})")
+    baseline = BASELINE_METHODS[method](spectra, **kwargs)
+    return np.asarray(spectra, dtype=float) - baseline, baseline
+
+
+# Accumulation
+class SpectrumAccumulator:
+    """
+    Running per-pixel mean and variance of a sequence of spectra in O(pixels) memory.
+
+    With `ema_alpha=None` every spectrum has equal weight (Welford updates; batches
+    are merged with Chan's formula). With `ema_alpha` set, mean and variance are
+    exponentially weighted so the estimate follows slow drifts.
+    """
+    def __init__(self, ema_alpha=None):
+        if ema_alpha is not None and not 0 < ema_alpha <= 1:
+            raise ValueError(f"ema_alpha must be in (0, 1], got {ema_alpha}")
+        self.ema_alpha = ema_alpha
+        self.count = 0
+        self._mean = None
+        self._m2 = None
+
+    def reset(self):
+        self.count = 0
+        if self._mean is not None:
+            self._mean.fill(0)
+            self._m2.fill(0)
+
+    def update(self, spectra):
+        "Add one spectrum or a (n, pixels) batch"
+        spectra = np.atleast_2d(np.asarray(spectra, dtype=float))
+        if self._mean is None or self._mean.shape != spectra.shape[1:]:
+            self._mean = np.zeros(spectra.shape[1:])
+            self._m2 = np.zeros(spectra.shape[1:])
+            self.count = 0
+        if self.ema_alpha is not None:
+            for spectrum in spectra:
+                self._update_ema(spectrum)
+            return self.count
+        n = len(spectra)
+        batch_mean = spectra.mean(axis=0)
+        delta = batch_mean - self._mean
+        total = self.count + n
+        self._mean += delta * (n / total)
+        self._m2 += ((spectra - batch_mean) ** 2).sum(axis=0) + delta ** 2 * (self.count * n / total)
+        self.count = total
+        return self.count
+
+    def _update_ema(self, spectrum):
+        if self.count == 0:
+            self._mean[:] = spectrum
+        else:
+            delta = spectrum - self._mean
+            increment = self.ema_alpha * delta
+            self._mean += increment
+            self._m2 *= 1 - self.ema_alpha
+            self._m2 += (1 - self.ema_alpha) * delta * increment
+        self.count += 1
+
+    @property
+    def mean(self):
+        return None if self._mean is None else self._mean.copy()
+
+    @property
+    def variance(self):
+        "Per-pixel variance of a single spectrum"
+        if self.count < 2:
+            return None
+        if self.ema_alpha is not None:
+            return self._m2.copy()
+        return self._m2 / (self.count - 1)
+
+    @property
+    def effective_count(self):
+        "Number of equally weighted spectra the estimate corresponds to"
+        if self.ema_alpha is None:
+            return self.count
+        return min(self.count, (2 - self.ema_alpha) / self.ema_alpha)
+
+    @property
+    def snr(self):
+        "Per-pixel SNR of the mean: mean / (std / sqrt(effective count))"
+        variance = self.variance
+        if variance is None:
+            return None
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return self._mean / np.sqrt(variance / self.effective_count)
+
+    def status(self):
+        snr = self.snr
+        return {
+            "count": self.count,
+            "effective_count": self.effective_count,
+            "ema_alpha": self.ema_alpha,
+            "median_snr": None if snr is None else float(np.nanmedian(snr)),
+        }
+
+
+# Dark frames
+class DarkFrameLibrary:
+    """
+    On-disk library of averaged dark frames.
+
+    Frames are grouped by readout settings (a dict such as
+    AndorCameraController.dark_settings()) and a temperature bucket of
+    `temperature_step` degrees. Within a group, a frame whose exposure matches to
+    `exposure_rtol` is reused directly; otherwise the two frames bracketing the
+    exposure are interpolated linearly (bias + dark current * t). Frames are stored
+    as .npy files next to an index.json and loaded lazily.
+    """
+    def __init__(self, directory="darks", temperature_step=2.0, exposure_rtol=0.02):
+        self.directory = directory
+        self.temperature_step = temperature_step
+        self.exposure_rtol = exposure_rtol
+        self.hits = 0
+        self.interpolated = 0
+        self.misses = 0
+        self._frames = {}
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._index_path = os.path.join(directory, "index.json")
+        self.entries = []
+        if os.path.exists(self._index_path):
+            with open(self._index_path) as f:
+                self.entries = json.load(f)
+
+    def _group(self, settings, temperature):
+        settings = json.dumps(settings, sort_keys=True, default=str)
+        bucket = int(round(temperature / self.temperature_step))
+        return settings, bucket
+
+    def _candidates(self, settings, temperature, shape=None):
+        settings, bucket = self._group(settings, temperature)
+        found = [e for e in self.entries if e["settings"] == settings and e["temperature_bucket"] == bucket
+                 and (shape is None or tuple(e["shape"]) == tuple(shape))]
+        return sorted(found, key=lambda e: e["exposure"])
+
+    def _load(self, entry):
+        frame = self._frames.get(entry["file"])
+        if frame is None:
+            frame = np.load(os.path.join(self.directory, entry["file"]))
+            self._frames[entry["file"]] = frame
+        return frame
+
+    def _save_index(self):
+        tmp = self._index_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.entries, f, indent=1)
+        os.replace(tmp, self._index_path)
+
+    def add(self, frame, exposure, settings, temperature, n_frames=1):
+        "Store a dark frame, replacing one with the same settings and exposure"
+        frame = np.asarray(frame, dtype=np.float32)
+        settings_key, bucket = self._group(settings, temperature)
+        tag = hashlib.sha1(f"{settings_key}|{bucket}".encode()).hexdigest()[:12]
+        entry = {
+            "file": f"dark_{tag}_{exposure:.6g}s.npy",
+            "settings": settings_key,
+            "temperature_bucket": bucket,
+            "temperature": float(temperature),
+            "exposure": float(exposure),
+            "n_frames": int(n_frames),
+            "shape": list(frame.shape),
+            "date": datetime.datetime.now().isoformat(timespec="seconds"),
+        }
+        with self._lock:
+            for old in self._candidates(settings, temperature):
+                if abs(old["exposure"] - exposure) <= self.exposure_rtol * max(exposure, 1e-9):
+                    self.entries.remove(old)
+                    self._frames.pop(old["file"], None)
+                    old_path = os.path.join(self.directory, old["file"])
+                    if old["file"] != entry["file"] and os.path.exists(old_path):
+                        os.remove(old_path)
+            np.save(os.path.join(self.directory, entry["file"]), frame)
+            self._frames[entry["file"]] = frame
+            self.entries.append(entry)
+            self._save_index()
+        return entry
+
+    def match(self, exposure, settings, temperature, shape=None):
+        "Dark frame for these settings, interpolated in exposure if needed; None if not covered"
+        with self._lock:
+            found = self._candidates(settings, temperature, shape)
+            exposures = np.array([e["exposure"] for e in found])
+            if len(found):
+                nearest = int(np.argmin(np.abs(exposures - exposure)))
+                if abs(exposures[nearest] - exposure) <= self.exposure_rtol * max(exposure, 1e-9):
+                    self.hits += 1
+                    return self._load(found[nearest])
+            above = int(np.searchsorted(exposures, exposure))
+            if 0 < above < len(found):
+                lo, hi = found[above - 1], found[above]
+                w = (exposure - lo["exposure"]) / (hi["exposure"] - lo["exposure"])
+                self.interpolated += 1
+                return (1 - w) * self._load(lo) + w * self._load(hi)
+            self.misses += 1
+            return None
+
+    def status(self):
+        return {
+            "directory": os.path.abspath(self.directory),
+            "frames": len(self.entries),
+            "hits": self.hits,
+            "interpolated": self.interpolated,
+            "misses": self.misses,
+        }
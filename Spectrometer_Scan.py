@@ -0,0 +1,144 @@
+import numpy as np
+
+# Step-and-glue scans: cover a wavelength range wider than one detector window by
+# moving the grating through several central wavelengths and merging the windows.
+
+
+# Planning
+def raman_to_wavelength(shift_cm, laser_nm):
+    "Absolute wavelength (nm) of a Raman shift (cm^-1) for a given laser"
+    return 1.0 / (1.0 / laser_nm - np.asarray(shift_cm, dtype=float) * 1e-7)
+
+
+def plan_windows(start_nm, end_nm, window_nm, overlap=0.15):
+    """
+    Central wavelengths covering [start_nm, end_nm] with windows `window_nm` wide.
+
+    Windows are spread evenly, so adjacent windows overlap by at least `overlap`
+    (a fraction of the window width).
+    """
+    if not 0 <= overlap < 1:
+        raise ValueError(f"Overlap must be in [0, 1), got {overlap}")
+    start_nm, end_nm = sorted((start_nm, end_nm))
+    span = end_nm - start_nm
+    if span <= window_nm:
+        return np.array([(start_nm + end_nm) / 2])
+    step = window_nm * (1 - overlap)
+    n = int(np.ceil((span - window_nm) / step)) + 1
+    return np.linspace(start_nm + window_nm / 2, end_nm - window_nm / 2, n)
+
+
+def order_windows(centers, current_nm):
+    """
+    Visit order with the least grating travel from `current_nm`.
+
+    The centers lie on a line, so the shortest tour starts at the nearer end and
+    sweeps once to the other.
+    """
+    centers = np.sort(np.asarray(centers, dtype=float))
+    if abs(current_nm - centers[-1]) < abs(current_nm - centers[0]):
+        centers = centers[::-1]
+    return centers
+
+
+# Merging
+def _sorted_window(wl, spectrum):
+    wl = np.asarray(wl, dtype=float)
+    spectrum = np.asarray(spectrum, dtype=float)
+    order = np.argsort(wl)
+    return wl[order], spectrum[order]
+
+
+def _overlap_fit(wl_a, spec_a, wl_b, spec_b, match_offset=True, max_gain_error=0.05):
+    """
+    Gain and offset mapping window b onto window a (a ~ gain * b + offset) by least
+    squares over their common range; (1, 0) if they do not overlap.
+
+    Without `match_offset`, or when the overlap has too little structure to pin the
+    gain down (relative standard error above `max_gain_error`), only an offset is
+    fitted: a flat overlap cannot tell the two apart, and a wrong offset distorts
+    band ratios less than a wrong gain.
+    """
+    lo, hi = max(wl_a[0], wl_b[0]), min(wl_a[-1], wl_b[-1])
+    inside = (wl_b >= lo) & (wl_b <= hi)
+    if hi <= lo or inside.sum() < 3:
+        return 1.0, 0.0
+    a = np.interp(wl_b[inside], wl_a, spec_a)
+    b = spec_b[inside]
+    if not match_offset:
+        denom = np.dot(b, b)
+        return (float(np.dot(a, b) / denom) if denom > 0 else 1.0), 0.0
+    spread = np.sum((b - b.mean()) ** 2)
+    if spread > 0:
+        gain = np.sum((a - a.mean()) * (b - b.mean())) / spread
+        offset = a.mean() - gain * b.mean()
+        resid = a - gain * b - offset
+        gain_error = np.sqrt(np.sum(resid ** 2) / max(len(b) - 2, 1) / spread)
+        if gain > 0 and gain_error <= max_gain_error * gain:
+            return float(gain), float(offset)
+    return 1.0, float(np.mean(a - b))
+
+
+def stitch_windows(windows, step_nm=None, match_intensity=True, match_offset=True):
+    """
+    Merge (wavelength_nm, spectrum) windows onto one uniform wavelength axis.
+
+    With `match_intensity`, each window is mapped onto its lower-wavelength
+    neighbour by a least-squares fit over their overlap: gain and offset, or gain
+    only without `match_offset` (see _overlap_fit). Overlaps are cross-faded with
+    weights proportional to the distance from each window's nearest edge. The axis
+    step defaults to the finest median pixel spacing of the windows.
+    Return (axis, spectrum, scales, offsets), with scales and offsets in the input
+    window order: window i contributes scales[i] * spectrum + offsets[i].
+    """
+    if not windows:
+        raise ValueError("No windows to stitch")
+    prepared = [_sorted_window(wl, spec) for wl, spec in windows]
+    order = np.argsort([wl[0] + wl[-1] for wl, _ in prepared])
+    scales = np.ones(len(prepared))
+    offsets = np.zeros(len(prepared))
+    if match_intensity:
+        for prev, cur in zip(order[:-1], order[1:]):
+            wl_a, spec_a = prepared[prev]
+            wl_b, spec_b = prepared[cur]
+            gain, offset = _overlap_fit(wl_a, spec_a, wl_b, spec_b, match_offset)
+            # compose with the mapping of the previous window onto the first one
+            scales[cur] = scales[prev] * gain
+            offsets[cur] = scales[prev] * offset + offsets[prev]
+
+    if step_nm is None:
+        step_nm = min(np.median(np.diff(wl)) for wl, _ in prepared)
+    lo = min(wl[0] for wl, _ in prepared)
+    hi = max(wl[-1] for wl, _ in prepared)
+    axis = lo + step_nm * np.arange(int(np.floor((hi - lo) / step_nm)) + 1)
+
+    values = np.zeros((len(prepared), len(axis)))
+    weights = np.zeros((len(prepared), len(axis)))
+    for i, (wl, spec) in enumerate(prepared):
+        values[i] = np.interp(axis, wl, spec * scales[i] + offsets[i])
+        inside = (axis >= wl[0]) & (axis <= wl[-1])
+        weights[i][inside] = np.minimum(axis - wl[0], wl[-1] - axis)[inside] + step_nm / 2
+    total = weights.sum(axis=0)
+    merged = (values * weights).sum(axis=0) / np.where(total > 0, total, 1)
+    return axis, merged, scales, offsets
+
+
+# Acquisition
+def run_scan(kymera, acquire, centers, restore=True):
+    """
+    Move to each central wavelength in order and call `acquire()`, which must
+    return (spectrum, wavelength_nm). Return the list of windows in visit order.
+    With `restore`, the grating goes back to its starting wavelength afterwards,
+    also if an acquisition fails.
+    """
+    start_nm = kymera.get_central_wavelength() if restore else None
+    windows = []
+    try:
+        for center in centers:
+            kymera.set_central_wavelength(center)
+            spectrum, wl = acquire()
+            windows.append((np.array(wl, dtype=float), np.array(spectrum, dtype=float)))
+    finally:
+        if restore:
+            kymera.set_central_wavelength(start_nm)
+    return windows
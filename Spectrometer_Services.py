@@ -0,0 +1,318 @@
+import collections
+import queue
+import threading
+import time
+import types
+import uuid
+
+# Background services shared by the Flask driver and other front ends. Each one
+# owns a single thread that talks to the controllers, so any number of clients
+# can be served without each of them touching the hardware.
+
+
+class Subscription:
+    """Bounded per-client queue; when full, the oldest item is dropped"""
+    def __init__(self, maxlen=8):
+        self._items = collections.deque(maxlen=maxlen)
+        self._cond = threading.Condition()
+        self.dropped = 0
+        self.closed = False
+
+    def put(self, item):
+        with self._cond:
+            if len(self._items) == self._items.maxlen:
+                self.dropped += 1
+            self._items.append(item)
+            self._cond.notify()
+
+    def get(self, timeout=None):
+        "Return the oldest pending item, or None on timeout/close"
+        with self._cond:
+            if not self._items and not self.closed:
+                self._cond.wait(timeout)
+            return self._items.popleft() if self._items else None
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+
+class SpectrumBroadcaster:
+    """
+    Fan out live spectra from continuous mode to many subscribers.
+
+    One producer thread drains the camera stream, reduces each frame to a spectrum
+    with the controller's corrections (as acquire_spectrum does) and formats it once
+    with `formatter`; subscribers only receive the formatted item.
+    """
+    def __init__(self, spec, formatter=None, queue_size=8):
+        self.spec = spec
+        self.camera = spec.camera
+        self.formatter = formatter or (lambda item: item)
+        self.queue_size = queue_size
+        self.laser_wl = None
+        self.published = 0
+        self.error = None
+        self._subscribers = set()
+        self._subs_lock = threading.Lock()
+        self._thread = None
+        self._running = False
+
+    @property
+    def running(self):
+        return self._running
+
+    def start(self, laser_wl, cycle_time=0):
+        if self._running:
+            self.laser_wl = laser_wl
+            return
+        self.laser_wl = laser_wl
+        self.error = None
+        self.camera.start_stream(cycle_time=cycle_time)
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="SpectrumBroadcaster", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.camera.stop_stream()
+
+    def _run(self):
+        try:
+            while self._running:
+                if not self.camera.wait_stream(timeout=0.5):
+                    continue
+                self.camera.drain_stream()
+                indices, timestamps, frames = self.camera.stream.read_new()
+                if not len(indices):
+                    continue
+                wl = self.spec.get_wavelength_axis()
+                for index, ts, spectrum in zip(indices, timestamps, self.spec.spectra_from_frames(frames)):
+                    self.publish({"frame": int(index), "timestamp": float(ts), "intensity": spectrum, "wavelength_nm": wl})
+        except Exception as e:
+            self.error = repr(e)
+            self._running = False
+
+    def publish(self, item):
+        formatted = self.formatter(item)
+        with self._subs_lock:
+            subscribers = list(self._subscribers)
+        for sub in subscribers:
+            sub.put(formatted)
+        self.published += 1
+
+    def subscribe(self, maxlen=None):
+        sub = Subscription(maxlen or self.queue_size)
+        with self._subs_lock:
+            self._subscribers.add(sub)
+        return sub
+
+    def unsubscribe(self, sub):
+        with self._subs_lock:
+            self._subscribers.discard(sub)
+        sub.close()
+
+    def status(self):
+        with self._subs_lock:
+            subscribers = list(self._subscribers)
+        return {
+            "running": self._running,
+            "laser_wavelength_nm": self.laser_wl,
+            "published": self.published,
+            "subscribers": len(subscribers),
+            "dropped": sum(sub.dropped for sub in subscribers),
+            "error": self.error,
+            "stream": self.camera.stream_status(),
+        }
+
+
+class AcquisitionJobQueue:
+    """
+    Acquisition jobs executed one at a time, in submission order, by a single thread.
+
+    Every job gets an id; finished jobs are kept in an LRU store of `max_results`
+    entries that clients can fetch or long-poll with `wait`. A job calls the
+    controller `method` (acquire_spectrum, acquire_tracks, ...) with the laser
+    wavelength and `options`; it fails while the camera is streaming live spectra.
+    """
+    def __init__(self, spec, max_results=64):
+        self.spec = spec
+        self.max_results = max_results
+        self._pending = queue.Queue()
+        self._jobs = collections.OrderedDict()
+        self._cond = threading.Condition()
+        self._last_done = None
+        self._thread = threading.Thread(target=self._run, name="AcquisitionJobQueue", daemon=True)
+        self._thread.start()
+
+    def submit(self, laser_wl, method="acquire_spectrum", **options):
+        job_id = uuid.uuid4().hex
+        job = {
+            "id": job_id,
+            "state": "queued",
+            "method": method,
+            "options": options,
+            "laser_wavelength_nm": laser_wl,
+            "submitted": time.time(),
+            "started": None,
+            "finished": None,
+            "error": None,
+            "result": None,
+        }
+        with self._cond:
+            self._jobs[job_id] = job
+        self._pending.put(job_id)
+        return job_id
+
+    def _run(self):
+        while True:
+            job_id = self._pending.get()
+            with self._cond:
+                job = self._jobs.get(job_id)
+                if job is None:
+                    continue
+                job["state"] = "running"
+                job["started"] = time.time()
+            try:
+                if self.spec.camera.streaming:
+                    raise RuntimeError("Camera is streaming live spectra")
+                result = getattr(self.spec, job["method"])(job["laser_wavelength_nm"], **job["options"])
+                state, error = "done", None
+            except Exception as e:
+                result, state, error = None, "error", repr(e)
+            with self._cond:
+                job.update(state=state, error=error, result=result, finished=time.time())
+                if state == "done":
+                    self._last_done = job_id
+                self._jobs.move_to_end(job_id)
+                self._evict()
+                self._cond.notify_all()
+
+    def _evict(self):
+        finished = [jid for jid, job in self._jobs.items() if job["finished"] is not None]
+        for jid in finished[:max(len(finished) - self.max_results, 0)]:
+            del self._jobs[jid]
+
+    def get(self, job_id):
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is not None and job["finished"] is not None:
+                self._jobs.move_to_end(job_id)
+            return None if job is None else dict(job)
+
+    def wait(self, job_id, timeout=None):
+        "Block until the job finishes or `timeout` expires; return its current record"
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while job_id in self._jobs and self._jobs[job_id]["finished"] is None:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+        return self.get(job_id)
+
+    def last_result(self):
+        "Result of the most recently finished successful job, or None"
+        with self._cond:
+            job = self._jobs.get(self._last_done)
+            return None if job is None else job["result"]
+
+    def summary(self, job):
+        return {key: value for key, value in job.items() if key != "result"}
+
+    def list_jobs(self):
+        with self._cond:
+            return [self.summary(job) for job in self._jobs.values()]
+
+    def busy(self):
+        "True while any job is queued or running"
+        with self._cond:
+            return any(job["finished"] is None for job in self._jobs.values())
+
+    def status(self):
+        with self._cond:
+            states = collections.Counter(job["state"] for job in self._jobs.values())
+        return {"queued": states["queued"], "running": states["running"],
+                "stored": states["done"] + states["error"], "max_results": self.max_results}
+
+
+TelemetrySnapshot = collections.namedtuple(
+    "TelemetrySnapshot", ["camera", "camera_time", "kymera", "kymera_time", "error"]
+)
+
+
+class TelemetryPoller:
+    """
+    Poll camera and spectrograph status on one background thread.
+
+    Readers get the latest immutable `TelemetrySnapshot` from `snapshot()` without any
+    SDK call. The spectrograph only changes when commanded, so it is polled every
+    `kymera_interval` seconds or right after `refresh()`.
+    """
+    def __init__(self, camera, kymera, interval=1.0, kymera_interval=10.0):
+        self.camera = camera
+        self.kymera = kymera
+        self.interval = interval
+        self.kymera_interval = kymera_interval
+        empty = types.MappingProxyType({})
+        self._snapshot = TelemetrySnapshot(empty, None, empty, None, None)
+        self._wake = threading.Event()
+        self._refresh_kymera = True
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="TelemetryPoller", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def refresh(self, kymera=True):
+        "Poll again now (e.g. after a setting was changed)"
+        self._refresh_kymera = self._refresh_kymera or kymera
+        self._wake.set()
+
+    def snapshot(self):
+        return self._snapshot
+
+    def _run(self):
+        while self._running:
+            self.poll_once()
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+    def poll_once(self):
+        snap = self._snapshot
+        camera, camera_time = snap.camera, snap.camera_time
+        kymera, kymera_time = snap.kymera, snap.kymera_time
+        error = None
+        try:
+            if self.camera.connected:
+                status = self.camera.get_status()
+                status["temperature_status"] = self.camera.get_temp_status()
+                camera, camera_time = types.MappingProxyType(status), time.time()
+                self.camera.record_temperature(status["temperature"], status["temperature_status"],
+                                               status["cooler"], camera_time)
+        except Exception as e:
+            error = f"camera: {e!r}"
+        try:
+            stale = kymera_time is None or time.time() - kymera_time >= self.kymera_interval
+            if self._refresh_kymera or stale:
+                self._refresh_kymera = False
+                kymera, kymera_time = types.MappingProxyType(self.kymera.get_status()), time.time()
+        except Exception as e:
+            error = f"kymera: {e!r}"
+        self._snapshot = TelemetrySnapshot(camera, camera_time, kymera, kymera_time, error)
+        return self._snapshot
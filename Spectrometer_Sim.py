@@ -0,0 +1,795 @@
+import threading
+import time
+
+import numpy as np
+
+# Simulated iDus camera + Kymera spectrograph.
+# Both classes mimic the subset of the pylablib AndorSDK2Camera / ShamrockSpectrograph
+# API used by Spectrometer.py, so they can be passed in as backends for profiling,
+# load tests and CI runs without hardware attached.
+#
+# All modeled durations (exposure, readout, grating moves, cooling) are multiplied by
+# `time_scale`; time_scale=0.01 runs the instrument 100x faster than real time while
+# keeping the relative timing intact. time_scale=0 runs both devices in instant
+# virtual time: grating moves take no time, and the camera clock jumps ahead to the
+# next frame whenever a caller waits for one.
+
+
+class SimulatedRamanSample:
+    """Synthetic Raman sample: Lorentzian bands on a broad fluorescence background"""
+
+    # polystyrene-like bands: (shift cm^-1, FWHM cm^-1, peak counts/s on the brightest row sum)
+    DEFAULT_BANDS = [
+        (620.9, 8.0, 900.0),
+        (795.8, 10.0, 350.0),
+        (1001.4, 6.0, 5000.0),
+        (1031.8, 7.0, 1400.0),
+        (1155.3, 9.0, 700.0),
+        (1450.5, 14.0, 800.0),
+        (1583.1, 8.0, 600.0),
+        (1602.3, 8.0, 1800.0),
+        (2852.4, 18.0, 900.0),
+        (2904.5, 20.0, 1500.0),
+        (3054.7, 12.0, 3000.0),
+    ]
+
+    def __init__(self, laser_nm=532.0, bands=None,
+                 fluorescence_amp=400.0, fluorescence_center_nm=650.0, fluorescence_width_nm=80.0):
+        self.laser_nm = laser_nm
+        self.bands = list(self.DEFAULT_BANDS if bands is None else bands)
+        self.fluorescence_amp = fluorescence_amp
+        self.fluorescence_center_nm = fluorescence_center_nm
+        self.fluorescence_width_nm = fluorescence_width_nm
+
+    def rate(self, wl_nm):
+        "Photo-electrons per second per detector column at wavelengths `wl_nm`"
+        wl_nm = np.asarray(wl_nm, dtype=float)
+        shift = (1 / self.laser_nm - 1 / wl_nm) * 1e7
+        rate = self.fluorescence_amp * np.exp(
+            -0.5 * ((wl_nm - self.fluorescence_center_nm) / self.fluorescence_width_nm) ** 2
+        )
+        for center, fwhm, amp in self.bands:
+            hw = fwhm / 2
+            rate = rate + amp * hw ** 2 / ((shift - center) ** 2 + hw ** 2)
+        return rate
+
+
+class SimulatedAndorCamera:
+    """Simulated Andor iDus (SDK2) camera with an exposure/readout timing model"""
+
+    READ_MODES = ["fvb", "single_track", "multi_track", "random_track", "image"]
+    ACQ_MODES = ["single", "accum", "kinetic", "fast_kinetic", "cont"]
+
+    def __init__(self, width=1024, height=255, pixel_size_um=26.0,
+                 vsspeeds_us=(4.25, 8.25, 16.25, 32.25), hsspeed_mhz=0.1,
+                 readout_overhead_s=1e-3, buffer_size=256,
+                 bias=300.0, read_noise_e=4.0, gain_e_per_count=1.0,
+                 dark_rate_20c=1000.0, ambient_temp=20.0, cooling_tau_s=60.0,
+                 track_centers=None, track_sigma=3.0, track_scales=None,
+                 cosmic_rate=0.05, sample=None, time_scale=1.0, seed=None):
+        self.width = width
+        self.height = height
+        self.pixel_size_um = pixel_size_um
+        self.vsspeeds_us = list(vsspeeds_us)
+        self.hsspeed_mhz = hsspeed_mhz
+        self.readout_overhead_s = readout_overhead_s
+        self.buffer_size = buffer_size
+        self.bias = bias
+        self.read_noise_e = read_noise_e
+        self.gain = gain_e_per_count
+        self.dark_rate_20c = dark_rate_20c
+        self.ambient_temp = ambient_temp
+        self.cooling_tau_s = cooling_tau_s
+        self.track_centers = [height / 2] if track_centers is None else list(track_centers)
+        self.track_sigma = track_sigma
+        self.track_scales = [1.0] * len(self.track_centers) if track_scales is None else list(track_scales)
+        self.cosmic_rate = cosmic_rate
+        self.sample = SimulatedRamanSample() if sample is None else sample
+        if time_scale < 0:
+            raise ValueError(f"time_scale must be >= 0, got {time_scale}")
+        self.time_scale = time_scale
+        self.rng = np.random.default_rng(seed)
+        self._clock = 0.0
+
+        self.spectrograph = None
+        self.opened = True
+        self._lock = threading.RLock()
+
+        self._read_mode = "fvb"
+        self._roi = (0, width, 0, height, 1, 1)
+        self._single_track = (height // 2, 1)
+        self._multi_track = (1, 1, 0)
+        self._exposure = 0.1
+        self._acq_mode = "single"
+        self._accum = (1, 0.0)
+        self._kinetic = (1, 0.0, 1, 0.0, 0)
+        self._cont_cycle = 0.0
+        self._trigger_mode = "int"
+        self._vsspeed = 0
+        self._fan_mode = "full"
+        self._shutter = "auto"
+        self._shutter_parameters = ("auto", 0, None, None)
+        self._frame_format = "list"
+
+        self._cooler_on = False
+        self._temp_setpoint = -80.0
+        self._temp = ambient_temp
+        self._temp_time = self._now()
+
+        self._acquiring = False
+        self._acq_start = 0.0
+        self._trigger_times = []
+        self._frames = {}
+        self._generated = 0
+        self._last_read = -1
+        self._skipped = 0
+
+    # Clock
+    def _now(self):
+        "Virtual instrument time (seconds); with time_scale=0 it only advances while waiting"
+        if not self.time_scale:
+            return self._clock
+        return time.monotonic() / self.time_scale
+
+    # Connection / misc
+    def close(self):
+        self.stop_acquisition()
+        self.opened = False
+
+    def is_opened(self):
+        return self.opened
+
+    def attach_spectrograph(self, spectrograph):
+        "Link the simulated spectrograph so frames follow its wavelength calibration"
+        self.spectrograph = spectrograph
+
+    def get_detector_size(self):
+        return self.width, self.height
+
+    def get_pixel_size(self):
+        return self.pixel_size_um * 1e-6, self.pixel_size_um * 1e-6
+
+    # Cooling
+    def _update_temperature(self):
+        now = self._now()
+        dt = max(now - self._temp_time, 0.0)
+        target = self._temp_setpoint if self._cooler_on else self.ambient_temp
+        self._temp = target + (self._temp - target) * np.exp(-dt / self.cooling_tau_s)
+        self._temp_time = now
+        return self._temp
+
+    def get_temperature(self):
+        with self._lock:
+            return float(self._update_temperature() + self.rng.normal(0, 0.05))
+
+    def get_temperature_setpoint(self):
+        return self._temp_setpoint
+
+    def set_temperature(self, temperature, enable_cooler=True):
+        with self._lock:
+            self._update_temperature()
+            self._temp_setpoint = float(temperature)
+            if enable_cooler:
+                self._cooler_on = True
+        return self._temp_setpoint
+
+    def set_cooler(self, on=True):
+        with self._lock:
+            self._update_temperature()
+            self._cooler_on = bool(on)
+
+    def is_cooler_on(self):
+        return self._cooler_on
+
+    def get_temperature_status(self):
+        with self._lock:
+            if not self._cooler_on:
+                return "off"
+            temp = self._update_temperature()
+            if abs(temp - self._temp_setpoint) > 1.0:
+                return "not_reached"
+            return "stabilized"
+
+    def set_fan_mode(self, mode):
+        if mode not in ["full", "low", "off"]:
+            raise ValueError(f"unknown fan mode: {mode}")
+        self._fan_mode = mode
+
+    def get_fan_mode(self):
+        return self._fan_mode
+
+    def setup_shutter(self, mode, ttl_mode=0, open_time=None, close_time=None):
+        if mode not in ["auto", "open", "closed"]:
+            raise ValueError(f"unknown shutter mode: {mode}")
+        self._shutter = mode
+        self._shutter_parameters = (mode, ttl_mode, open_time, close_time)
+        return self._shutter_parameters
+
+    def get_shutter_parameters(self):
+        return self._shutter_parameters
+
+    # Readout geometry
+    def set_read_mode(self, mode):
+        if mode not in self.READ_MODES:
+            raise ValueError(f"unknown read mode: {mode}")
+        self._read_mode = mode
+        return mode
+
+    def get_read_mode(self):
+        return self._read_mode
+
+    def set_roi(self, hstart=0, hend=None, vstart=0, vend=None, hbin=1, vbin=1):
+        "Image-mode readout area; like pylablib, this always selects image readout"
+        hend = self.width if hend is None else hend
+        vend = self.height if vend is None else vend
+        self._roi = (hstart, hend, vstart, vend, hbin, vbin)
+        self._read_mode = "image"
+        return self.get_roi()
+
+    def get_roi(self):
+        return self._roi
+
+    def setup_image_mode(self, hstart=0, hend=None, vstart=0, vend=None, hbin=1, vbin=1):
+        return self.set_roi(hstart, hend, vstart, vend, hbin, vbin)
+
+    def get_image_mode_parameters(self):
+        return self._roi
+
+    def setup_single_track_mode(self, center=0, width=1):
+        self._read_mode = "single_track"
+        self._single_track = (center, width)
+        return self._single_track
+
+    def get_single_track_mode_parameters(self):
+        return self._single_track
+
+    def setup_multi_track_mode(self, number=1, height=1, offset=0):
+        self._read_mode = "multi_track"
+        self._multi_track = (number, height, offset)
+        top, gap = self._multi_track_layout()
+        return (number, height, offset, top, gap)
+
+    def get_multi_track_mode_parameters(self):
+        return self._multi_track
+
+    def _multi_track_layout(self):
+        number, height, offset = self._multi_track
+        gap = max((self.height - number * height) // number, 0)
+        top = min(max(gap // 2 + offset, 0), self.height - number * height)
+        return top, gap
+
+    def _row_bands(self):
+        "List of (start, stop) detector row ranges, one per output row"
+        mode = self._read_mode
+        if mode == "fvb":
+            return [(0, self.height)]
+        if mode == "single_track":
+            center, width = self._single_track
+            start = max(int(center - width // 2), 0)
+            return [(start, min(start + int(width), self.height))]
+        if mode == "multi_track":
+            number, height, _ = self._multi_track
+            top, gap = self._multi_track_layout()
+            return [(top + i * (height + gap), top + i * (height + gap) + height) for i in range(number)]
+        _, _, vstart, vend, _, vbin = self._roi
+        return [(r, r + vbin) for r in range(vstart, vend - vbin + 1, vbin)]
+
+    def _col_range(self):
+        hstart, hend, _, _, hbin, _ = self._roi
+        if self._read_mode != "image":
+            hstart, hend, hbin = 0, self.width, 1
+        n = (hend - hstart) // hbin
+        return hstart, hbin, n
+
+    def get_data_dimensions(self):
+        rows = self._row_bands()
+        _, _, ncols = self._col_range()
+        return len(rows), ncols
+
+    # Speeds / timing model
+    def get_all_vsspeeds(self):
+        return list(self.vsspeeds_us)
+
+    def set_vsspeed(self, speed):
+        if not 0 <= speed < len(self.vsspeeds_us):
+            raise ValueError(f"vsspeed index out of range: {speed}")
+        self._vsspeed = int(speed)
+
+    def get_vsspeed(self):
+        return self._vsspeed
+
+    def get_max_vsspeed(self):
+        return 0
+
+    def get_readout_time(self):
+        "Modeled readout time: all rows shifted vertically, every output row read horizontally"
+        _, _, ncols = self._col_range()
+        n_out = len(self._row_bands())
+        vshift = self.height * self.vsspeeds_us[self._vsspeed] * 1e-6
+        hread = n_out * ncols / (self.hsspeed_mhz * 1e6)
+        return self.readout_overhead_s + vshift + hread
+
+    def _accum_frame_time(self):
+        "Time to expose and read one accumulation"
+        return self._exposure + self.get_readout_time()
+
+    def _frame_timing(self):
+        "Return (first frame done, frame period, total frames or None)"
+        single = self._accum_frame_time()
+        mode = self._acq_mode
+        if mode == "single":
+            return single, single, 1
+        if mode == "accum":
+            num_acc, acc_cycle = self._accum
+            acc = max(acc_cycle, single)
+            done = acc * (num_acc - 1) + single
+            return done, done, 1
+        if mode in ["kinetic", "fast_kinetic"]:
+            num_cycle, cycle_time, num_acc, acc_cycle, _ = self._kinetic
+            acc = max(acc_cycle, single)
+            done = acc * (num_acc - 1) + single
+            return done, max(cycle_time, done), num_cycle
+        return single, max(self._cont_cycle, single), None
+
+    def get_cycle_timings(self):
+        _, period, _ = self._frame_timing()
+        acc = max(self._accum[1] if self._acq_mode == "accum" else self._kinetic[3], self._accum_frame_time())
+        return self._exposure, acc, period
+
+    # Acquisition settings
+    def set_exposure(self, exposure):
+        self._exposure = float(exposure)
+        return self._exposure
+
+    def get_exposure(self):
+        return self._exposure
+
+    def set_acquisition_mode(self, mode="single"):
+        if mode not in self.ACQ_MODES:
+            raise ValueError(f"unknown acquisition mode: {mode}")
+        self._acq_mode = mode
+        return mode
+
+    def get_acquisition_mode(self):
+        return self._acq_mode
+
+    def setup_accum_mode(self, num_acc, cycle_time_acc=0):
+        self._acq_mode = "accum"
+        self._accum = (int(num_acc), float(cycle_time_acc))
+
+    def get_accum_mode_parameters(self):
+        return self._accum
+
+    def setup_kinetic_mode(self, num_cycle, cycle_time=0.0, num_acc=1, cycle_time_acc=0, num_prescan=0):
+        self._acq_mode = "kinetic"
+        self._kinetic = (int(num_cycle), float(cycle_time), int(num_acc), float(cycle_time_acc), int(num_prescan))
+
+    def get_kinetic_mode_parameters(self):
+        return self._kinetic
+
+    def setup_cont_mode(self, cycle_time=0):
+        self._acq_mode = "cont"
+        self._cont_cycle = float(cycle_time)
+
+    def get_cont_mode_parameters(self):
+        return self._cont_cycle
+
+    def set_trigger_mode(self, mode):
+        if mode not in ["int", "ext", "ext_start", "ext_exp", "software"]:
+            raise ValueError(f"unknown trigger mode: {mode}")
+        self._trigger_mode = mode
+
+    def get_trigger_mode(self):
+        return self._trigger_mode
+
+    def set_frame_format(self, fmt):
+        if fmt not in ["list", "array", "chunks", "try_chunks"]:
+            raise ValueError(f"unknown frame format: {fmt}")
+        self._frame_format = "array" if fmt in ["chunks", "try_chunks"] else fmt
+
+    def get_frame_format(self):
+        return self._frame_format
+
+    # Acquisition control
+    def start_acquisition(self, mode=None, nframes=None):
+        "Start acquiring, switching the acquisition mode first if `mode` is given"
+        with self._lock:
+            if mode is not None:
+                self.set_acquisition_mode(mode)
+            self._acquiring = True
+            self._acq_start = self._now()
+            self._trigger_times = []
+            self._frames = {}
+            self._generated = 0
+            self._last_read = -1
+            self._skipped = 0
+
+    def stop_acquisition(self):
+        with self._lock:
+            self._update_frames()
+            self._acquiring = False
+
+    def clear_acquisition(self):
+        self.stop_acquisition()
+
+    def acquisition_in_progress(self):
+        with self._lock:
+            if not self._acquiring:
+                return False
+            _, _, total = self._frame_timing()
+            return total is None or self._acquired_count() < total
+
+    def send_software_trigger(self):
+        with self._lock:
+            if self._acquiring and self._trigger_mode == "software":
+                self._trigger_times.append(self._now())
+
+    def _frame_done_time(self, index):
+        "Virtual time at which frame `index` finishes reading out (None if not scheduled)"
+        first, period, total = self._frame_timing()
+        if total is not None and index >= total:
+            return None
+        if self._trigger_mode == "software":
+            if index >= len(self._trigger_times):
+                return None
+            return self._trigger_times[index] + first
+        return self._acq_start + first + index * period
+
+    def _acquired_count(self):
+        if not self._acquiring:
+            return self._generated
+        first, period, total = self._frame_timing()
+        now = self._now()
+        if self._trigger_mode == "software":
+            n = sum(1 for t in self._trigger_times if t + first <= now)
+        else:
+            elapsed = now - self._acq_start - first
+            # the tolerance keeps a frame due exactly now (instant virtual time) from rounding away
+            n = 0 if elapsed < -1e-9 else int(np.floor(elapsed / period + 1e-9)) + 1
+        return n if total is None else min(n, total)
+
+    def _update_frames(self):
+        "Generate any frames that finished since the last call, keeping only the ring buffer"
+        if not self._acquiring:
+            return self._generated
+        acquired = self._acquired_count()
+        start = max(self._generated, acquired - self.buffer_size)
+        for index in range(start, acquired):
+            self._frames[index] = self._render_frame()
+        for index in [i for i in self._frames if i < acquired - self.buffer_size]:
+            del self._frames[index]
+        self._generated = acquired
+        return acquired
+
+    def get_frames_status(self):
+        with self._lock:
+            acquired = self._update_frames()
+            full_unread = acquired - 1 - self._last_read
+            unread = min(full_unread, self.buffer_size)
+            return acquired, unread, self._skipped + (full_unread - unread), self.buffer_size
+
+    def get_new_images_range(self):
+        with self._lock:
+            acquired = self._update_frames()
+            start = max(self._last_read + 1, acquired - self.buffer_size)
+            return (start, acquired) if acquired > start else None
+
+    def wait_for_frame(self, since="lastread", nframes=1, timeout=20.0, error_on_stopped=False):
+        with self._lock:
+            acquired = self._update_frames()
+            if since == "lastread":
+                target = self._last_read + nframes
+            elif since == "start":
+                target = nframes - 1
+            else:
+                target = acquired - 1 + nframes
+        deadline = time.monotonic() + (timeout if timeout is not None else float("inf"))
+        while True:
+            with self._lock:
+                acquired = self._update_frames()
+                if acquired - 1 >= target:
+                    return
+                if not self._acquiring and error_on_stopped:
+                    raise RuntimeError("acquisition stopped while waiting for a frame")
+                done = self._frame_done_time(target)
+            now_real = time.monotonic()
+            if now_real >= deadline:
+                raise TimeoutError("timed out waiting for a frame")
+            if done is None:
+                pause = 1e-3
+            elif not self.time_scale:
+                with self._lock:
+                    self._clock = max(self._clock, done)
+                continue
+            else:
+                pause = (done - self._now()) * self.time_scale
+            time.sleep(min(max(pause, 1e-4), deadline - now_real))
+
+    def read_multiple_images(self, rng=None, peek=False, missing_frame="skip", return_info=False, return_rng=False):
+        with self._lock:
+            acquired = self._update_frames()
+            if rng is None:
+                rng = (self._last_read + 1, acquired)
+            first, last = rng
+            last = min(last, acquired)
+            oldest = max(acquired - self.buffer_size, 0)
+            start = max(first, oldest)
+            indices = list(range(start, last))
+            frames = [self._frames[i] for i in indices]
+            if not peek:
+                self._skipped += max(start - 1 - self._last_read, 0)
+                self._last_read = max(self._last_read, last - 1)
+        if self._frame_format == "array":
+            rows, cols = self.get_data_dimensions()
+            frames = np.array(frames).reshape(len(indices), rows, cols)
+        result = [frames]
+        if return_info:
+            result.append(indices)
+        if return_rng:
+            result.append((start, max(start, last)))
+        return result[0] if len(result) == 1 else tuple(result)
+
+    def read_newest_image(self, peek=False, return_info=False):
+        with self._lock:
+            acquired = self._update_frames()
+            if acquired == 0 or acquired - 1 <= self._last_read:
+                return None
+            index = acquired - 1
+            frame = self._frames[index]
+            if not peek:
+                self._skipped += max(index - 1 - self._last_read, 0)
+                self._last_read = index
+        return (frame, index) if return_info else frame
+
+    def snap(self, timeout=5.0, return_info=False):
+        """
+        Acquire one frame, blocking for the modeled duration. As in pylablib, this
+        switches the camera to continuous mode, so accumulate/kinetic settings are lost.
+        """
+        self.start_acquisition(mode="cont")
+        if self._trigger_mode == "software":
+            self.send_software_trigger()
+        try:
+            self.wait_for_frame(since="start", nframes=1, timeout=timeout)
+            with self._lock:
+                self._update_frames()
+                frame = self._frames[0]
+                self._last_read = max(self._last_read, 0)
+        finally:
+            self.stop_acquisition()
+        return (frame, 0) if return_info else frame
+
+    # Frame synthesis
+    def _column_axis_nm(self):
+        if self.spectrograph is not None:
+            return self.spectrograph.calibration_for(self.width, self.pixel_size_um)
+        return np.linspace(500.0, 600.0, self.width)
+
+    def _row_profile(self):
+        "Fraction of the signal falling on each detector row"
+        rows = np.arange(self.height) + 0.5
+        profile = np.zeros(self.height)
+        for center, scale in zip(self.track_centers, self.track_scales):
+            profile += scale * np.exp(-0.5 * ((rows - center) / self.track_sigma) ** 2)
+        return profile / max(sum(self.track_scales), 1e-12) / (self.track_sigma * np.sqrt(2 * np.pi))
+
+    def dark_rate(self, temperature=None):
+        "Dark current (e-/pixel/s), halving every ~6 degC"
+        temp = self._update_temperature() if temperature is None else temperature
+        return self.dark_rate_20c * 2.0 ** ((temp - 20.0) / 6.0)
+
+    def _expected_electrons(self, exposure):
+        "Expected electrons per output pixel and the detector pixel count behind each output pixel"
+        hstart, hbin, ncols = self._col_range()
+        col_slice = slice(hstart, hstart + ncols * hbin)
+        rate = self.sample.rate(self._column_axis_nm())[col_slice]
+        if self.spectrograph is not None:
+            rate = rate * self.spectrograph.throughput()
+        col_rate = rate.reshape(ncols, hbin).sum(axis=1)
+
+        cum = np.concatenate([[0.0], np.cumsum(self._row_profile())])
+        bands = np.array(self._row_bands())
+        row_weight = cum[bands[:, 1]] - cum[bands[:, 0]]
+        pixels_per_bin = (bands[:, 1] - bands[:, 0])[:, None] * hbin
+
+        signal = np.outer(row_weight, col_rate)
+        if self._shutter == "closed":
+            signal = np.zeros_like(signal)
+        dark = self.dark_rate() * pixels_per_bin
+        return (signal + dark) * exposure, bands
+
+    def _add_cosmic_rays(self, electrons, bands, exposure):
+        hstart, hbin, ncols = self._col_range()
+        n_hits = self.rng.poisson(self.cosmic_rate * exposure)
+        for _ in range(n_hits):
+            row = self.rng.integers(0, self.height)
+            col = (self.rng.integers(hstart, hstart + ncols * hbin) - hstart) // hbin
+            out_rows = np.nonzero((bands[:, 0] <= row) & (bands[:, 1] > row))[0]
+            if len(out_rows):
+                electrons[out_rows[0], col] += self.rng.uniform(500, 20000)
+        return electrons
+
+    def _render_frame(self):
+        "One read-out frame: shot noise, dark current, cosmic rays, read noise and bias"
+        mode = self._acq_mode
+        if mode == "accum":
+            n_acc = self._accum[0]
+        elif mode in ["kinetic", "fast_kinetic"]:
+            n_acc = self._kinetic[2]
+        else:
+            n_acc = 1
+        expected, bands = self._expected_electrons(self._exposure)
+        frame = np.zeros(expected.shape)
+        for _ in range(n_acc):
+            electrons = self.rng.poisson(expected).astype(float)
+            electrons = self._add_cosmic_rays(electrons, bands, self._exposure)
+            electrons += self.rng.normal(0.0, self.read_noise_e, expected.shape)
+            frame += electrons / self.gain + self.bias
+        return np.clip(np.round(frame), 0, None).astype(np.int32)
+
+
+class SimulatedShamrockSpectrograph:
+    """Simulated Kymera/Shamrock Czerny-Turner spectrograph with grating move latency"""
+
+    def __init__(self, device_index=0, focal_length_mm=193.0, deviation_deg=24.0,
+                 gratings=((1200, 500.0), (600, 500.0), (300, 500.0)),
+                 wavelength_nm=600.0, grating_switch_s=6.0, move_base_s=0.2,
+                 move_speed_nm_s=200.0, move_jitter_s=0.05, position_noise_nm=0.02,
+                 offset_step_nm=0.01, time_scale=1.0, seed=None):
+        if time_scale < 0:
+            raise ValueError(f"time_scale must be >= 0, got {time_scale}")
+        self.device_index = device_index
+        self.focal_length_mm = focal_length_mm
+        self.deviation_deg = deviation_deg
+        self.gratings = [tuple(g) for g in gratings]
+        self.grating_switch_s = grating_switch_s
+        self.move_base_s = move_base_s
+        self.move_speed_nm_s = move_speed_nm_s
+        self.move_jitter_s = move_jitter_s
+        self.position_noise_nm = position_noise_nm
+        self.offset_step_nm = offset_step_nm
+        self.time_scale = time_scale
+        self.rng = np.random.default_rng(seed)
+
+        self._grating = 1
+        self._wavelength_nm = float(wavelength_nm)
+        self._actual_nm = float(wavelength_nm)
+        self._offsets = {i + 1: 0 for i in range(len(self.gratings))}
+        self._pixel_width = 26e-6
+        self._number_pixels = 1024
+        self._slits = {"input_side": 50e-6, "input_direct": 50e-6}
+        self._focus_mirror = 0
+        self._focus_mirror_max = 1000
+        self.opened = True
+
+    def _sleep(self, duration):
+        if duration > 0 and self.time_scale:
+            time.sleep(duration * self.time_scale)
+
+    def close(self):
+        self.opened = False
+
+    def is_opened(self):
+        return self.opened
+
+    # Pixels
+    def setup_pixels_from_camera(self, cam):
+        pixel_size = cam.get_pixel_size()
+        det_size = cam.get_detector_size()
+        self.set_pixel_width(pixel_size[0])
+        self.set_number_pixels(det_size[0])
+        if hasattr(cam, "attach_spectrograph"):
+            cam.attach_spectrograph(self)
+        return self.get_pixel_width(), self.get_number_pixels()
+
+    def set_pixel_width(self, width):
+        self._pixel_width = float(width)
+
+    def get_pixel_width(self):
+        return self._pixel_width
+
+    def set_number_pixels(self, number):
+        self._number_pixels = int(number)
+
+    def get_number_pixels(self):
+        return self._number_pixels
+
+    # Grating / wavelength
+    def get_grating(self):
+        return self._grating
+
+    def set_grating(self, grating):
+        if not 1 <= grating <= len(self.gratings):
+            raise ValueError(f"grating index out of range: {grating}")
+        if grating != self._grating:
+            self._sleep(self.grating_switch_s + abs(self.rng.normal(0, self.move_jitter_s)))
+            self._grating = int(grating)
+            self._actual_nm = self._wavelength_nm + self.rng.normal(0, self.position_noise_nm)
+        return self._grating
+
+    def get_grating_info(self, grating=None):
+        info = [{"name": f"{lines} l/mm, blaze {blaze:.0f} nm", "lines": lines * 1e3, "blaze_wavelength": blaze * 1e-9}
+                for lines, blaze in self.gratings]
+        return info if grating is None else info[grating - 1]
+
+    def get_grating_offset(self, grating=None):
+        return self._offsets[self._grating if grating is None else grating]
+
+    def set_grating_offset(self, offset, grating=None):
+        self._offsets[self._grating if grating is None else grating] = int(offset)
+
+    def set_wavelength(self, wavelength):
+        wl_nm = wavelength * 1e9
+        self._check_wavelength(wl_nm)
+        delta = abs(wl_nm - self._wavelength_nm)
+        self._sleep(self.move_base_s + delta / self.move_speed_nm_s + abs(self.rng.normal(0, self.move_jitter_s)))
+        self._wavelength_nm = wl_nm
+        self._actual_nm = wl_nm + self.rng.normal(0, self.position_noise_nm)
+        return self.get_wavelength()
+
+    def get_wavelength(self):
+        return self._wavelength_nm * 1e-9
+
+    def _check_wavelength(self, wl_nm):
+        lines = self.gratings[self._grating - 1][0]
+        if wl_nm <= 0 or wl_nm * 1e-6 * lines >= 2 * np.cos(np.radians(self.deviation_deg) / 2):
+            raise ValueError(f"wavelength {wl_nm:.2f} nm is out of range for grating {self._grating}")
+
+    def calibration_for(self, number_pixels, pixel_width_um):
+        "Wavelength (nm) of each pixel centre from the Czerny-Turner grating equation"
+        lines = self.gratings[self._grating - 1][0]
+        center_mm = (self._actual_nm + self._offsets[self._grating] * self.offset_step_nm) * 1e-6
+        half = np.radians(self.deviation_deg) / 2
+        psi = np.arcsin(center_mm * lines / (2 * np.cos(half)))
+        alpha, beta = psi + half, psi - half
+        x_mm = (np.arange(number_pixels) - (number_pixels - 1) / 2) * pixel_width_um * 1e-3
+        beta_x = beta + np.arctan(x_mm / self.focal_length_mm)
+        return (np.sin(alpha) + np.sin(beta_x)) / lines * 1e6
+
+    def get_calibration(self):
+        if not self._number_pixels:
+            return np.zeros(0)
+        return self.calibration_for(self._number_pixels, self._pixel_width * 1e6) * 1e-9
+
+    # Slits / focus
+    def get_slit_width(self, slit):
+        return self._slits[slit]
+
+    def set_slit_width(self, slit, width):
+        self._slits[slit] = float(width)
+
+    def throughput(self):
+        "Relative signal throughput of the entrance slit (1.0 at 50 um)"
+        return self._slits["input_side"] / 50e-6
+
+    def is_focus_mirror_present(self):
+        return True
+
+    def get_focus_mirror_position(self):
+        return self._focus_mirror
+
+    def set_focus_mirror_position(self, position):
+        self._focus_mirror = int(np.clip(position, 0, self._focus_mirror_max))
+
+    def get_focus_mirror_position_max(self):
+        return self._focus_mirror_max
+
+
+def measure_throughput(spec, laser_wl=532.0, n_frames=50):
+    "Time `n_frames` blocking spectrum acquisitions; return frames per second"
+    t0 = time.perf_counter()
+    for _ in range(n_frames):
+        spec.acquire_spectrum(laser_wl)
+    return n_frames / (time.perf_counter() - t0)
+
+
+if __name__ == "__main__":
+    from Spectrometer import create_controllers
+
+    camera, kymera, spec = create_controllers("sim")
+    camera.connect()
+    kymera.setup_from_camera(camera.cam)
+    camera.set_readout_mode("fvb")
+    camera.set_exposure(0.01)
+    print(f"FVB, 10 ms exposure: {measure_throughput(spec):.1f} spectra/s")
+    camera.shutdown()
@@ -0,0 +1,18 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Spectrometer import AndorCameraController
+from Spectrometer_Sim import SimulatedAndorCamera
+
+
+@pytest.fixture
+def camera():
+    "Connected camera controller on a simulated iDus running in instant virtual time"
+    cam = AndorCameraController(camera_factory=lambda: SimulatedAndorCamera(time_scale=0, seed=0))
+    cam.connect()
+    yield cam
+    cam.disconnect()
@@ -0,0 +1,101 @@
+import threading
+
+import numpy as np
+from astropy.io import fits
+
+from Spectrometer import AndorCameraController
+from Spectrometer_Sim import SimulatedAndorCamera
+
+
+class SkippingCamera(SimulatedAndorCamera):
+    "Simulated camera whose reads leave out every third frame, like missing_frame='skip'"
+    def read_multiple_images(self, rng=None, peek=False, missing_frame="skip", return_info=False, return_rng=False):
+        frames, indices = super().read_multiple_images(rng, peek, missing_frame, return_info=True)
+        keep = [k for k, index in enumerate(indices) if index % 3 != 1]
+        frames = np.asarray(frames)[keep]
+        indices = [indices[k] for k in keep]
+        return (frames, indices) if return_info else frames
+
+
+def connected(factory):
+    cam = AndorCameraController(camera_factory=factory)
+    cam.connect()
+    cam.set_readout_mode("fvb")
+    return cam
+
+
+def test_kinetic_series_longer_than_timeout():
+    # 64 frames of 0.2 s take ~0.13 s real time at time_scale=0.01, more than the timeout
+    cam = connected(lambda: SimulatedAndorCamera(time_scale=0.01, seed=0))
+    cam.set_exposure(0.2)
+    frames, timestamps = cam.acquire_kinetic_series(64, timeout=0.05)
+    assert frames.shape == (64, 1, 1024)
+    assert not np.isnan(timestamps).any()
+    assert (frames.sum(axis=(1, 2)) > 0).all()
+
+
+def test_kinetic_series_places_frames_by_index():
+    cam = connected(lambda: SkippingCamera(time_scale=0.001, seed=0))
+    frames, timestamps = cam.acquire_kinetic_series(30, batch_size=7)
+    missing = np.arange(30) % 3 == 1
+    assert np.isnan(timestamps[missing]).all()
+    assert not np.isnan(timestamps[~missing]).any()
+    assert (frames[missing] == 0).all()
+    assert (frames[~missing].sum(axis=(1, 2)) > 0).all()
+
+
+def test_iter_stream_leaves_unyielded_frames_unread():
+    cam = connected(lambda: SimulatedAndorCamera(time_scale=0, seed=0))
+    cam.start_stream(buffer_frames=64)
+    try:
+        # instant virtual time: ten frames are ready before the first read
+        cam.cam.wait_for_frame(since="start", nframes=10)
+        first = [index for index, _, _ in cam.iter_stream(max_frames=5)]
+        rest, _, _ = cam.stream.read_new()
+    finally:
+        cam.stop_stream()
+    assert first == list(range(5))
+    assert list(rest[:5]) == list(range(5, 10))
+
+
+def test_stream_counts_skipped_frames_under_concurrent_drains():
+    cam = connected(lambda: SkippingCamera(time_scale=0, seed=0))
+    cam.start_stream(buffer_frames=1024)
+
+    def drain():
+        while cam.stream_status()["last_index"] < 300:
+            if cam.wait_stream(timeout=1.0):
+                cam.drain_stream()
+
+    threads = [threading.Thread(target=drain) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    cam.stop_stream()
+    status = cam.stream_status()
+    indices, _, _ = cam.stream.read_new()
+    assert (np.diff(indices) > 0).all()
+    assert status["received"] + status["dropped_camera"] == status["last_index"] + 1
+    assert status["dropped_camera"] == (np.arange(status["last_index"] + 1) % 3 == 1).sum()
+
+
+def test_concurrent_drains_record_frames_in_order(tmp_path):
+    cam = connected(lambda: SimulatedAndorCamera(time_scale=0, seed=0))
+    cam.start_stream(buffer_frames=1024)
+    path = cam.record_stream(200, "stream.fits", str(tmp_path))
+
+    def drain():
+        while cam.series_writer is not None:
+            if cam.wait_stream(timeout=1.0):
+                cam.drain_stream()
+
+    threads = [threading.Thread(target=drain) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    cam.stop_stream()
+    with fits.open(path) as hdul:
+        assert list(hdul["FRAMES"].data["FRAME"]) == list(range(200))
+        assert hdul[0].data.shape[0] == 200
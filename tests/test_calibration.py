@@ -0,0 +1,81 @@
+import os
+import threading
+
+import numpy as np
+
+from Spectrometer import DEFAULT_CALIBRATION_CACHE, KymeraController, calibration_cache_path, create_controllers
+from Spectrometer_Sim import SimulatedShamrockSpectrograph
+
+
+def sim_controllers():
+    camera, kymera, spec = create_controllers("sim", time_scale=0, seed=0)
+    camera.connect()
+    kymera.setup_from_camera(camera.cam)
+    return camera, kymera, spec
+
+
+def test_default_cache_stays_in_memory(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    _, kymera, _ = sim_controllers()
+    kymera.get_calibration_nm()
+    assert kymera.calibration_cache.path is None
+    assert not list(tmp_path.iterdir())
+
+
+def test_andor_cache_defaults_to_a_per_user_file(monkeypatch, tmp_path):
+    monkeypatch.delenv("SPECTROMETER_CALIBRATION_CACHE", raising=False)
+    assert calibration_cache_path() == DEFAULT_CALIBRATION_CACHE
+    assert DEFAULT_CALIBRATION_CACHE.startswith(os.path.expanduser("~"))
+    monkeypatch.setenv("SPECTROMETER_CALIBRATION_CACHE", str(tmp_path / "cache.npz"))
+    assert calibration_cache_path() == str(tmp_path / "cache.npz")
+
+
+def test_cache_reloads_after_restart(tmp_path):
+    camera, _, _ = sim_controllers()
+    path = str(tmp_path / "nested" / "cache.npz")
+
+    def restart():
+        kymera = KymeraController(spectrograph_factory=lambda idx: SimulatedShamrockSpectrograph(idx, time_scale=0),
+                                  calibration_cache=path)
+        kymera.setup_from_camera(camera.cam)
+        return kymera
+
+    first = restart().get_calibration_nm()
+    kymera = restart()
+    assert np.array_equal(kymera.get_calibration_nm(), first)
+    assert (kymera.calibration_cache.hits, kymera.calibration_cache.misses) == (1, 0)
+
+
+def test_binning_change_rebuilds_axis():
+    camera, kymera, _ = sim_controllers()
+    full = kymera.get_calibration_nm()
+    camera.set_roi(hbin=4)
+    kymera.setup_from_camera(camera.cam)
+    binned = kymera.get_calibration_nm()
+    assert len(full) == 1024 and len(binned) == 256
+    assert np.allclose(binned, full.reshape(-1, 4).mean(axis=1))
+
+
+def test_concurrent_moves_and_reads_stay_consistent():
+    _, kymera, _ = sim_controllers()
+    errors = []
+
+    def mover():
+        for center in np.linspace(550, 650, 50):
+            kymera.set_central_wavelength(center)
+
+    def reader():
+        try:
+            for _ in range(200):
+                wl = kymera.get_calibration_nm()
+                assert len(wl) == 1024
+        except Exception as error:
+            errors.append(error)
+
+    threads = [threading.Thread(target=mover)] + [threading.Thread(target=reader) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+    assert abs(np.mean(kymera.get_calibration_nm()) - 650) < 5
@@ -0,0 +1,69 @@
+import pytest
+
+
+def test_repeated_settings_are_not_rewritten(camera):
+    assert camera.apply_settings(exposure=0.5, trigger_mode="int") == ["exposure", "trigger_mode"]
+    assert camera.apply_settings(exposure=0.5, trigger_mode="int") == []
+    assert camera.cam.get_exposure() == 0.5
+
+
+def test_geometry_forgets_read_mode(camera):
+    camera.set_readout_mode("fvb")
+    camera.set_roi(hbin=2)
+    assert camera.cam.get_read_mode() == "image"
+    assert camera.apply_settings(read_mode="fvb") == ["read_mode"]
+    assert camera.cam.get_read_mode() == "fvb"
+
+
+def test_mode_setup_switches_cached_acquisition_mode(camera):
+    camera.set_acquisition_mode("single")
+    camera.setup_cont_mode(0)
+    assert camera.cam.get_acquisition_mode() == "cont"
+    assert camera.acquisition_mode == "cont"
+    assert camera.apply_settings(acquisition_mode="single") == ["acquisition_mode"]
+    assert camera.cam.get_acquisition_mode() == "single"
+    assert camera.acquisition_mode == "single"
+
+
+def test_mode_setup_rewritten_after_mode_change(camera):
+    camera.setup_cont_mode(0)
+    camera.set_acquisition_mode("single")
+    assert camera.apply_settings(cont=0) == ["cont"]
+    assert camera.cam.get_acquisition_mode() == "cont"
+
+
+def test_conflicting_modes_are_rejected(camera):
+    camera.set_acquisition_mode("single")
+    with pytest.raises(ValueError):
+        camera.apply_settings(acquisition_mode="single", accum=(3, 0))
+    assert camera.cam.get_acquisition_mode() == "single"
+    assert camera.acquisition_mode == "single"
+
+
+def test_matching_mode_and_timings_written_once(camera):
+    assert camera.apply_settings(acquisition_mode="accum", accum=(3, 0)) == ["accum"]
+    assert camera.cam.get_acquisition_mode() == "accum"
+    assert camera.cam.get_accum_mode_parameters() == (3, 0.0)
+    assert camera.apply_settings(acquisition_mode="accum", accum=(3, 0)) == []
+
+
+def test_snap_forgets_cached_acquisition_mode(camera):
+    camera.set_readout_mode("fvb")
+    camera.acquire_kinetic_series(3, num_acc=2)
+    camera.acquire_single()
+    assert camera.cam.get_acquisition_mode() == "cont"
+    camera.acquire_kinetic_series(3, num_acc=2)
+    assert camera.cam.get_acquisition_mode() == "kinetic"
+    assert camera.cam.get_kinetic_mode_parameters()[2] == 2
+    camera.setup_accum_mode(4)
+    camera.acquire_dark(2)
+    camera.setup_accum_mode(4)
+    assert camera.cam.get_acquisition_mode() == "accum"
+
+
+def test_stream_forgets_cached_acquisition_mode(camera):
+    camera.setup_accum_mode(4)
+    camera.start_stream()
+    camera.stop_stream()
+    camera.setup_accum_mode(4)
+    assert camera.cam.get_acquisition_mode() == "accum"
@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+from Spectrometer import create_controllers
+from Spectrometer_Cube import SpectrumCube
+
+
+@pytest.fixture
+def series(tmp_path):
+    "Kinetic series written to a cube through the controller, and the frames it came from"
+    camera, kymera, spec = create_controllers("sim", time_scale=0, seed=0)
+    camera.connect()
+    kymera.setup_from_camera(camera.cam)
+    camera.set_readout_mode("fvb")
+    cube = spec.open_cube(str(tmp_path / "cube"), 40, laser_wl=532.0, fields=("x_um",))
+    with cube:
+        frames, timestamps = camera.acquire_kinetic_series(40, batch_size=9, writer=cube)
+    return str(tmp_path / "cube"), frames[:, 0, :].astype(float), timestamps
+
+
+def test_cube_round_trip(series):
+    directory, spectra, timestamps = series
+    cube = SpectrumCube(directory, mode="r")
+    assert (cube.count, cube.n_pixels) == (40, 1024)
+    assert list(cube.axes) == ["raman_shift", "wavelength_nm"]
+    assert np.array_equal(cube.spectra, spectra.astype(np.float32))
+    assert list(cube.frames["index"]) == list(range(40))
+    assert np.allclose(cube.frames["timestamp"], timestamps)
+    assert np.isnan(cube.frames["x_um"]).all()
+    assert cube.metadata["laser_wavelength_nm"] == 532.0
+    with pytest.raises(ValueError):
+        cube.append(spectra[0])
+
+
+def test_chunked_reductions_match_numpy(series):
+    directory, spectra, _ = series
+    # ~3 frames per chunk, reduced on a thread pool
+    cube = SpectrumCube(directory, mode="r", chunk_bytes=3 * 1024 * 4, workers=4)
+    raman = cube.axes["raman_shift"]
+    band = (980.0, 1020.0)
+    inside = (raman >= band[0]) & (raman <= band[1])
+    assert np.allclose(cube.mean(), spectra.mean(axis=0))
+    assert np.allclose(cube.mean(10, 25), spectra[10:25].mean(axis=0))
+    assert np.allclose(cube.frame_mean(band), spectra[:, inside].mean(axis=1))
+    integrals = cube.band_integrals([band, (1590.0, 1610.0)])
+    assert integrals.shape == (40, 2)
+    assert np.allclose(integrals[:, 0], np.abs(np.trapezoid(spectra[:, inside], raman[inside], axis=1)))
+    pixels, positions, values = cube.argmax(band)
+    expected = np.nonzero(inside)[0][spectra[:, inside].argmax(axis=1)]
+    assert np.array_equal(pixels, expected)
+    assert np.allclose(positions, raman[expected])
+    assert np.allclose(values, spectra[np.arange(40), expected])
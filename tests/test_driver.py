@@ -0,0 +1,135 @@
+import base64
+import importlib
+import json
+import os
+
+import numpy as np
+
+import pytest
+
+from Spectrometer import TemperatureHistory
+from Spectrometer_IO import calibration_id, decode_spectrum
+
+
+@pytest.fixture(scope="module")
+def driver():
+    previous = os.environ.get("SPECTROMETER_BACKEND")
+    os.environ["SPECTROMETER_BACKEND"] = "sim"
+    try:
+        module = importlib.import_module("Spectrometer_Driver")
+    finally:
+        if previous is None:
+            del os.environ["SPECTROMETER_BACKEND"]
+        else:
+            os.environ["SPECTROMETER_BACKEND"] = previous
+    yield module
+    module.telemetry.stop()
+
+
+def test_roi_change_updates_calibration(driver):
+    client = driver.app.test_client()
+    assert len(driver.kymera.get_calibration_nm()) == 1024
+    resp = client.post("/api/camera/roi", json={"hbin": 2})
+    assert resp.status_code == 200
+    assert len(driver.kymera.get_calibration_nm()) == 512
+    client.post("/api/camera/roi", json={"hbin": 1})
+    assert len(driver.kymera.get_calibration_nm()) == 1024
+
+
+def test_temperature_history_endpoint(driver, monkeypatch):
+    history = TemperatureHistory(min_interval=0)
+    for t, temp in [(1000, -20.0), (1010, -40.0), (1060, -60.0)]:
+        history.record(temp, "not_reached", True, "full", timestamp=t)
+    monkeypatch.setattr(driver.camera, "temperature_history", history)
+    data = driver.app.test_client().get("/api/camera/temperature/history?start=1000&end=1100&bins=4").get_json()
+    assert data["count"] == [2, 0, 1, 0]
+    assert data["temperature_mean"] == [-30.0, None, -60.0, None]
+    assert data["status"][0] == TemperatureHistory.STATUSES.index("not_reached")
+    assert data["status_names"] == TemperatureHistory.STATUSES
+    data = driver.app.test_client().get("/api/camera/temperature/history?end=1100&window=50&bins=2").get_json()
+    assert data["count"] == [1, 0]
+
+
+def test_frame_saving_endpoints(driver, tmp_path):
+    client = driver.app.test_client()
+    driver.camera.set_fvb()  # full image readouts take seconds in real-time simulation
+    resp = client.post("/api/camera/frames", json={"directory": str(tmp_path), "preview": False})
+    assert resp.get_json() == {"directory": str(tmp_path), "preview": False}
+    try:
+        assert client.post("/api/spectrum/acquire", json={"laser_wavelength_nm": 532.0}).status_code == 200
+        driver.camera.writer.flush()
+        status = client.get("/api/camera/writer").get_json()
+    finally:
+        client.post("/api/camera/frames", json={"directory": None})
+    assert status["writer"]["written"] >= 1 and status["writer"]["errors"] == 0
+    assert os.path.exists(status["last_frame"])
+
+
+def test_acquisitions_are_refused_while_live(driver):
+    client = driver.app.test_client()
+    driver.camera.set_fvb()  # full image readouts take seconds in real-time simulation
+    assert client.post("/api/live/start", json={"laser_wavelength_nm": 532.0}).status_code == 200
+    try:
+        for url in ["/api/spectrum/acquire", "/api/spectrum/acquire_async", "/api/spectrum/acquire_tracks"]:
+            assert client.post(url, json={"laser_wavelength_nm": 532.0}).status_code == 409
+    finally:
+        client.post("/api/live/stop")
+    resp = client.post("/api/spectrum/acquire", json={"laser_wavelength_nm": 532.0})
+    assert resp.status_code == 200
+    assert driver.jobs.list_jobs()[-1]["method"] == "acquire_spectrum"
+
+
+def test_axis_etag_and_not_modified(driver):
+    client = driver.app.test_client()
+    calib_id = calibration_id(driver.kymera.get_calibration_nm())
+    resp = client.get("/api/spectrum/axis?laser_wavelength_nm=532")
+    assert resp.status_code == 200 and resp.headers["X-Calibration-Id"] == calib_id
+    etag = resp.headers["ETag"]
+    assert calib_id in etag
+    resp = client.get("/api/spectrum/axis?laser_wavelength_nm=532", headers={"If-None-Match": etag})
+    assert resp.status_code == 304 and resp.data == b""
+    resp = client.get("/api/spectrum/axis?laser_wavelength_nm=785", headers={"If-None-Match": etag})
+    assert resp.status_code == 200
+    resp = client.get("/api/spectrum/axis?laser_wavelength_nm=532",
+                      headers={"If-None-Match": etag, "Accept": driver.SPECTRUM_NPY})
+    assert resp.status_code == 200 and resp.headers["ETag"] != etag
+
+
+def test_binary_spectrum_response(driver):
+    client = driver.app.test_client()
+    driver.camera.set_fvb()
+    resp = client.post("/api/spectrum/acquire", json={"laser_wavelength_nm": 532.0},
+                       headers={"Accept": driver.SPECTRUM_RAW})
+    assert resp.status_code == 200 and resp.headers["Content-Type"] == driver.SPECTRUM_RAW
+    data, calib_id = decode_spectrum(resp.data)
+    assert calib_id == resp.headers["X-Calibration-Id"]
+    assert len(data) == len(driver.kymera.get_calibration_nm()) and np.all(np.isfinite(data))
+
+
+def test_spectrum_event_framing(driver):
+    wl = np.linspace(540.0, 660.0, 16)
+    intensity = np.arange(16, dtype=float) - 3.5
+    event = driver.format_spectrum_event({"frame": 7, "timestamp": 12.5, "wavelength_nm": wl, "intensity": intensity})
+    assert event.endswith("\n\n")
+    lines = event.rstrip("\n").split("\n")
+    assert lines[:2] == ["id: 7", "event: spectrum"]
+    assert lines[2].startswith("data: ") and len(lines) == 3
+    data = json.loads(lines[2][len("data: "):])
+    assert data["frame"] == 7 and data["timestamp"] == 12.5
+    assert data["calibration_id"] == calibration_id(wl)
+    decoded = np.frombuffer(base64.b64decode(data["intensity_b64"]), dtype="<f4")
+    assert np.array_equal(decoded, intensity.astype("<f4"))
+
+
+def test_acquire_tracks_endpoint(driver):
+    client = driver.app.test_client()
+    driver.camera.setup_multi_mode(number=3, height=20, offset=0)
+    try:
+        resp = client.post("/api/spectrum/acquire_tracks", json={"laser_wavelength_nm": 532.0})
+    finally:
+        driver.camera.set_fvb()
+    assert resp.status_code == 200 and resp.headers["X-Tracks"] == "3"
+    data = resp.get_json()
+    assert len(data["intensity"]) == 3
+    assert all(len(track) == len(data["wavelength_nm"]) for track in data["intensity"])
+    assert driver.jobs.list_jobs()[-1]["method"] == "acquire_tracks"
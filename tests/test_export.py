@@ -0,0 +1,56 @@
+import json
+
+import numpy as np
+import pytest
+
+from Spectrometer_IO import write_spectrum
+
+METADATA = {"exposure_s": 0.5, "grating": 1}
+
+
+@pytest.fixture
+def spectrum():
+    rng = np.random.default_rng(0)
+    wl = np.linspace(540.0, 660.0, 1024)
+    return wl, (1e7 / 532.0 - 1e7 / wl), rng.normal(1000, 30, 1024)
+
+
+def test_csv_round_trip(tmp_path, spectrum):
+    wl, raman, intensity = spectrum
+    path = write_spectrum(str(tmp_path / "s.csv"), wl, intensity, METADATA, raman=raman, fmt="csv")
+    with open(path) as f:
+        lines = f.read().splitlines()
+    assert lines[:3] == ["# exposure_s: 0.5", "# grating: 1", "wavelength_nm,raman_shift,intensity"]
+    data = np.loadtxt(path, delimiter=",", comments="#", skiprows=3)
+    assert np.allclose(data, np.column_stack([wl, raman, intensity]), rtol=1e-9)
+
+
+def test_npz_round_trip(tmp_path, spectrum):
+    wl, _, intensity = spectrum
+    path = write_spectrum(str(tmp_path / "s.npz"), wl, intensity, METADATA, fmt="npz")
+    with np.load(path) as data:
+        assert np.array_equal(data["wavelength_nm"], wl)
+        assert np.array_equal(data["intensity"], intensity)
+        assert "raman_shift" not in data.files
+        assert json.loads(str(data["metadata"])) == METADATA
+
+
+def test_hdf5_appends_rows(tmp_path, spectrum):
+    h5py = pytest.importorskip("h5py")
+    wl, raman, intensity = spectrum
+    path = str(tmp_path / "s.h5")
+    for k in range(3):
+        write_spectrum(path, wl, intensity + k, dict(METADATA, index=k), raman=raman, fmt="hdf5")
+    with h5py.File(path, "r") as f:
+        assert f["intensity"].shape == (3, 1024)
+        assert np.array_equal(f["intensity"][2], intensity + 2)
+        assert np.array_equal(f["raman_shift"][:], raman)
+        assert json.loads(f["metadata"][1])["index"] == 1
+    with pytest.raises(ValueError):
+        write_spectrum(path, wl[:-1], intensity[:-1], METADATA, fmt="hdf5")
+
+
+def test_unknown_format_raises(tmp_path, spectrum):
+    wl, _, intensity = spectrum
+    with pytest.raises(ValueError):
+        write_spectrum(str(tmp_path / "s.txt"), wl, intensity, METADATA, fmt="txt")
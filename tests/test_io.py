@@ -0,0 +1,127 @@
+import os
+import threading
+
+import numpy as np
+import pytest
+from astropy.io import fits
+
+import Spectrometer_IO
+from Spectrometer import AndorCameraController, create_controllers
+from Spectrometer_IO import AsyncImageWriter, calibration_id, decode_spectrum, encode_spectrum
+from Spectrometer_Sim import SimulatedAndorCamera
+
+
+def connected():
+    cam = AndorCameraController(camera_factory=lambda: SimulatedAndorCamera(time_scale=0, seed=0))
+    cam.connect()
+    cam.set_readout_mode("fvb")
+    return cam
+
+
+def test_kinetic_series_fits_round_trip(tmp_path):
+    cam = connected()
+    writer = cam.open_series_writer(12, "series.fits", str(tmp_path))
+    frames, timestamps = cam.acquire_kinetic_series(12, batch_size=5, writer=writer)
+    path = writer.close()
+    with fits.open(path) as hdul:
+        assert hdul[0].data.shape == (12, 1, 1024)
+        assert np.array_equal(hdul[0].data, frames)
+        assert hdul[0].header["EXPOSURE"] == cam.exposure
+        table = hdul["FRAMES"].data
+        assert list(table["FRAME"]) == list(range(12))
+        assert np.allclose(table["TIMESTAMP"], timestamps)
+        assert np.allclose(table["EXPOSURE"], cam.exposure)
+
+
+def test_short_series_is_trimmed(tmp_path):
+    cam = connected()
+    writer = cam.open_series_writer(20, "short.fits", str(tmp_path))
+    frames, _ = cam.acquire_kinetic_series(7, writer=writer)
+    path = writer.close()
+    with fits.open(path) as hdul:
+        assert hdul[0].header["NAXIS3"] == 7
+        assert np.array_equal(hdul[0].data, frames)
+        assert len(hdul["FRAMES"].data) == 7
+    assert os.path.getsize(path) % 2880 == 0
+
+
+def test_recorded_stream_matches_yielded_frames(tmp_path):
+    cam = connected()
+    cam.start_stream(buffer_frames=64)
+    try:
+        path = cam.record_stream(8, "stream.fits", str(tmp_path))
+        cam.cam.wait_for_frame(since="start", nframes=10)
+        yielded = list(cam.iter_stream(max_frames=10))
+    finally:
+        cam.stop_stream()
+    with fits.open(path) as hdul:
+        data = hdul[0].data
+        assert data.shape == (8, 1, 1024)
+        assert list(hdul["FRAMES"].data["FRAME"]) == [index for index, _, _ in yielded[:8]]
+        assert all(np.array_equal(data[k], frame) for k, (_, _, frame) in enumerate(yielded[:8]))
+
+
+def test_async_writer_rejects_when_full_and_flushes(tmp_path, monkeypatch):
+    release = threading.Event()
+    write_fits = Spectrometer_IO.write_fits
+
+    def slow_write(path, image, metadata):
+        release.wait(5)
+        write_fits(path, image, metadata)
+
+    monkeypatch.setattr(Spectrometer_IO, "write_fits", slow_write)
+    writer = AsyncImageWriter(max_queue=2)
+    image = np.arange(12, dtype=np.int32).reshape(3, 4)
+    accepted = [writer.submit(str(tmp_path / f"{k}.fits"), image, {"EXPOSURE": 1.0}, save_preview=False)
+                for k in range(6)]
+    # one image is being written, two wait in the queue
+    assert accepted.count(True) in (2, 3) and writer.rejected == accepted.count(False)
+    release.set()
+    writer.flush()
+    assert writer.status()["pending"] == 0 and writer.written == accepted.count(True)
+    with fits.open(tmp_path / "0.fits") as hdul:
+        assert np.array_equal(hdul[0].data, image)
+        assert hdul[0].header["EXPOSURE"] == 1.0
+    writer.close()
+    assert not writer._thread.is_alive()
+
+
+def test_async_writer_keeps_recent_errors_only(tmp_path):
+    writer = AsyncImageWriter(max_errors=3)
+    for k in range(10):
+        writer.submit(str(tmp_path / "missing" / f"{k}.fits"), np.zeros((2, 2)), {}, save_preview=False, block=True)
+    writer.flush()
+    writer.close()
+    status = writer.status()
+    assert status["errors"] == 10 and len(writer.errors) == 3
+    assert status["last_error"][0].endswith("9.fits")
+
+
+def test_acquired_frames_are_saved_in_the_background(tmp_path):
+    camera, kymera, spec = create_controllers("sim", time_scale=0, seed=0)
+    camera.connect()
+    kymera.setup_from_camera(camera.cam)
+    camera.set_readout_mode("fvb")
+    spec.set_frame_saving(str(tmp_path), save_preview=False)
+    spectrum, _, _ = spec.acquire_spectrum(532.0)
+    camera.close_writer()
+    with fits.open(spec.last_frame_path) as hdul:
+        assert hdul[0].data.shape == (1, 1024)
+        assert np.allclose(hdul[0].data.mean(axis=0), spectrum)
+    spec.set_frame_saving(None)
+    spec.acquire_spectrum(532.0)
+    assert len(list(tmp_path.glob("*.fits"))) == 1
+
+
+def test_binary_spectrum_round_trip():
+    calib_id = calibration_id(np.linspace(540.0, 660.0, 64))
+    counts = np.arange(64, dtype=np.int64) * 1000
+    data, decoded_id = decode_spectrum(encode_spectrum(counts, calib_id))
+    assert data.dtype == np.dtype("<u4") and np.array_equal(data, counts)
+    assert decoded_id == calib_id and len(calib_id) == 16
+    corrected = np.linspace(-5.0, 5.0, 64)
+    data, _ = decode_spectrum(encode_spectrum(corrected, calib_id))
+    assert data.dtype == np.dtype("<f4") and np.allclose(data, corrected)
+    payload = encode_spectrum(counts, calib_id)
+    with pytest.raises(ValueError):
+        decode_spectrum(b"NOPE" + payload[4:])
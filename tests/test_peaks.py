@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+
+import Spectrometer_Peaks
+from Spectrometer_Peaks import PeakTracker, detect_peaks, fit_peaks
+
+
+def lorentzian(x, center, fwhm, amplitude):
+    return amplitude / (1 + ((x - center) / (fwhm / 2)) ** 2)
+
+
+@pytest.fixture
+def spectra():
+    rng = np.random.default_rng(0)
+    x = np.arange(400.0)
+    clean = 100 + lorentzian(x, 250.0, 8.0, 1000.0)
+    return x, clean + rng.normal(0, 3, (20, len(x)))
+
+
+def test_fit_recovers_band(spectra):
+    x, y = spectra
+    result = fit_peaks(y, x, [250])
+    assert result["converged"].all()
+    assert np.median(result["center"]) == pytest.approx(250.0, abs=0.05)
+    assert np.median(result["fwhm"]) == pytest.approx(8.0, rel=0.02)
+
+
+def test_singular_window_does_not_abort_batch(spectra, monkeypatch):
+    x, y = spectra
+
+    def singular(a, b):
+        raise np.linalg.LinAlgError("Singular matrix")
+
+    monkeypatch.setattr(Spectrometer_Peaks.np.linalg, "solve", singular)
+    result = fit_peaks(y, x, [60, 250], profile="gaussian")
+    assert np.isfinite(result["params"]).all()
+    assert np.median(result["center"][:, 1]) == pytest.approx(250.0, abs=0.2)
+
+
+def test_degenerate_window_marked_unconverged(spectra):
+    x, y = spectra
+    y = y.copy()
+    y[0, 40:80] = np.nan
+    result = fit_peaks(y, x, [60, 250], profile="gaussian")
+    assert not result["converged"][0, 0]
+    assert result["converged"][:, 1].all()
+
+
+def test_detected_bands_are_separated_by_the_fit_window(spectra):
+    x, y = spectra
+    peaks = detect_peaks(y[0], min_snr=2)
+    assert (np.abs(np.subtract.outer(peaks, peaks)) + 15 * np.eye(len(peaks)) >= 15).all()
+
+
+def test_tracker_drops_noise_fits():
+    rng = np.random.default_rng(1)
+    x = np.arange(600.0)
+    clean = 100 + lorentzian(x, 150.0, 8.0, 1000.0) + lorentzian(x, 400.0, 12.0, 600.0)
+    y = clean + rng.normal(0, 3, (50, len(x)))
+    detected = detect_peaks(y.mean(axis=0), min_snr=2)
+    tracker = PeakTracker(x, min_snr=2)
+    tracker.update(y)
+    series = tracker.series()
+    assert len(tracker.peaks) < len(detected)
+    assert {150, 400} <= set(np.round(np.median(series["center"], axis=0)))
+    assert (np.median(series["fwhm"], axis=0) >= 1.5).all()
+    assert (np.median(series["amplitude"], axis=0) > 0).all()
@@ -0,0 +1,203 @@
+import numpy as np
+import pytest
+
+from Spectrometer import create_controllers
+from Spectrometer_Processing import (DarkFrameLibrary, SpectrumAccumulator, airpls_baseline, als_baseline,
+                                     clean_frame, clean_spectra, clean_stack, extract_tracks, optimal_extract,
+                                     whittaker_smooth)
+from Spectrometer_Sim import SimulatedRamanSample
+
+SETTINGS = {"read_mode": "fvb", "vsspeed": 0}
+
+
+def test_dark_replacement_removes_old_file(tmp_path):
+    library = DarkFrameLibrary(str(tmp_path))
+    library.add(np.full((1, 8), 300.0), 1.0, SETTINGS, -60.0)
+    library.add(np.full((1, 8), 310.0), 1.01, SETTINGS, -60.0)
+    assert len(library.entries) == 1
+    assert sorted(p.name for p in tmp_path.glob("*.npy")) == [library.entries[0]["file"]]
+    assert np.all(library.match(1.01, SETTINGS, -60.0) == 310.0)
+
+
+def test_dark_interpolates_between_exposures(tmp_path):
+    library = DarkFrameLibrary(str(tmp_path))
+    library.add(np.full((1, 8), 300.0), 1.0, SETTINGS, -60.0)
+    library.add(np.full((1, 8), 320.0), 3.0, SETTINGS, -60.0)
+    reopened = DarkFrameLibrary(str(tmp_path))
+    assert np.allclose(reopened.match(2.0, SETTINGS, -60.5), 310.0)
+    assert reopened.match(5.0, SETTINGS, -60.0) is None
+    assert (reopened.interpolated, reopened.misses) == (1, 1)
+
+
+def _track_image(rng, bias=300.0, background=20.0, rows=32, cols=200, read_noise=4.0):
+    y = np.arange(rows)[:, None]
+    profile = np.exp(-0.5 * ((y - rows / 2) / 2.0) ** 2)
+    profile = np.broadcast_to(profile / profile.sum(), (rows, cols))
+    signal = 5000.0 * profile + background
+    image = bias + rng.poisson(signal) + rng.normal(0, read_noise, (rows, cols))
+    return image, profile
+
+
+def test_optimal_extract_matches_row_mean_with_background():
+    rng = np.random.default_rng(0)
+    image, profile = _track_image(rng)
+    flux, _, _, _ = optimal_extract(image, profile, read_noise=4.0, bias=300.0, include_background=True)
+    assert abs(np.median(flux / image.shape[0] - image.mean(axis=0))) < 2.0
+    bare, _, _, _ = optimal_extract(image, profile, read_noise=4.0, bias=300.0)
+    assert abs(np.median(bare) - 5000.0) < 50.0
+
+
+def test_optimal_extract_variance_excludes_bias():
+    rng = np.random.default_rng(1)
+    images = [_track_image(rng)[0] for _ in range(200)]
+    profile = _track_image(rng)[1]
+    fluxes, variances = zip(*[optimal_extract(image, profile, read_noise=4.0, bias=300.0)[:2]
+                              for image in images])
+    ratio = np.mean(variances, axis=0) / np.var(fluxes, axis=0)
+    assert 0.8 < np.median(ratio) < 1.25
+    with_bias = optimal_extract(images[0], profile, read_noise=4.0)[1]
+    assert np.median(with_bias) > 1.3 * np.median(variances)
+
+
+def sim_controllers(**options):
+    "Cooled sim (no dark current) without cosmic rays, 1 s FVB exposures"
+    camera, kymera, spec = create_controllers("sim", time_scale=0, seed=0, cosmic_rate=0, dark_rate_20c=0,
+                                              **options)
+    camera.connect()
+    kymera.setup_from_camera(camera.cam)
+    camera.set_readout_mode("fvb")
+    camera.set_exposure(1.0)
+    return camera, kymera, spec
+
+
+def inject_hits(data, n, rng):
+    "Add `n` cosmic-ray hits at random pixels; return (data, mask of hit pixels)"
+    data = np.array(data, dtype=float)
+    hits = np.zeros(data.size, dtype=bool)
+    hits[rng.choice(data.size, n, replace=False)] = True
+    hits = hits.reshape(data.shape)
+    data[hits] += rng.uniform(500, 20000, n)
+    return data, hits
+
+
+def test_accumulator_matches_numpy_on_sim_spectra():
+    _, _, spec = sim_controllers()
+    spec.start_accumulation()
+    spectra = np.array([spec.acquire_spectrum(532.0)[0] for _ in range(12)])
+    assert spec.accumulator.count == 12
+    assert np.allclose(spec.accumulator.mean, spectra.mean(axis=0))
+    assert np.allclose(spec.accumulator.variance, spectra.var(axis=0, ddof=1))
+    batched = SpectrumAccumulator()
+    batched.update(spectra[:5])
+    batched.update(spectra[5:])
+    assert np.allclose(batched.mean, spectra.mean(axis=0))
+    assert np.allclose(batched.variance, spectra.var(axis=0, ddof=1))
+
+
+def test_accumulator_restarts_when_settings_change():
+    camera, _, spec = sim_controllers()
+    spec.start_accumulation()
+    for _ in range(3):
+        spec.acquire_spectrum(532.0)
+    camera.set_exposure(0.5)
+    spec.acquire_spectrum(532.0)
+    assert spec.accumulator.count == 1
+
+
+def test_accumulator_restarts_when_readout_changes():
+    camera, _, spec = sim_controllers()
+    spec.start_accumulation()
+    for _ in range(3):
+        spec.acquire_spectrum(532.0)
+    # same 1 x 1024 spectrum shape, different rows on the detector
+    camera.setup_single_mode(center=127, width=20)
+    spec.acquire_spectrum(532.0)
+    assert spec.accumulator.count == 1
+    camera.set_vsspeed(2)
+    spec.acquire_spectrum(532.0)
+    assert spec.accumulator.count == 1
+
+
+def test_ema_accumulator_follows_drift():
+    accumulator = SpectrumAccumulator(ema_alpha=0.1)
+    for level in np.linspace(0, 100, 200):
+        accumulator.update(np.full(8, level))
+    assert np.allclose(accumulator.mean, 100, atol=10)
+    assert accumulator.effective_count == pytest.approx(19)
+
+
+def test_baselines_recover_sim_fluorescence():
+    camera, _, spec = sim_controllers()
+    spectrum = np.mean([spec.acquire_spectrum(532.0)[0] for _ in range(4)], axis=0)
+    sim = camera.cam
+    sim.sample = SimulatedRamanSample(bands=[])
+    truth = sim._expected_electrons(1.0)[0][0] / sim.gain + sim.bias
+    for method in (als_baseline, airpls_baseline):
+        error = np.abs(method(spectrum, lam=1e5) - truth)
+        # bands reach ~4000 counts above the background; the noise of the mean is ~13 counts
+        assert np.median(error) < 25
+        assert np.percentile(error, 95) < 80
+
+
+def test_banded_smoothers_match_dense_solve():
+    rng = np.random.default_rng(2)
+    y = np.cumsum(rng.normal(size=(3, 200)), axis=1) + 50 * np.exp(-0.5 * ((np.arange(200) - 80) / 3) ** 2)
+    lam = 1e4
+    d = np.diff(np.eye(200), 2, axis=0)
+    penalty = lam * d.T @ d
+    dense = np.linalg.solve(np.eye(200) + penalty, y.T).T
+    assert np.allclose(whittaker_smooth(y, lam), dense)
+    weights = np.where(y > dense, 0.01, 0.99)
+    weighted = np.array([np.linalg.solve(np.diag(w) + penalty, w * row) for w, row in zip(weights, y)])
+    assert np.allclose(als_baseline(y, lam, p=0.01, niter=1), weighted)
+
+
+def test_cosmic_rays_detected_in_sim_data():
+    camera, _, _ = sim_controllers()
+    rng = np.random.default_rng(5)
+    frames, _ = camera.acquire_kinetic_series(10)
+    clean = frames[:, 0, :].astype(float)
+    noise = {"read_noise": 4.0, "bias": 300.0}
+
+    stack, hits = inject_hits(clean, 20, rng)
+    cleaned, mask = clean_stack(stack, **noise)
+    assert mask[hits].all() and (mask & ~hits).sum() <= 2
+    assert np.abs(cleaned - clean)[hits].max() < 100
+
+    spectra, hits = inject_hits(clean, 20, rng)
+    for options in (noise, {}):
+        mask = clean_spectra(spectra, **options)[1]
+        assert mask[hits].all() and (mask & ~hits).sum() <= 3
+
+    camera.set_readout_mode("image")
+    image, hits = inject_hits(camera.acquire_single(), 20, rng)
+    mask = clean_frame(image, **noise)[1]
+    assert mask[hits].all() and (mask & ~hits).sum() <= 3
+
+
+def test_extract_tracks_rows_and_bands():
+    image = np.arange(24, dtype=float).reshape(6, 4)
+    tracks = extract_tracks(image)
+    assert np.array_equal(tracks, image)
+    tracks[0] = 0
+    assert image[0, 1] == 1  # rows are copied, not views
+    tracks = extract_tracks(image, bands=[(0, 2), (3, 6)])
+    assert np.allclose(tracks, [image[0:2].sum(axis=0), image[3:6].sum(axis=0)])
+    tracks = extract_tracks(image, bands=[(0, 2), (3, 6)], background=[1.0, 2.0])
+    assert np.allclose(tracks[:, 0], [image[0:2, 0].sum() - 1, image[3:6, 0].sum() - 2])
+    background = np.ones((2, 4))
+    assert np.allclose(extract_tracks(image, bands=[(0, 2), (3, 6)], background=background),
+                       extract_tracks(image, bands=[(0, 2), (3, 6)]) - 1)
+
+
+def test_multi_track_spectra_share_the_calibration_axis():
+    camera, kymera, spec = sim_controllers()
+    camera.setup_multi_mode(number=3, height=20, offset=0)
+    kymera.setup_from_camera(camera.cam)
+    tracks, wl, raman = spec.acquire_tracks(532.0)
+    assert tracks.shape == (3, len(wl)) and len(raman) == len(wl)
+    spec.acquire_track_background(n_frames=2)
+    assert spec.track_background.shape == tracks.shape
+    corrected, _, _ = spec.acquire_tracks(532.0)
+    # the background frames had the same signal, so little is left after subtraction
+    assert np.median(np.abs(corrected)) < np.median(np.abs(tracks))
@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+
+from Spectrometer import create_controllers
+from Spectrometer_Scan import stitch_windows
+
+
+def synthetic_windows(gains, offsets, rng):
+    def truth(wl):
+        return 1000 + 800 * np.exp(-0.5 * ((wl - 560) / 3) ** 2) + 500 * np.exp(-0.5 * ((wl - 585) / 2) ** 2)
+
+    windows = []
+    for k, (gain, offset) in enumerate(zip(gains, offsets)):
+        wl = np.linspace(540 + 20 * k, 570 + 20 * k, 300)
+        windows.append((wl, (truth(wl) - offset) / gain + rng.normal(0, 1, len(wl))))
+    return windows, truth
+
+
+def test_stitch_recovers_gain_and_offset():
+    rng = np.random.default_rng(0)
+    windows, truth = synthetic_windows([1.0, 1.3, 0.8], [0.0, 150.0, -80.0], rng)
+    axis, merged, scales, offsets = stitch_windows(windows)
+    assert scales == pytest.approx([1.0, 1.3, 0.8], rel=0.02)
+    assert offsets == pytest.approx([0.0, 150.0, -80.0], abs=20)
+    assert np.abs(merged - truth(axis)).max() < 10
+
+
+def test_offset_only_windows_do_not_become_gain_errors():
+    rng = np.random.default_rng(1)
+    windows, _ = synthetic_windows([1.0, 1.0, 1.0], [0.0, -400.0, -900.0], rng)
+    _, _, scales, _ = stitch_windows(windows)
+    assert scales == pytest.approx([1.0, 1.0, 1.0], rel=0.02)
+    _, _, gain_only, _ = stitch_windows(windows, match_offset=False)
+    assert abs(gain_only[2] - 1) > 0.2
+
+
+def test_acquire_stitched_restores_grating_and_trims():
+    camera, kymera, spec = create_controllers("sim", time_scale=0, seed=0)
+    camera.connect()
+    kymera.setup_from_camera(camera.cam)
+    camera.set_readout_mode("fvb")
+    start = kymera.get_central_wavelength()
+    spectrum, wl, raman = spec.acquire_stitched(540.0, 840.0, 532.0)
+    assert kymera.get_central_wavelength() == pytest.approx(start, abs=0.1)
+    assert wl[0] >= 540.0 and wl[-1] <= 840.0
+    assert wl[-1] - wl[0] > 0.98 * 300.0
+    assert len(spec.last_scan["centers"]) > 1
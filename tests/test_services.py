@@ -0,0 +1,181 @@
+import threading
+import time
+import types
+
+import numpy as np
+import pytest
+
+from Spectrometer import create_controllers
+from Spectrometer_Services import AcquisitionJobQueue, SpectrumBroadcaster, Subscription, TelemetryPoller
+
+
+def sim_controllers():
+    camera, kymera, spec = create_controllers("sim", time_scale=0, seed=0, cosmic_rate=0, dark_rate_20c=0)
+    camera.connect()
+    kymera.setup_from_camera(camera.cam)
+    camera.set_readout_mode("fvb")
+    return camera, kymera, spec
+
+
+def test_subscription_drops_oldest_when_full():
+    sub = Subscription(maxlen=3)
+    for i in range(5):
+        sub.put(i)
+    assert sub.dropped == 2
+    assert [sub.get(timeout=0) for _ in range(3)] == [2, 3, 4]
+    assert sub.get(timeout=0.01) is None
+    sub.close()
+    assert sub.get() is None  # closed: returns at once instead of blocking
+
+
+def test_slow_subscriber_does_not_hold_back_others():
+    _, _, spec = sim_controllers()
+    broadcaster = SpectrumBroadcaster(spec, formatter=lambda item: item["frame"], queue_size=2)
+    slow, fast = broadcaster.subscribe(), broadcaster.subscribe(maxlen=10)
+    for i in range(6):
+        broadcaster.publish({"frame": i})
+    assert [fast.get(timeout=0) for _ in range(6)] == list(range(6))
+    assert [slow.get(timeout=0) for _ in range(2)] == [4, 5]
+    status = broadcaster.status()
+    assert status["published"] == 6 and status["subscribers"] == 2 and status["dropped"] == 4
+    broadcaster.unsubscribe(slow)
+    assert slow.closed and broadcaster.status()["subscribers"] == 1
+
+
+def test_live_spectra_use_the_controller_corrections():
+    _, _, spec = sim_controllers()
+    spec.set_baseline_removal("als")
+    single, _, _ = spec.acquire_spectrum(532.0)
+    broadcaster = SpectrumBroadcaster(spec)
+    sub = broadcaster.subscribe()
+    broadcaster.start(532.0)
+    try:
+        item = sub.get(timeout=5)
+    finally:
+        broadcaster.stop()
+    assert broadcaster.error is None
+    live = item["intensity"]
+    # the baseline (bias and fluorescence, several hundred counts) is removed as in acquire_spectrum
+    assert abs(np.median(live)) < 20
+    assert abs(np.median(live - single)) < 20
+
+
+class RecordingSpec:
+    "Controller stand-in that records the order of acquisitions and can be held back"
+    def __init__(self):
+        self.camera = types.SimpleNamespace(streaming=False)
+        self.calls = []
+        self.gate = threading.Event()
+        self.gate.set()
+
+    def acquire_spectrum(self, laser_wl):
+        self.gate.wait(5)
+        self.calls.append(laser_wl)
+        if laser_wl < 0:
+            raise ValueError("bad laser")
+        return np.full(4, laser_wl), np.arange(4.0), np.arange(4.0)
+
+
+def test_jobs_run_in_submission_order():
+    spec = RecordingSpec()
+    jobs = AcquisitionJobQueue(spec)
+    ids = [jobs.submit(float(k)) for k in range(10)]
+    results = [jobs.wait(job_id, timeout=5) for job_id in ids]
+    assert spec.calls == [float(k) for k in range(10)]
+    assert all(job["state"] == "done" for job in results)
+    assert [job["result"][0][0] for job in results] == spec.calls
+    assert jobs.last_result()[0][0] == 9.0
+
+
+def test_finished_jobs_are_evicted_least_recently_used_first():
+    jobs = AcquisitionJobQueue(RecordingSpec(), max_results=3)
+    ids = [jobs.submit(float(k)) for k in range(4)]
+    jobs.wait(ids[-1], timeout=5)
+    assert jobs.get(ids[0]) is None
+    jobs.get(ids[1])  # touched, so ids[2] is now the oldest
+    jobs.wait(jobs.submit(4.0), timeout=5)
+    assert jobs.get(ids[1]) is not None and jobs.get(ids[2]) is None
+    assert jobs.status()["stored"] == 3
+
+
+def test_long_poll_times_out_on_running_job():
+    spec = RecordingSpec()
+    spec.gate.clear()
+    jobs = AcquisitionJobQueue(spec)
+    job_id = jobs.submit(1.0)
+    start = time.monotonic()
+    job = jobs.wait(job_id, timeout=0.2)
+    assert 0.15 < time.monotonic() - start < 2
+    assert job["finished"] is None and jobs.busy()
+    spec.gate.set()
+    assert jobs.wait(job_id, timeout=5)["state"] == "done"
+    assert not jobs.busy()
+
+
+def test_failed_and_streaming_jobs_report_errors():
+    spec = RecordingSpec()
+    jobs = AcquisitionJobQueue(spec)
+    assert "bad laser" in jobs.wait(jobs.submit(-1.0), timeout=5)["error"]
+    spec.camera.streaming = True
+    job = jobs.wait(jobs.submit(1.0), timeout=5)
+    assert job["state"] == "error" and "streaming" in job["error"]
+    assert spec.calls == [-1.0]
+
+
+class CountingKymera:
+    def __init__(self):
+        self.polls = 0
+
+    def get_status(self):
+        self.polls += 1
+        return {"wavelength_nm": 600.0}
+
+
+def test_telemetry_snapshot_and_refresh():
+    camera, _, _ = sim_controllers()
+    kymera = CountingKymera()
+    poller = TelemetryPoller(camera, kymera, kymera_interval=3600)
+    assert poller.snapshot().camera_time is None
+    snap = poller.poll_once()
+    assert snap is poller.snapshot() and snap.error is None
+    assert "temperature" in snap.camera and "temperature_status" in snap.camera
+    assert snap.kymera["wavelength_nm"] == 600.0 and kymera.polls == 1
+    with pytest.raises(TypeError):
+        snap.camera["temperature"] = 0  # snapshots are read-only
+    poller.poll_once()
+    assert kymera.polls == 1  # spectrograph is only polled when stale or refreshed
+    poller.refresh()
+    poller.poll_once()
+    assert kymera.polls == 2
+    assert camera.temperature_history.query()["count"].sum() >= 1  # polls feed the temperature history
+
+
+def test_telemetry_keeps_last_good_values_on_error():
+    camera, _, _ = sim_controllers()
+    kymera = CountingKymera()
+    poller = TelemetryPoller(camera, kymera)
+    good = poller.poll_once()
+
+    def fail():
+        raise RuntimeError("USB gone")
+    camera.get_status = fail
+    snap = poller.poll_once()
+    assert snap.error.startswith("camera:") and "USB gone" in snap.error
+    assert snap.camera is good.camera and snap.camera_time == good.camera_time
+
+
+def test_telemetry_thread_wakes_on_refresh():
+    camera, _, _ = sim_controllers()
+    kymera = CountingKymera()
+    poller = TelemetryPoller(camera, kymera, interval=60, kymera_interval=3600)
+    poller.start()
+    try:
+        deadline = time.time() + 5
+        while kymera.polls < 1 and time.time() < deadline:
+            time.sleep(0.01)
+        poller.refresh()
+        while kymera.polls < 2 and time.time() < deadline:
+            time.sleep(0.01)
+    finally:
+        poller.stop()
+    assert kymera.polls == 2
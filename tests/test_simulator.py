@@ -0,0 +1,56 @@
+import time
+
+import pytest
+
+from Spectrometer import create_controllers
+
+
+def test_sim_options_go_to_the_devices_that_take_them():
+    camera, kymera, _ = create_controllers("sim", time_scale=0.001, seed=1, track_centers=[50, 150], bias=100,
+                                           spectrograph_options={"wavelength_nm": 550.0})
+    camera.connect()
+    assert camera.cam.track_centers == [50, 150]
+    assert camera.cam.bias == 100
+    assert camera.cam.time_scale == kymera.spec.time_scale == 0.001
+    assert kymera.spec.get_wavelength() == pytest.approx(550e-9)
+
+
+def test_unknown_sim_option_raises():
+    with pytest.raises(TypeError):
+        create_controllers("sim", bogus=1)
+
+
+def test_zero_time_scale_is_instant_virtual_time():
+    camera, kymera, spec = create_controllers("sim", time_scale=0, seed=0)
+    camera.connect()
+    kymera.setup_from_camera(camera.cam)
+    camera.set_readout_mode("fvb")
+    camera.set_exposure(10.0)
+    start = time.monotonic()
+    kymera.set_central_wavelength(700.0)
+    image = camera.acquire_single()
+    frames, timestamps = camera.acquire_kinetic_series(20)
+    assert time.monotonic() - start < 5
+    assert image.shape == (1, 1024)
+    assert (frames.sum(axis=(1, 2)) > 0).all()
+    assert camera.cam._now() >= 21 * 10.0
+
+
+def test_negative_time_scale_raises():
+    with pytest.raises(ValueError):
+        create_controllers("sim", time_scale=-1)[0].connect()
+
+
+def test_snap_switches_to_continuous_mode(camera):
+    camera.cam.setup_accum_mode(3)
+    camera.cam.snap()
+    assert camera.cam.get_acquisition_mode() == "cont"
+
+
+def test_roi_always_selects_image_readout(camera):
+    camera.cam.set_read_mode("fvb")
+    camera.cam.set_roi(hbin=4)
+    assert camera.cam.get_read_mode() == "image"
+    assert camera.cam.get_data_dimensions() == (255, 256)
+    camera.set_fvb()
+    assert camera.cam.get_data_dimensions() == (1, 1024)
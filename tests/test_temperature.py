@@ -0,0 +1,52 @@
+import numpy as np
+
+from Spectrometer import TemperatureHistory
+
+
+def history(times, capacity=16, temperatures=None):
+    h = TemperatureHistory(capacity=capacity, min_interval=0)
+    temperatures = times if temperatures is None else temperatures
+    for t, temp in zip(times, temperatures):
+        h.record(temp, "stabilized" if temp < 0 else "off", temp < 0, "low", timestamp=t)
+    return h
+
+
+def test_last_filled_bin_includes_newest_sample():
+    result = history([10, 20, 30]).query(0, 110, 2)
+    assert list(result["count"]) == [3, 0]
+    assert result["temperature_mean"][0] == 20
+    assert (result["temperature_min"][0], result["temperature_max"][0]) == (10, 30)
+    assert np.isnan(result["temperature_mean"][1])
+
+
+def test_bins_match_per_bin_statistics():
+    rng = np.random.default_rng(0)
+    times = np.sort(rng.uniform(0, 100, 60))
+    temps = rng.normal(-60, 2, 60)
+    result = history(times, capacity=64, temperatures=temps).query(0, 100, 7)
+    edges = np.linspace(0, 100, 8)
+    for k in range(7):
+        inside = (times >= edges[k]) & (times < edges[k + 1])
+        assert result["count"][k] == inside.sum()
+        if inside.any():
+            assert np.isclose(result["temperature_mean"][k], temps[inside].astype(np.float32).mean())
+            assert np.isclose(result["temperature_max"][k], temps[inside].astype(np.float32).max())
+            assert np.isclose(result["temperature_min"][k], temps[inside].astype(np.float32).min())
+
+
+def test_ring_wraps_to_the_newest_samples():
+    h = history(np.arange(40.0), capacity=16)
+    result = h.query(None, 100, 4)
+    assert result["time"][0] == 24
+    assert result["count"].sum() == 16
+    full = h.query(0, 100, 1)
+    assert full["count"][0] == 16
+    assert full["temperature_min"][0] == 24 and full["temperature_max"][0] == 39
+
+
+def test_empty_range_has_no_samples():
+    result = history([10, 20, 30]).query(100, 200, 5)
+    assert (result["count"] == 0).all()
+    assert np.isnan(result["temperature_mean"]).all()
+    assert (result["status"] == -1).all()
+    assert TemperatureHistory().query(0, 10, 3)["count"].sum() == 0